@@ -4,75 +4,169 @@ from pathlib import PurePath
 
 import Metashape
 
+from resource_profile import ResourceProfile
+from stage_state import StageState
+from stage_telemetry import StageTelemetry
+
 
 class CreateOrthomosaic:
     """
     Class to generate an orthomosaic for a existing Metashape project.
-    """
-    EXPORT_IMAGE_TYPE = '.tif'
 
-    WGS_84 = Metashape.CoordinateSystem("EPSG::4326")
+    The orthomosaic is built on the mesh by default, or on the DEM, which
+    skips building the mesh. DEM and orthomosaic are built and exported in
+    the project CRS, or a given CRS, with the resolution in units of that
+    CRS. The export can be split into tiles of a given block size.
 
-    # Degree using EPSG:4326
-    X_1M_IN_DEG = 1.13747e-05
-    Y_1M_IN_DEG = 9.0094e-06
+    Uses the raster API of Metashape 1.6 to 1.8, i.e. OrthoProjection,
+    'resolution' and 'exportRaster'.
 
-    # Degree using EPSG:4326
-    X_5M_IN_DEG = 5.76345e-05
-    Y_5M_IN_DEG = 4.50396e-05
+    Completed stages are recorded with StageState and skipped on a re-run
+    when their outputs are present. Each stage is measured with
+    StageTelemetry.
+    """
+    EXPORT_IMAGE_TYPE = '.tif'
+    EXPORT_STAGE = ResourceProfile.EXPORT_STAGE
 
-    EXPORT_DEFAULTS = dict(
-        image_format=Metashape.ImageFormat.ImageFormatTIFF,
-        projection=WGS_84,
-        dx=X_1M_IN_DEG,
-        dy=Y_1M_IN_DEG,
-    )
+    MODEL_SURFACE = 'model'
+    DEM_SURFACE = 'dem'
+
+    @staticmethod
+    def export_defaults():
+        compression = Metashape.ImageCompression()
+        compression.tiff_big = True
+
+        return dict(
+            source_data=Metashape.DataSource.OrthomosaicData,
+            image_format=Metashape.ImageFormat.ImageFormatTIFF,
+            image_compression=compression,
+        )
 
     def __init__(self, options):
         self.project_file = PurePath(options.project_file)
 
-        self.setup_application()
+        self.setup_application(options)
 
         self.project = Metashape.app.document
         self.project.open(self.project_file.as_posix())
         self.chunk = self.project.chunk
 
+        self.state = StageState(
+            self.project_file.with_suffix('').as_posix()
+        )
+        self.telemetry = StageTelemetry(
+            self.project_file.with_suffix('').as_posix(), 'create_orthomosaic'
+        )
+
     @property
     def project_file_name(self):
         return self.project_file.stem
 
-    @staticmethod
-    def setup_application():
-        app = Metashape.Application()
-        number_of_gpus = len(Metashape.app.enumGPUDevices())
-        mask = int(str('1' * number_of_gpus).rjust(8, '0'), 2)
-        app.gpu_mask = mask
-        app.cpu_enable = False
+    def setup_application(self, options):
+        self.resources = ResourceProfile.from_arguments(options)
+        self.resources.apply()
+        print(self.resources.describe())
 
         settings = Metashape.Application.Settings()
         settings.log_enable = False
         settings.save()
 
-    def process(self, options):
-        self.chunk.buildDem()
-        self.project.save()
+    @staticmethod
+    def raster_options(options):
+        """
+        Projection and resolution for building and exporting rasters.
+        Metashape uses the project CRS and the native resolution for
+        options that are not set.
+        """
+        raster_options = {}
+        if options.crs:
+            projection = Metashape.OrthoProjection()
+            projection.crs = Metashape.CoordinateSystem(options.crs)
+            raster_options['projection'] = projection
+        if options.resolution:
+            raster_options['resolution'] = options.resolution
+
+        return raster_options
+
+    def build_dem(self, options, progress=None):
+        self.chunk.buildDem(
+            progress=progress,
+            **self.raster_options(options)
+        )
+
+    def build_orthomosaic(self, options, progress=None):
+        surface = {}
+        if options.surface == self.DEM_SURFACE:
+            surface['surface_data'] = Metashape.DataSource.ElevationData
 
-        self.chunk.buildModel()
-        self.project.save()
         self.chunk.buildOrthomosaic(
             fill_holes=False,
+            progress=progress,
+            **surface,
+            **self.raster_options(options)
+        )
+
+    def export_orthomosaic(self, options, progress=None):
+        blocks = {}
+        if options.block_size:
+            blocks = dict(
+                split_in_blocks=True,
+                block_width=options.block_size,
+                block_height=options.block_size,
+            )
+
+        self.chunk.exportRaster(
+            path=str(
+                self.project_file.with_suffix(self.EXPORT_IMAGE_TYPE)
+            ),
+            progress=progress,
+            **blocks,
+            **self.raster_options(options),
+            **self.export_defaults()
         )
-        self.project.save()
+
+    def run_stage(self, options, stage, is_valid, action):
+        chunk = self.chunk
+        self.resources.apply(stage)
+        completed = self.state.run(
+            self.project, chunk, stage, is_valid,
+            lambda: self.telemetry.measure(chunk, stage, action),
+            save=not options.skip_intermediate_saves,
+        )
+        if not completed:
+            self.telemetry.skipped(chunk, stage)
+
+    def process(self, options):
+        chunk = self.chunk
+
+        self.run_stage(
+            options, StageState.DEM,
+            lambda: chunk.elevation is not None,
+            lambda progress: self.build_dem(options, progress),
+        )
+        if options.surface == self.MODEL_SURFACE:
+            self.run_stage(
+                options, StageState.MODEL,
+                lambda: chunk.model is not None,
+                lambda progress: chunk.buildModel(progress=progress),
+            )
+        self.run_stage(
+            options, StageState.ORTHOMOSAIC,
+            lambda: chunk.orthomosaic is not None,
+            lambda progress: self.build_orthomosaic(options, progress),
+        )
+        if options.skip_intermediate_saves:
+            self.project.save()
 
         if options.with_export:
-            self.chunk.exportOrthomosaic(
-                path=str(
-                    self.project_file.with_suffix(self.EXPORT_IMAGE_TYPE)
-                ),
-                tiff_big=True,
-                **self.EXPORT_DEFAULTS
+            self.resources.apply(self.EXPORT_STAGE)
+            self.telemetry.measure(
+                chunk, self.EXPORT_STAGE,
+                lambda progress: self.export_orthomosaic(options, progress),
             )
 
+        self.telemetry.print_report()
+
 
 def argument_parser():
     parser = argparse.ArgumentParser()
@@ -86,6 +180,39 @@ def argument_parser():
         action='store_true',
         help='Flag to also export as .tif'
     )
+    parser.add_argument(
+        '--surface',
+        choices=[
+            CreateOrthomosaic.MODEL_SURFACE, CreateOrthomosaic.DEM_SURFACE,
+        ],
+        default=CreateOrthomosaic.MODEL_SURFACE,
+        help='Surface to build the orthomosaic on. Building on the DEM skips '
+             'building the mesh. Default: model',
+    )
+    parser.add_argument(
+        '--crs',
+        help='CRS to build and export DEM and orthomosaic in, '
+             'i.e. EPSG::32613. Default: Project CRS',
+    )
+    parser.add_argument(
+        '--resolution',
+        type=float,
+        help='Resolution of DEM and orthomosaic in units of the CRS. '
+             'Default: Native resolution',
+    )
+    parser.add_argument(
+        '--block-size',
+        type=int,
+        help='Split the exported orthomosaic into tiles of this size in '
+             'pixels',
+    )
+    parser.add_argument(
+        '--skip-intermediate-saves',
+        action='store_true',
+        help='Only save the project once all stages completed',
+    )
+
+    ResourceProfile.add_arguments(parser)
 
     return parser
 
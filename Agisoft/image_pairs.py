@@ -0,0 +1,284 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class ImagePairs:
+    """
+    Pre-select image pairs for matching from the camera positions in the
+    reference file.
+
+    Images are assumed to be nadir. The footprint of each image is
+    approximated with the circle around the camera position enclosing the
+    image corners on flat ground. Two images are a pair when these circles
+    overlap. Candidates are the nearest neighbors from a KD-tree over the
+    camera positions, projected to meters around the center of the flight.
+
+    The pairs are cached next to the reference file, with the content hash
+    of the reference file and the camera model as key.
+    """
+    VERSION = 1
+    CACHE_FILE = 'image_pairs.npz'
+
+    # Meters per degree latitude and longitude at the equator
+    METERS_PER_DEGREE_LAT = 110540.0
+    METERS_PER_DEGREE_LON = 111320.0
+
+    # Scale for the footprint radius, larger values add more pairs
+    OVERLAP_FACTOR = 1.0
+    # Maximum number of nearest images paired with each image
+    NEIGHBOR_LIMIT = 40
+
+    def __init__(self, reference_file, focal_length, sensor_width,
+                 sensor_height, ground_elevation=0.0,
+                 overlap_factor=OVERLAP_FACTOR,
+                 neighbor_limit=NEIGHBOR_LIMIT):
+        """
+        :param reference_file: Path to images_metadata.csv
+        :param focal_length: Focal length of the camera in mm
+        :param sensor_width: Sensor size across flight direction in mm
+        :param sensor_height: Sensor size along flight direction in mm
+        :param ground_elevation: Elevation of the ground in meters
+        :param overlap_factor: Scale for the footprint radius
+        :param neighbor_limit: Maximum number of pairs for each image
+        """
+        self.reference_file = reference_file
+        self.cache_file = os.path.join(
+            os.path.dirname(reference_file), self.CACHE_FILE
+        )
+        self.camera_model = dict(
+            focal_length=focal_length,
+            sensor_width=sensor_width,
+            sensor_height=sensor_height,
+            ground_elevation=ground_elevation,
+            overlap_factor=overlap_factor,
+            neighbor_limit=neighbor_limit,
+        )
+
+    def cache_key(self):
+        content_hash = hashlib.sha256()
+        with open(self.reference_file, 'rb') as reference:
+            for block in iter(lambda: reference.read(2 ** 20), b''):
+                content_hash.update(block)
+
+        return dict(
+            version=self.VERSION,
+            hash=content_hash.hexdigest(),
+            **self.camera_model
+        )
+
+    @staticmethod
+    def read_cameras(reference_file):
+        """
+        :return: Tuple of image file names and arrays with longitude,
+                 latitude and altitude. Missing values are NaN.
+        """
+        names, values = [], []
+        with open(reference_file, 'r') as reference:
+            rows = csv.reader(reference)
+            next(rows)  # Skip header
+            for row in rows:
+                names.append(row[0])
+                values.append([
+                    float(value) if value else np.nan for value in row[1:4]
+                ])
+
+        values = np.array(values, dtype=float).reshape(-1, 3)
+        return names, values[:, 0], values[:, 1], values[:, 2]
+
+    @classmethod
+    def positions(cls, lon, lat):
+        """
+        Project longitude and latitude to meters around the center.
+        """
+        center_lat = np.nanmean(lat)
+        x = (lon - np.nanmean(lon)) * \
+            cls.METERS_PER_DEGREE_LON * np.cos(np.radians(center_lat))
+        y = (lat - center_lat) * cls.METERS_PER_DEGREE_LAT
+        return np.column_stack([x, y])
+
+    def footprint_radius(self, altitude):
+        """
+        Radius of the circle enclosing the image corners on the ground.
+        Images without altitude use the median of all images.
+        """
+        height = altitude - self.camera_model['ground_elevation']
+        height[np.isnan(height)] = np.nanmedian(height)
+
+        half_diagonal = np.hypot(
+            self.camera_model['sensor_width'],
+            self.camera_model['sensor_height'],
+        ) / 2
+        return height * half_diagonal / self.camera_model['focal_length'] * \
+            self.camera_model['overlap_factor']
+
+    def find_pairs(self):
+        """
+        :return: Tuple of the image file names and an array with index pairs
+                 into the names for images with overlapping footprints
+        """
+        # Only needed when the pairs are not cached
+        from scipy.spatial import cKDTree
+
+        names, lon, lat, altitude = self.read_cameras(self.reference_file)
+        index = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+
+        positions = self.positions(lon[index], lat[index])
+        radius = self.footprint_radius(altitude[index])
+
+        tree = cKDTree(positions)
+        distance, neighbor = tree.query(
+            positions,
+            # Always as list for a two dimensional result, includes the image
+            k=list(range(1, self.camera_model['neighbor_limit'] + 2)),
+            distance_upper_bound=2 * radius.max(),
+        )
+        image = np.broadcast_to(
+            np.arange(len(index))[:, np.newaxis], neighbor.shape
+        )
+        # Missing neighbors have an infinite distance and index out of range
+        found = (neighbor < len(index)) & (image != neighbor)
+        image, neighbor = image[found], neighbor[found]
+        overlapping = distance[found] < radius[image] + radius[neighbor]
+
+        pairs = np.sort(
+            np.column_stack([image, neighbor])[overlapping], axis=1
+        )
+        return names, index[np.unique(pairs, axis=0)].astype(np.int32)
+
+    def load(self, key):
+        if not os.path.exists(self.cache_file):
+            return None
+
+        try:
+            with np.load(self.cache_file) as cache:
+                if json.loads(str(cache['key'])) != key:
+                    return None
+                return cache['names'].tolist(), cache['pairs']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, key, names, pairs):
+        # Keep the file ending, numpy adds it otherwise
+        temp_file = self.cache_file + '.' + str(os.getpid()) + '.tmp.npz'
+        np.savez(
+            temp_file, key=json.dumps(key), names=np.array(names), pairs=pairs
+        )
+        os.replace(temp_file, self.cache_file)
+
+    def pairs(self):
+        """
+        Cached pairs when the reference file and camera model match,
+        computed and cached otherwise.
+
+        :return: Tuple of the image file names and an array with index pairs
+                 into the names
+        """
+        key = self.cache_key()
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+
+        names, pairs = self.find_pairs()
+        try:
+            self.save(key, names, pairs)
+        except OSError as error:
+            print('**** Could not write image pairs: ' + str(error))
+
+        return names, pairs
+
+    def camera_pairs(self, cameras):
+        """
+        Translate the image pairs to keys of the given Metashape cameras,
+        matched by the image file name. Pairs of images that are not in the
+        chunk are left out.
+
+        :param cameras: List of Metashape cameras
+        :return: List of camera key tuples
+        """
+        camera_keys = {
+            os.path.basename(camera.photo.path): camera.key
+            for camera in cameras if camera.photo is not None
+        }
+        names, pairs = self.pairs()
+        keys = np.array([camera_keys.get(name, -1) for name in names])
+
+        pairs = keys[pairs]
+        pairs = pairs[(pairs >= 0).all(axis=1)]
+        return [(first, second) for first, second in pairs.tolist()]
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description='Cache the image pairs for matching ahead of processing.'
+    )
+    parser.add_argument(
+        '--reference-file',
+        required=True,
+        help='Full path to the images_metadata.csv',
+    )
+    parser.add_argument(
+        '--focal-length',
+        type=float,
+        required=True,
+        help='Focal length of the camera in mm',
+    )
+    parser.add_argument(
+        '--sensor-width',
+        type=float,
+        required=True,
+        help='Sensor size across flight direction in mm',
+    )
+    parser.add_argument(
+        '--sensor-height',
+        type=float,
+        required=True,
+        help='Sensor size along flight direction in mm',
+    )
+    parser.add_argument(
+        '--ground-elevation',
+        type=float,
+        default=0.0,
+        help='Elevation of the ground in meters. Default: 0',
+    )
+    parser.add_argument(
+        '--overlap-factor',
+        type=float,
+        default=ImagePairs.OVERLAP_FACTOR,
+        help='Scale for the footprint radius, larger values add more pairs. '
+             'Default: ' + str(ImagePairs.OVERLAP_FACTOR),
+    )
+    parser.add_argument(
+        '--neighbor-limit',
+        type=int,
+        default=ImagePairs.NEIGHBOR_LIMIT,
+        help='Maximum number of pairs for each image. '
+             'Default: ' + str(ImagePairs.NEIGHBOR_LIMIT),
+    )
+
+    return parser
+
+
+# Example command line execution, to cache the pairs outside of Metashape:
+#
+# python image_pairs.py \
+#        --reference-file /project/root/path/images_metadata.csv \
+#        --focal-length 50 --sensor-width 53.4 --sensor-height 40.0 \
+#        --ground-elevation 2500
+#
+if __name__ == '__main__':
+    arguments = argument_parser().parse_args()
+    image_pairs = ImagePairs(
+        arguments.reference_file,
+        arguments.focal_length,
+        arguments.sensor_width,
+        arguments.sensor_height,
+        arguments.ground_elevation,
+        arguments.overlap_factor,
+        arguments.neighbor_limit,
+    )
+    print('Image pairs: ' + str(len(image_pairs.pairs()[1])))
@@ -0,0 +1,109 @@
+import argparse
+import math
+
+import numpy as np
+
+from image_pairs import ImagePairs
+
+
+class ImageTiles:
+    """
+    Partition the images into tiles by their camera position in the
+    reference file. The extent of all images is split evenly into tiles no
+    larger than the tile size, to avoid narrow tiles at the edges. Each
+    tile is extended by an overlap on all sides, so images near a tile edge
+    are part of the neighboring tiles too and the processed tiles can be
+    aligned to each other.
+
+    Tiles without images are left out and the remaining ones are numbered
+    row by row, starting with the south-west tile. Images without a
+    position in the reference file are not part of any tile.
+    """
+    TILE_OVERLAP = 200.0
+
+    def __init__(self, reference_file, tile_size, tile_overlap=TILE_OVERLAP):
+        """
+        :param reference_file: Path to images_metadata.csv
+        :param tile_size: Maximum length of a tile side in meters
+        :param tile_overlap: Extent added to each tile side in meters
+        """
+        self.reference_file = reference_file
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+
+    def tiles(self):
+        """
+        :return: List with the image file names for each tile
+        """
+        names, lon, lat, _altitude = ImagePairs.read_cameras(
+            self.reference_file
+        )
+        index = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+        names = np.array(names)[index]
+        if len(index) == 0:
+            return []
+
+        positions = ImagePairs.positions(lon[index], lat[index])
+        origin = positions.min(axis=0)
+        extent = positions.max(axis=0) - origin
+        columns, rows = [
+            max(1, math.ceil(length / self.tile_size)) for length in extent
+        ]
+        tile_size = extent / [columns, rows]
+
+        tiles = []
+        for row in range(rows):
+            for column in range(columns):
+                lower = origin + np.array([column, row]) * tile_size - \
+                    self.tile_overlap
+                upper = lower + tile_size + 2 * self.tile_overlap
+                in_tile = ((positions >= lower) & (positions <= upper)) \
+                    .all(axis=1)
+                if in_tile.any():
+                    tiles.append(names[in_tile].tolist())
+
+        return tiles
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description='List the tiles for partitioned processing, i.e. to set '
+                    'the size of a SLURM job array.'
+    )
+    parser.add_argument(
+        '--reference-file',
+        required=True,
+        help='Full path to the images_metadata.csv',
+    )
+    parser.add_argument(
+        '--tile-size',
+        type=float,
+        required=True,
+        help='Maximum length of a tile side in meters',
+    )
+    parser.add_argument(
+        '--tile-overlap',
+        type=float,
+        default=ImageTiles.TILE_OVERLAP,
+        help='Extent added to each tile side in meters. '
+             'Default: ' + str(ImageTiles.TILE_OVERLAP),
+    )
+
+    return parser
+
+
+# Example command line execution:
+#
+# python image_tiles.py \
+#        --reference-file /project/root/path/images_metadata.csv \
+#        --tile-size 5000
+#
+if __name__ == '__main__':
+    arguments = argument_parser().parse_args()
+    image_tiles = ImageTiles(
+        arguments.reference_file,
+        arguments.tile_size,
+        arguments.tile_overlap,
+    )
+    for tile_index, tile in enumerate(image_tiles.tiles()):
+        print('Tile ' + str(tile_index) + ': ' + str(len(tile)) + ' images')
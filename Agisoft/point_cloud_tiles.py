@@ -0,0 +1,253 @@
+import json
+import math
+import os
+import re
+
+import Metashape
+
+
+class PointCloudTiles:
+    """
+    Export the dense cloud as LAZ tiles in a projected CRS, cropped to given
+    bounds, along with a tile index.
+
+    The tiles are named by their lower left corner and saved with the tile
+    index into the output path.
+
+    The bounds are split into square tiles of the tile size, starting at
+    the lower left corner. For each tile, the chunk region is set to the
+    tile, aligned with the axes of the CRS, and the points within are
+    exported. The region of the chunk is restored afterwards. Tiles outside
+    the region the dense cloud was built in, or for which Metashape reports
+    no points, are left out. Any other export error fails the export.
+
+    The tile index is a GeoJSON file with the outline and the file location
+    of each tile, which can be read with the PDAL readers.tindex or GDAL.
+    """
+    CRS = 'EPSG::32613'
+    TILE_SIZE = 1000.0
+    # Height of the tile regions in meters, to contain all points
+    REGION_HEIGHT = 10000.0
+
+    # Error message of exportPoints for a region without points
+    EMPTY_EXPORT = re.compile(r'empty|nothing to export', re.IGNORECASE)
+
+    INDEX_FILE = 'tile_index.geojson'
+    LOCATION_FIELD = 'location'
+
+    def __init__(self, output_path, bounds, crs=CRS, tile_size=TILE_SIZE):
+        """
+        :param output_path: Directory to write the tiles and index to
+        :param bounds: Tuple of X and Y minimum and maximum as returned by
+                       parse_bounds
+        :param crs: CRS of the bounds and exported tiles as EPSG code
+        :param tile_size: Length of a tile side in units of the CRS
+        """
+        self.output_path = output_path
+        self.bounds = bounds
+        self.crs = crs
+        self.tile_size = tile_size
+
+    @property
+    def index_file(self):
+        return os.path.join(self.output_path, self.INDEX_FILE)
+
+    @staticmethod
+    def parse_bounds(value):
+        """
+        Parse bounds given in the PDAL format:
+        ([xmin, xmax], [ymin, ymax])
+
+        :return: Tuple of (x_min, x_max, y_min, y_max)
+        """
+        values = [
+            float(number) for number in
+            re.findall(r'[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?', value)
+        ]
+        if len(values) < 4:
+            raise ValueError('Bounds need X and Y minimum and maximum')
+        return tuple(values[:4])
+
+    def tiles(self):
+        """
+        :return: List of tile bounds as (x_min, x_max, y_min, y_max)
+        """
+        x_min, x_max, y_min, y_max = self.bounds
+        columns = max(1, math.ceil((x_max - x_min) / self.tile_size))
+        rows = max(1, math.ceil((y_max - y_min) / self.tile_size))
+
+        return [
+            (
+                x_min + column * self.tile_size,
+                min(x_max, x_min + (column + 1) * self.tile_size),
+                y_min + row * self.tile_size,
+                min(y_max, y_min + (row + 1) * self.tile_size),
+            )
+            for row in range(rows) for column in range(columns)
+        ]
+
+    def tile_file(self, tile):
+        return os.path.join(
+            self.output_path, '{:.0f}_{:.0f}.laz'.format(tile[0], tile[2])
+        )
+
+    def tile_region(self, chunk, crs, tile):
+        """
+        Chunk region covering the tile, with the axes aligned to the CRS at
+        the center of the tile.
+        """
+        transform = chunk.transform.matrix
+        to_internal = transform.inv()
+
+        # Keep the vertical center of the current region
+        height = crs.project(transform.mulp(chunk.region.center)).z
+        center = Metashape.Vector([
+            (tile[0] + tile[1]) / 2, (tile[2] + tile[3]) / 2, height
+        ])
+
+        def internal(offset):
+            return to_internal.mulp(crs.unproject(center + offset))
+
+        region_center = internal(Metashape.Vector([0, 0, 0]))
+        axes = [
+            internal(Metashape.Vector(offset)) - region_center
+            for offset in ([1, 0, 0], [0, 1, 0], [0, 0, 1])
+        ]
+        # Internal units per unit of the CRS
+        scale = axes[0].norm()
+
+        region = chunk.region
+        region.center = region_center
+        region.rot = Metashape.Matrix([
+            [axis.normalized()[row] for axis in axes] for row in range(3)
+        ])
+        region.size = Metashape.Vector([
+            (tile[1] - tile[0]) * scale,
+            (tile[3] - tile[2]) * scale,
+            self.REGION_HEIGHT * scale,
+        ])
+        return region
+
+    @staticmethod
+    def region_bounds(chunk, crs, region):
+        """
+        Bounds of a chunk region in the CRS.
+
+        :return: Tuple of (x_min, x_max, y_min, y_max)
+        """
+        transform = chunk.transform.matrix
+        corners = [
+            crs.project(transform.mulp(
+                region.center + region.rot * Metashape.Vector([
+                    x * region.size[0], y * region.size[1],
+                    z * region.size[2],
+                ])
+            ))
+            for x in (-0.5, 0.5) for y in (-0.5, 0.5) for z in (-0.5, 0.5)
+        ]
+        return (
+            min(corner[0] for corner in corners),
+            max(corner[0] for corner in corners),
+            min(corner[1] for corner in corners),
+            max(corner[1] for corner in corners),
+        )
+
+    @staticmethod
+    def overlaps(tile, bounds):
+        return tile[0] < bounds[1] and tile[1] > bounds[0] and \
+            tile[2] < bounds[3] and tile[3] > bounds[2]
+
+    def tile_feature(self, tile, tile_file):
+        x_min, x_max, y_min, y_max = tile
+        return dict(
+            type='Feature',
+            properties={self.LOCATION_FIELD: tile_file},
+            geometry=dict(
+                type='Polygon',
+                coordinates=[[
+                    [x_min, y_min], [x_max, y_min], [x_max, y_max],
+                    [x_min, y_max], [x_min, y_min],
+                ]],
+            ),
+        )
+
+    def write_index(self, features):
+        epsg = self.crs.split(':')[-1]
+        index = dict(
+            type='FeatureCollection',
+            crs=dict(
+                type='name',
+                properties=dict(name='urn:ogc:def:crs:EPSG::' + epsg),
+            ),
+            features=features,
+        )
+        temp_file = self.index_file + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_file, 'w') as index_file:
+            json.dump(index, index_file, indent=2)
+        os.replace(temp_file, self.index_file)
+
+    def is_exported(self):
+        """
+        Whether the tile index and all listed tiles exist.
+        """
+        if not os.path.exists(self.index_file):
+            return False
+
+        with open(self.index_file, 'r') as index_file:
+            try:
+                features = json.load(index_file)['features']
+            except (ValueError, KeyError):
+                return False
+
+        return all(
+            os.path.exists(feature['properties'][self.LOCATION_FIELD])
+            for feature in features
+        )
+
+    def export(self, chunk, progress=None):
+        """
+        Export all tiles of the dense cloud in given chunk and write the
+        tile index.
+
+        :param chunk: Metashape chunk with a dense cloud
+        :param progress: Optional, progress callback
+        """
+        os.makedirs(self.output_path, exist_ok=True)
+        crs = Metashape.CoordinateSystem(self.crs)
+        tiles = self.tiles()
+        original_region = chunk.region
+        # The dense cloud has no points outside the region it was built in
+        cloud_bounds = self.region_bounds(chunk, crs, original_region)
+        features = []
+
+        try:
+            for tile_number, tile in enumerate(tiles):
+                if progress is not None:
+                    progress(tile_number * 100 / len(tiles))
+                if not self.overlaps(tile, cloud_bounds):
+                    continue
+
+                chunk.region = self.tile_region(chunk, crs, tile)
+                tile_file = self.tile_file(tile)
+                try:
+                    chunk.exportPoints(
+                        path=tile_file,
+                        source_data=Metashape.DataSource.DenseCloudData,
+                        format=Metashape.PointsFormat.PointsFormatLAZ,
+                        crs=crs,
+                    )
+                except RuntimeError as error:
+                    if not self.EMPTY_EXPORT.search(str(error)):
+                        raise
+                    print('**** Skipping tile without points ' + tile_file)
+                    continue
+
+                features.append(self.tile_feature(tile, tile_file))
+        finally:
+            chunk.region = original_region
+
+        if progress is not None:
+            progress(100)
+        self.write_index(features)
+        print('Exported ' + str(len(features)) + ' tiles to: ' +
+              self.index_file)
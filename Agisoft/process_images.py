@@ -6,6 +6,13 @@ import sys
 
 import Metashape
 
+from image_pairs import ImagePairs
+from image_tiles import ImageTiles
+from point_cloud_tiles import PointCloudTiles
+from resource_profile import ResourceProfile
+from stage_state import StageState
+from stage_telemetry import StageTelemetry
+
 
 class ProcessImages:
     """
@@ -25,6 +32,29 @@ class ProcessImages:
     image_file_name, lon, lat, elevation, yaw, pitch, roll
 
     The Agisoft project file will be saved under *base_path*
+
+    With the camera model given, only image pairs with overlapping
+    footprints are matched. See ImagePairs.
+
+    With a tile size given, the images are partitioned into overlapping
+    tiles, see ImageTiles, and each tile is processed in a separate chunk.
+    A single tile can be processed on its own with the tile index, i.e.
+    as SLURM array task, which saves the tile to a separate project with
+    the tile index appended to the project name. All tile chunks and tile
+    projects are aligned and merged into one chunk with a final merge run.
+
+    With export bounds given, the dense cloud is exported as LAZ tiles
+    cropped to the bounds with a tile index, see PointCloudTiles. The tiles
+    are saved to a folder next to the project file:
+      my_project_name_2019_01_01_dense_cloud/
+    Partitioned processing only exports the merged chunk.
+
+    Completed stages are recorded with StageState. A re-run opens the
+    latest existing project with the given name, regardless of the date in
+    the file name, and skips all stages that have valid outputs. The sparse
+    cloud filter leaves no output of its own, so the number of remaining
+    tie points is stored in the chunk metadata and compared on a re-run.
+    Each stage is measured with StageTelemetry.
     """
 
     # Default image type for input images
@@ -33,6 +63,11 @@ class ProcessImages:
     PROJECT_REPORT = '.pdf'
     IMAGE_FOLDER = 'images'
     REFERENCE_FILE = 'images_metadata.csv'
+    TILE_SUFFIX = '_tile_'
+    DATE_FORMAT = '%Y_%m_%d'
+    DATE_PATTERN = '[0-9]' * 4 + '_' + '[0-9]' * 2 + '_' + '[0-9]' * 2
+    MERGED_CHUNK = 'Merged'
+    EXPORT_FOLDER = '_dense_cloud'
 
     WGS_84 = Metashape.CoordinateSystem("EPSG::4326")
 
@@ -44,6 +79,8 @@ class ProcessImages:
 
     REPROJECTION_ERROR_THRESHOLD = 0.3
     REPROJECTION_ACCURACY_THRESHOLD = 10
+    # Chunk metadata with the number of tie points after filtering
+    FILTERED_POINTS_KEY = 'snow_aso/filtered_points'
 
     # Source:
     # https://www.agisoft.com/forum/index.php?topic=11697.msg52455#msg52455
@@ -60,9 +97,30 @@ class ProcessImages:
     def __init__(self, options):
         # Ensure trailing slash
         self.project_base_path = os.path.join(options.base_path, '')
-        self.project_file_name = self.project_file_path(options.project_name)
+        self.project_base_name = options.project_name
+
+        self.image_tiles = None
+        self.tile_index = None
+        if options.tile_size:
+            self.image_tiles = ImageTiles(
+                self.project_base_path + self.REFERENCE_FILE,
+                options.tile_size,
+                options.tile_overlap,
+            )
+            self.tile_index = options.tile_index
+
+        tile_name = ''
+        if self.tile_index is not None:
+            tile_name = self.tile_name(self.tile_index)
+        self.project_file_name = self.project_file_path(
+            options.project_name, tile_name
+        )
+        self.state = StageState(self.project_file_name)
+        self.telemetry = StageTelemetry(
+            self.project_file_name, 'process_images'
+        )
 
-        self.setup_application()
+        self.setup_application(options)
 
         self.create_new_project()
         self.project = Metashape.app.document
@@ -76,6 +134,29 @@ class ProcessImages:
         )
         self.image_type = options.image_type
 
+        self.image_pairs = None
+        if options.focal_length:
+            self.image_pairs = ImagePairs(
+                self.project_base_path + self.REFERENCE_FILE,
+                options.focal_length,
+                options.sensor_width,
+                options.sensor_height,
+                options.ground_elevation,
+            )
+
+        self.point_cloud_tiles = None
+        if options.export_bounds:
+            self.point_cloud_tiles = PointCloudTiles(
+                self.project_file_name + self.EXPORT_FOLDER,
+                options.export_bounds,
+                options.export_crs,
+                options.export_tile_size,
+            )
+
+    @classmethod
+    def tile_name(cls, tile_index):
+        return cls.TILE_SUFFIX + str(tile_index)
+
     @property
     def project_name(self):
         return self.project_file_name + self.PROJECT_TYPE
@@ -89,29 +170,40 @@ class ProcessImages:
                 chunks=[chunk]
             )
 
-    def project_file_path(self, project_name):
+    def project_file_path(self, project_name, tile_name=''):
         """
         Return absolute Agisoft project file path. The project will be saved
         under initialized  _base_path_.
         Project name will be given _project_name_ parameter and a run date,
         when the project was created and will be appended to the name.
         Example: my_project_name_2019_01_01
+
+        An existing project with the given name is reused, the latest one
+        by date when there are multiple.
+
+        :param project_name: Name of the project
+        :param tile_name: Optional, name of the processed tile appended to
+                          the date
         """
-        run_date = datetime.date.today().strftime('%Y_%m_%d')
-        project_name = project_name + '_' + run_date
+        existing_projects = sorted(glob.glob(os.path.join(
+            self.project_base_path,
+            project_name + '_' + self.DATE_PATTERN + tile_name +
+            self.PROJECT_TYPE
+        )))
+        if len(existing_projects) > 0:
+            print('Opening existing project: ' + existing_projects[-1])
+            return os.path.splitext(existing_projects[-1])[0]
+
+        run_date = datetime.date.today().strftime(self.DATE_FORMAT)
+        project_name = project_name + '_' + run_date + tile_name
         return os.path.join(
             self.project_base_path, project_name
         )
 
-    @staticmethod
-    def setup_application():
-        app = Metashape.Application()
-        # Use all available GPUs, needs a bit mask
-        number_of_gpus = len(Metashape.app.enumGPUDevices())
-        mask = int(str('1' * number_of_gpus).rjust(8, '0'), 2)
-        app.gpu_mask = mask
-        # Disable CPU usage; recommended in manual
-        app.cpu_enable = False
+    def setup_application(self, options):
+        self.resources = ResourceProfile.from_arguments(options)
+        self.resources.apply()
+        print(self.resources.describe())
 
         settings = Metashape.Application.Settings()
         settings.log_enable = False
@@ -129,17 +221,25 @@ class ProcessImages:
         self.project.save()
         sys.exit(-1)
 
-    def image_list(self):
+    def image_list(self, image_names=None):
         """
         Find all images recursively under the initialized image folder.
         Only images with the specified file ending will be found.
         Default image file ending is '.tif'.
 
         The script will exit if there are no images found.
+
+        :param image_names: Optional, only find images with given file names
         """
         images = glob.glob(
             self.image_folder + '**/*' + self.image_type, recursive=True
         )
+        if image_names is not None:
+            image_names = set(image_names)
+            images = [
+                image for image in images
+                if os.path.basename(image) in image_names
+            ]
         if len(images) == 0:
             print('**** EXIT - ' + self.image_type +
                   ' no files found in directory:')
@@ -186,26 +286,62 @@ class ProcessImages:
             create_markers=False,
         )
 
-    def align_images(self):
-        self.chunk.addPhotos(self.image_list())
+    def pair_options(self):
+        """
+        Options to select the image pairs for matching. Either the pairs
+        with overlapping footprints or Metashape's preselection.
+        """
+        if self.image_pairs is None:
+            return dict(
+                generic_preselection=True,
+                reference_preselection=True,
+                reference_preselection_mode=(
+                    Metashape.ReferencePreselectionSource
+                ),
+            )
+
+        pairs = self.image_pairs.camera_pairs(self.chunk.cameras)
+        print('Matching ' + str(len(pairs)) + ' image pairs')
+        return dict(
+            generic_preselection=False,
+            reference_preselection=False,
+            pairs=pairs,
+        )
+
+    def add_images(self, image_names=None, progress=None):
+        # Skip images of an interrupted previous run
+        added_images = set(
+            camera.photo.path for camera in self.chunk.cameras
+            if camera.photo is not None
+        )
+        images = [
+            image for image in self.image_list(image_names)
+            if image not in added_images
+        ]
+        if len(images) > 0:
+            self.chunk.addPhotos(images, progress=progress)
         self.load_image_references()
+
+    def align_images(self, progress=None):
         self.chunk.matchPhotos(
             downscale=self.ImageMatching.HIGH,
-            generic_preselection=True,
-            reference_preselection=True,
-            reference_preselection_mode=Metashape.ReferencePreselectionSource,
             keypoint_limit=self.KEYPOINT_LIMIT,
             tiepoint_limit=self.TIEPOINT_LIMIT,
+            reset_matches=True,
+            progress=StageTelemetry.part_progress(progress, 0, 2),
+            **self.pair_options()
+        )
+        self.chunk.alignCameras(
+            reset_alignment=True,
+            progress=StageTelemetry.part_progress(progress, 1, 2),
         )
-        self.chunk.alignCameras()
-        self.project.save()
 
     def remove_by_criteria(self, criteria, threshold):
         point_cloud_filter = Metashape.PointCloud.Filter()
         point_cloud_filter.init(self.chunk, criterion=criteria)
         point_cloud_filter.removePoints(threshold)
 
-    def filter_sparse_cloud(self):
+    def filter_sparse_cloud(self, progress=None):
         # Points that statistical error in point placement exceed threshold
         self.remove_by_criteria(
             Metashape.PointCloud.Filter.ReprojectionError,
@@ -217,26 +353,193 @@ class ProcessImages:
             Metashape.PointCloud.Filter.ProjectionAccuracy,
             self.REPROJECTION_ACCURACY_THRESHOLD,
         )
-        self.chunk.optimizeCameras()
-        self.project.save()
+        self.chunk.optimizeCameras(progress=progress)
+        self.chunk.meta[self.FILTERED_POINTS_KEY] = str(
+            len(self.chunk.point_cloud.points)
+        )
+
+    @classmethod
+    def is_sparse_cloud_filtered(cls, chunk):
+        """
+        The sparse cloud still has the number of tie points recorded after
+        filtering. A new alignment changes the tie points.
+        """
+        if chunk.point_cloud is None or \
+                cls.FILTERED_POINTS_KEY not in chunk.meta.keys():
+            return False
+
+        return chunk.meta[cls.FILTERED_POINTS_KEY] == \
+            str(len(chunk.point_cloud.points))
 
-    def build_dense_cloud(self, dense_cloud_quality):
+    def build_depth_maps(self, dense_cloud_quality, progress=None):
         self.chunk.buildDepthMaps(
             downscale=dense_cloud_quality,
             filter_mode=Metashape.MildFiltering,
+            progress=progress,
+        )
+
+    def build_dense_cloud(self, progress=None):
+        self.chunk.buildDenseCloud(progress=progress)
+
+    def export_dense_cloud(self, progress=None):
+        self.point_cloud_tiles.export(self.chunk, progress=progress)
+
+    def run_stage(self, stage, is_valid, action, *arguments):
+        chunk = self.chunk
+        self.resources.apply(stage)
+        completed = self.state.run(
+            self.project, chunk, stage, is_valid,
+            lambda: self.telemetry.measure(
+                chunk, stage,
+                lambda progress: action(*arguments, progress=progress),
+            ),
+        )
+        if not completed:
+            self.telemetry.skipped(chunk, stage)
+
+    def tile_chunk(self, tile_index):
+        """
+        Chunk for given tile. Uses the chunk of a previous run, or the empty
+        chunk of a new project for the first processed tile.
+        """
+        label = 'Tile ' + str(tile_index)
+        for chunk in self.project.chunks:
+            if chunk.label == label:
+                self.chunk = chunk
+                return self.chunk
+
+        if len(self.chunk.cameras) > 0:
+            self.chunk = self.project.addChunk()
+        self.chunk.label = label
+        self.setup_camera()
+
+        return self.chunk
+
+    def process_chunk(self, options, report_name, image_names=None):
+        chunk = self.chunk
+
+        self.run_stage(
+            StageState.ADD_PHOTOS,
+            lambda: len(chunk.cameras) > 0,
+            self.add_images, image_names,
+        )
+        self.run_stage(
+            StageState.MATCH_AND_ALIGN,
+            lambda: chunk.point_cloud is not None,
+            self.align_images,
+        )
+        self.run_stage(
+            StageState.SPARSE_FILTER,
+            lambda: self.is_sparse_cloud_filtered(chunk),
+            self.filter_sparse_cloud,
+        )
+        self.run_stage(
+            StageState.DEPTH_MAPS,
+            lambda: chunk.depth_maps is not None,
+            self.build_depth_maps, options.dense_cloud_quality,
+        )
+        self.run_stage(
+            StageState.DENSE_CLOUD,
+            lambda: chunk.dense_cloud is not None,
+            self.build_dense_cloud,
+        )
+        self.chunk.exportReport(report_name + self.PROJECT_REPORT)
+
+    def export_points(self):
+        if self.point_cloud_tiles is None:
+            return
+
+        self.run_stage(
+            StageState.EXPORT_POINTS,
+            self.point_cloud_tiles.is_exported,
+            self.export_dense_cloud,
         )
-        self.chunk.buildDenseCloud()
+
+    def process_tiles(self, options):
+        """
+        Process all tiles into separate chunks, or only the one with the
+        initialized tile index.
+        """
+        tiles = self.image_tiles.tiles()
+
+        if self.tile_index is None:
+            tile_indices = range(len(tiles))
+        elif self.tile_index < len(tiles):
+            tile_indices = [self.tile_index]
+        else:
+            print('**** EXIT - Tile index ' + str(self.tile_index) +
+                  ' out of range, number of tiles: ' + str(len(tiles)))
+            self.save_and_exit()
+
+        for tile_index in tile_indices:
+            print('Processing tile ' + str(tile_index) + ' with ' +
+                  str(len(tiles[tile_index])) + ' images')
+            self.tile_chunk(tile_index)
+
+            report_name = self.project_file_name
+            if self.tile_index is None:
+                report_name += self.tile_name(tile_index)
+            self.process_chunk(options, report_name, tiles[tile_index])
+
+    def merge_tiles(self):
+        """
+        Add the chunks of all tile projects and align and merge them with
+        the tile chunks of this project into a new chunk.
+        """
+        if any(
+            chunk.label == self.MERGED_CHUNK for chunk in self.project.chunks
+        ):
+            print('Skipping merge, project has merged chunk')
+            return
+
+        tile_projects = sorted(glob.glob(os.path.join(
+            self.project_base_path,
+            self.project_base_name + '_' + self.DATE_PATTERN +
+            self.TILE_SUFFIX + '*' + self.PROJECT_TYPE
+        )))
+        for tile_project in tile_projects:
+            self.project.append(tile_project)
+
+        tile_chunks = [
+            chunk.key for chunk in self.project.chunks
+            if len(chunk.cameras) > 0
+        ]
+        if len(tile_chunks) < 2:
+            print('**** EXIT - Need at least two tiles to merge, found: ' +
+                  str(len(tile_chunks)))
+            self.save_and_exit()
+
+        self.project.alignChunks(
+            chunks=tile_chunks,
+            reference=tile_chunks[0],
+            method=0,  # Point based
+            downscale=self.ImageMatching.HIGH,
+            keypoint_limit=self.KEYPOINT_LIMIT,
+        )
+        self.project.mergeChunks(
+            chunks=tile_chunks,
+            merge_dense_clouds=True,
+        )
+
+        # The merged chunk is added last
+        self.chunk = self.project.chunks[-1]
+        self.chunk.label = self.MERGED_CHUNK
         self.project.save()
+        self.chunk.exportReport(self.project_file_name + self.PROJECT_REPORT)
 
     def process(self, options):
-        self.align_images()
-        self.filter_sparse_cloud()
-        self.build_dense_cloud(options.dense_cloud_quality)
-        self.chunk.exportReport(
-            self.project_file_name + self.PROJECT_REPORT
-        )
+        if self.image_tiles is not None:
+            self.process_tiles(options)
+        elif not options.merge_tiles:
+            self.process_chunk(options, self.project_file_name)
+            self.export_points()
+
+        if options.merge_tiles:
+            self.merge_tiles()
+            self.export_points()
 
         self.project.save()
+        self.telemetry.print_report()
 
 
 def argument_parser():
@@ -277,6 +580,78 @@ def argument_parser():
              "Medium -> " + str(ProcessImages.DepthMapQuality.MEDIUM)
     )
 
+    parser.add_argument(
+        '--focal-length',
+        type=float,
+        help='Focal length of the camera in mm. Together with the sensor '
+             'size, only image pairs with overlapping footprints are '
+             'matched.',
+    )
+    parser.add_argument(
+        '--sensor-width',
+        type=float,
+        help='Sensor size across flight direction in mm',
+    )
+    parser.add_argument(
+        '--sensor-height',
+        type=float,
+        help='Sensor size along flight direction in mm',
+    )
+    parser.add_argument(
+        '--ground-elevation',
+        type=float,
+        default=0.0,
+        help='Elevation of the ground in meters for the image pairs. '
+             'Default: 0',
+    )
+    parser.add_argument(
+        '--tile-size',
+        type=float,
+        help='Partition the images into tiles with this maximum side length '
+             'in meters and process each tile in a separate chunk.',
+    )
+    parser.add_argument(
+        '--tile-overlap',
+        type=float,
+        default=ImageTiles.TILE_OVERLAP,
+        help='Extent added to each tile side in meters. '
+             'Default: ' + str(ImageTiles.TILE_OVERLAP),
+    )
+    parser.add_argument(
+        '--tile-index',
+        type=int,
+        default=os.environ.get('SLURM_ARRAY_TASK_ID'),
+        help='Only process the tile with this index into a separate '
+             'project. Defaults to the SLURM array task ID when set.',
+    )
+    parser.add_argument(
+        '--merge-tiles',
+        action='store_true',
+        help='Align and merge the chunks of all processed tiles.',
+    )
+    parser.add_argument(
+        '--export-bounds',
+        type=PointCloudTiles.parse_bounds,
+        help='Export the dense cloud as LAZ tiles cropped to these bounds, '
+             'given in the export CRS and PDAL format, i.e. '
+             '"([322518.0, 336552.0], [4305588.0, 4322445.0])"',
+    )
+    parser.add_argument(
+        '--export-crs',
+        default=PointCloudTiles.CRS,
+        help='CRS of the export bounds and tiles. '
+             'Default: ' + PointCloudTiles.CRS,
+    )
+    parser.add_argument(
+        '--export-tile-size',
+        type=float,
+        default=PointCloudTiles.TILE_SIZE,
+        help='Length of an exported tile side in units of the export CRS. '
+             'Default: ' + str(PointCloudTiles.TILE_SIZE),
+    )
+
+    ResourceProfile.add_arguments(parser)
+
     return parser
 
 
@@ -299,6 +674,13 @@ def argument_parser():
 #              --project-name test
 #
 if __name__ == '__main__':
-    arguments = argument_parser().parse_args()
+    parser = argument_parser()
+    arguments = parser.parse_args()
+    if arguments.focal_length and not (
+        arguments.sensor_width and arguments.sensor_height
+    ):
+        parser.error(
+            '--focal-length requires --sensor-width and --sensor-height'
+        )
     project = ProcessImages(arguments)
     project.process(arguments)
@@ -0,0 +1,214 @@
+import argparse
+import os
+
+import Metashape
+
+from stage_state import StageState
+
+
+class ResourceProfile:
+    """
+    Select the GPUs and CPU usage for Metashape processing.
+
+    The GPUs are taken from, in this order:
+      * The given device indices
+      * CUDA_VISIBLE_DEVICES
+      * SLURM_STEP_GPUS or SLURM_JOB_GPUS, the GPUs bound to the SLURM job
+      * All GPUs found by Metashape
+
+    CUDA and a SLURM job with bound GPUs often only expose the visible
+    devices to Metashape already. When Metashape finds no more devices than
+    are visible, all found devices are used. Otherwise, the visible device
+    indices select from the found devices.
+
+    The CPU is disabled for processing when GPUs are available, as
+    recommended in the manual, unless enabled for a stage. Without a GPU,
+    the CPU is always used. The GPUs can be further restricted for single
+    stages.
+    """
+    GPU_VARIABLES = [
+        'CUDA_VISIBLE_DEVICES', 'SLURM_STEP_GPUS', 'SLURM_JOB_GPUS',
+    ]
+    # Stage exporting the orthomosaic, not recorded in the state file
+    EXPORT_STAGE = 'export'
+    STAGES = StageState.STAGES + [EXPORT_STAGE]
+
+    def __init__(self, gpus=None, cpu_stages=(), stage_gpus=None,
+                 devices=None, environment=os.environ):
+        """
+        :param gpus: Optional, list of GPU indices to use
+        :param cpu_stages: Stages to enable the CPU for along with the GPUs
+        :param stage_gpus: Optional, dictionary with a list of GPU indices
+                           per stage, as returned by parse_stage_gpus
+        :param devices: Optional, GPU devices. Default: Devices found by
+                        Metashape
+        :param environment: Mapping with the environment variables
+        """
+        if devices is None:
+            devices = Metashape.app.enumGPUDevices()
+        self.devices = devices
+        self.gpus = self.select_gpus(gpus, environment)
+        self.cpu_stages = set(cpu_stages)
+        self.stage_gpus = stage_gpus or {}
+
+    @staticmethod
+    def parse_gpus(value):
+        """
+        Parse a comma separated list of GPU indices.
+
+        :return: List of indices, None when one is not an index, i.e. an
+                 UUID
+        """
+        gpus = [gpu.strip() for gpu in value.split(',') if gpu.strip()]
+        if not all(gpu.isdigit() for gpu in gpus):
+            return None
+        return [int(gpu) for gpu in gpus]
+
+    @staticmethod
+    def gpu_indices(value):
+        """
+        Parse the --gpus option, which only accepts GPU indices.
+
+        :return: List of indices
+        """
+        gpus = ResourceProfile.parse_gpus(value)
+        if gpus is None:
+            raise argparse.ArgumentTypeError(
+                'Comma separated GPU indices expected, got: ' + value
+            )
+        return gpus
+
+    @staticmethod
+    def stage_name(value):
+        """
+        :return: Given stage name without surrounding spaces
+        """
+        stage = value.strip()
+        if stage not in ResourceProfile.STAGES:
+            raise argparse.ArgumentTypeError(
+                'Unknown stage: "' + stage + '", valid stages are: ' +
+                ', '.join(ResourceProfile.STAGES)
+            )
+        return stage
+
+    @staticmethod
+    def parse_cpu_stages(value):
+        """
+        Parse a comma separated list of stages, i.e. 'match and align,DEM'.
+
+        :return: List of stage names
+        """
+        return [
+            ResourceProfile.stage_name(stage) for stage in value.split(',')
+        ]
+
+    @staticmethod
+    def parse_stage_gpus(value):
+        """
+        Parse the GPUs per stage, i.e. 'depth maps=0,1;dense cloud=0'.
+
+        :return: Dictionary with the list of GPU indices per stage
+        """
+        stage_gpus = {}
+        for stage_value in value.split(';'):
+            if stage_value.count('=') != 1:
+                raise argparse.ArgumentTypeError(
+                    'Expected stage=GPU indices, got: ' + stage_value
+                )
+            stage, gpus = stage_value.split('=')
+            stage = ResourceProfile.stage_name(stage)
+            gpus = ResourceProfile.parse_gpus(gpus)
+            if gpus is None:
+                raise argparse.ArgumentTypeError(
+                    'Invalid GPU indices for: ' + stage
+                )
+            stage_gpus[stage] = gpus
+
+        return stage_gpus
+
+    def select_gpus(self, gpus, environment):
+        """
+        :return: List of indices into the found devices
+        """
+        found = list(range(len(self.devices)))
+        if gpus is not None:
+            return [gpu for gpu in gpus if gpu in found]
+
+        for variable in self.GPU_VARIABLES:
+            if variable not in environment:
+                continue
+
+            visible = self.parse_gpus(environment[variable])
+            if visible is None:
+                # Device UUIDs, use as many devices as given
+                visible_count = len(environment[variable].split(','))
+                return found[:visible_count]
+            if len(found) <= len(visible):
+                return found
+            return [gpu for gpu in visible if gpu in found]
+
+        return found
+
+    @staticmethod
+    def gpu_mask(gpus):
+        """
+        Bit mask with one bit per device index, lowest bit is the first.
+        """
+        mask = 0
+        for gpu in gpus:
+            mask |= 1 << gpu
+        return mask
+
+    def stage_profile(self, stage=None):
+        """
+        :return: Tuple of the GPU indices and whether to enable the CPU for
+                 given stage
+        """
+        gpus = self.gpus
+        if stage in self.stage_gpus:
+            gpus = [gpu for gpu in self.stage_gpus[stage] if gpu in gpus]
+
+        return gpus, len(gpus) == 0 or stage in self.cpu_stages
+
+    def apply(self, stage=None):
+        """
+        Set the GPU mask and CPU usage of the application for given stage.
+        """
+        gpus, cpu_enable = self.stage_profile(stage)
+        Metashape.app.gpu_mask = self.gpu_mask(gpus)
+        Metashape.app.cpu_enable = cpu_enable
+
+    def describe(self, stage=None):
+        gpus, cpu_enable = self.stage_profile(stage)
+        names = [str(self.devices[gpu].get('name', gpu)) for gpu in gpus]
+        return 'GPUs: ' + (', '.join(names) or 'none') + \
+            ' - CPU: ' + ('enabled' if cpu_enable else 'disabled')
+
+    @staticmethod
+    def add_arguments(parser):
+        """
+        Add the options for the resource profile to given argument parser.
+        """
+        parser.add_argument(
+            '--gpus',
+            type=ResourceProfile.gpu_indices,
+            help='Comma separated indices of the GPUs to use. '
+                 'Default: GPUs visible to CUDA or bound to the SLURM job.',
+        )
+        parser.add_argument(
+            '--cpu-stages',
+            type=ResourceProfile.parse_cpu_stages,
+            default=[],
+            help='Comma separated stages to enable the CPU for along with '
+                 'the GPUs, i.e. "match and align"',
+        )
+        parser.add_argument(
+            '--stage-gpus',
+            type=ResourceProfile.parse_stage_gpus,
+            help='GPU indices for single stages, i.e. '
+                 '"depth maps=0,1;dense cloud=0"',
+        )
+
+    @classmethod
+    def from_arguments(cls, arguments):
+        return cls(arguments.gpus, arguments.cpu_stages, arguments.stage_gpus)
@@ -0,0 +1,93 @@
+import json
+import os
+
+
+class StageState:
+    """
+    Record the completed processing stages of a Metashape project in a
+    sidecar file, to resume a project after an interruption.
+
+    Stages are recorded per chunk label and in processing order. Recording
+    a stage drops all later stages of the chunk, since their outputs are
+    based on the previous result.
+
+    The file is saved next to the project file as:
+      my_project_name_2019_01_01_state.json
+    """
+    FILE_SUFFIX = '_state.json'
+
+    ADD_PHOTOS = 'add photos'
+    MATCH_AND_ALIGN = 'match and align'
+    SPARSE_FILTER = 'sparse filter and optimize'
+    DEPTH_MAPS = 'depth maps'
+    DENSE_CLOUD = 'dense cloud'
+    EXPORT_POINTS = 'export points'
+    DEM = 'DEM'
+    MODEL = 'model'
+    ORTHOMOSAIC = 'ortho'
+
+    STAGES = [
+        ADD_PHOTOS, MATCH_AND_ALIGN, SPARSE_FILTER, DEPTH_MAPS, DENSE_CLOUD,
+        EXPORT_POINTS, DEM, MODEL, ORTHOMOSAIC,
+    ]
+
+    def __init__(self, project_file_name):
+        """
+        :param project_file_name: Project file path without file ending
+        """
+        self.state_file = project_file_name + self.FILE_SUFFIX
+        self.chunks = self.read()
+
+    def read(self):
+        if not os.path.exists(self.state_file):
+            return {}
+
+        with open(self.state_file, 'r') as state_file:
+            try:
+                return json.load(state_file)['chunks']
+            except (ValueError, KeyError):
+                return {}
+
+    def save(self):
+        temp_file = self.state_file + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_file, 'w') as state_file:
+            json.dump(dict(chunks=self.chunks), state_file, indent=2)
+        os.replace(temp_file, self.state_file)
+
+    def completed(self, chunk, stage):
+        return stage in self.chunks.get(chunk.label, [])
+
+    def record(self, chunk, stage):
+        stage_index = self.STAGES.index(stage)
+        self.chunks[chunk.label] = [
+            completed for completed in self.chunks.get(chunk.label, [])
+            if self.STAGES.index(completed) < stage_index
+        ] + [stage]
+        self.save()
+
+    def run(self, project, chunk, stage, is_valid, action, save=True):
+        """
+        Run the action of a stage, unless it is recorded as completed and
+        the outputs of the stage in the chunk are valid. The project is
+        saved before the stage is recorded. Without saving, the stage is
+        recorded, but only skipped when a later save kept its outputs.
+
+        :param project: Metashape document
+        :param chunk: Metashape chunk processed by the action
+        :param stage: Name of the stage, one of STAGES
+        :param is_valid: Callable to check the outputs in the chunk
+        :param action: Callable processing the stage
+        :param save: Save the project after the stage
+
+        :return: False when the stage was skipped
+        """
+        if self.completed(chunk, stage) and is_valid():
+            print('Skipping completed stage: ' + stage +
+                  ' (' + chunk.label + ')')
+            return False
+
+        action()
+        if save:
+            project.save()
+        self.record(chunk, stage)
+        return True
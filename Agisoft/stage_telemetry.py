@@ -0,0 +1,222 @@
+import datetime
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+class StageTelemetry:
+    """
+    Measure wall time and memory of processing stages and report the
+    progress of the running stage.
+
+    Files saved next to the project file:
+      * my_project_name_2019_01_01_status.json
+        Running stage with percent done and estimated time to completion.
+        Updated from the Metashape progress callback, at most every
+        STATUS_INTERVAL seconds.
+      * my_project_name_2019_01_01_timing.json
+        Wall time and peak memory for each stage, with one entry per run to
+        compare runs. The entry of the current run is updated after each
+        stage.
+
+    Memory is the resident set size in MB. The stage peak is sampled with
+    the progress updates on Linux, the process peak is the maximum up to
+    the end of the stage.
+    """
+    STATUS_SUFFIX = '_status.json'
+    TIMING_SUFFIX = '_timing.json'
+
+    # Seconds between updates of the status file
+    STATUS_INTERVAL = 10
+
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+
+    def __init__(self, project_file_name, run_name):
+        """
+        :param project_file_name: Project file path without file ending
+        :param run_name: Name of the run in the timing report
+        """
+        self.status_file = project_file_name + self.STATUS_SUFFIX
+        self.timing_file = project_file_name + self.TIMING_SUFFIX
+        self.run_name = run_name
+        self.run_start = time.time()
+        self.previous_runs = self.read_runs()
+        self.stages = []
+        self.status = None
+
+    def read_runs(self):
+        if not os.path.exists(self.timing_file):
+            return []
+
+        with open(self.timing_file, 'r') as timing_file:
+            try:
+                return json.load(timing_file)['runs']
+            except (ValueError, KeyError):
+                return []
+
+    @staticmethod
+    def current_rss():
+        """
+        Current resident set size in MB, None when not available.
+        """
+        try:
+            with open('/proc/self/statm', 'r') as statm:
+                pages = int(statm.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            return None
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+    @staticmethod
+    def process_peak_rss():
+        """
+        Peak resident set size of the process in MB, None when not available.
+        """
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes on Linux
+        if sys.platform == 'darwin':
+            return peak / 2 ** 20
+        return peak / 2 ** 10
+
+    @staticmethod
+    def write_json(file_path, content):
+        temp_file = file_path + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_file, 'w') as json_file:
+            json.dump(content, json_file, indent=2)
+        os.replace(temp_file, file_path)
+
+    @staticmethod
+    def timestamp(seconds):
+        return datetime.datetime.fromtimestamp(seconds).isoformat(
+            timespec='seconds'
+        )
+
+    @staticmethod
+    def part_progress(progress, part, parts):
+        """
+        Progress callback for one of multiple Metashape calls in a stage.
+
+        :param progress: Progress callback of the stage
+        :param part: Index of the call within the stage
+        :param parts: Number of calls in the stage
+        """
+        if progress is None:
+            return None
+        return lambda percent: progress((part * 100 + percent) / parts)
+
+    def write_status(self, force=False):
+        now = time.time()
+        if not force and now - self.status['updated'] < self.STATUS_INTERVAL:
+            return
+
+        self.status['updated'] = now
+        elapsed = now - self.status['start']
+        percent = self.status['percent']
+        eta = None
+        if 0 < percent < 100:
+            eta = elapsed * (100 - percent) / percent
+
+        try:
+            self.write_json(self.status_file, dict(
+                chunk=self.status['chunk'],
+                stage=self.status['stage'],
+                status=self.status['state'],
+                percent=round(percent, 1),
+                elapsed=round(elapsed),
+                eta=None if eta is None else round(eta),
+                eta_time=None if eta is None else self.timestamp(now + eta),
+                updated=self.timestamp(now),
+            ))
+        except OSError as error:
+            print('**** Could not write status: ' + str(error))
+
+    def progress(self, percent):
+        """
+        Progress callback given to Metashape.
+        """
+        self.status['percent'] = percent
+
+        rss = self.current_rss()
+        if rss is not None:
+            self.status['peak_rss'] = max(self.status['peak_rss'] or 0, rss)
+
+        self.write_status()
+
+    def add_stage(self, chunk, stage, state, wall_time=0.0,
+                  peak_rss=None):
+        process_peak_rss = self.process_peak_rss()
+        self.stages.append(dict(
+            chunk=chunk.label,
+            stage=stage,
+            status=state,
+            wall_time=round(wall_time, 3),
+            peak_rss_mb=None if peak_rss is None else round(peak_rss),
+            process_peak_rss_mb=None if process_peak_rss is None
+            else round(process_peak_rss),
+        ))
+        self.write_report()
+
+    def write_report(self):
+        try:
+            self.write_json(self.timing_file, dict(
+                runs=self.previous_runs + [dict(
+                    name=self.run_name,
+                    start=self.timestamp(self.run_start),
+                    wall_time=round(time.time() - self.run_start, 3),
+                    stages=self.stages,
+                )]
+            ))
+        except OSError as error:
+            print('**** Could not write timing report: ' + str(error))
+
+    def skipped(self, chunk, stage):
+        self.add_stage(chunk, stage, self.SKIPPED)
+
+    def measure(self, chunk, stage, action):
+        """
+        Run the action of a stage and record the wall time and memory.
+
+        :param chunk: Metashape chunk processed by the action
+        :param stage: Name of the stage
+        :param action: Callable processing the stage, called with the
+                       progress callback for Metashape
+        """
+        start = time.time()
+        self.status = dict(
+            chunk=chunk.label, stage=stage, state=self.RUNNING, start=start,
+            updated=0, percent=0.0, peak_rss=self.current_rss(),
+        )
+        self.write_status(force=True)
+
+        state = self.FAILED
+        try:
+            action(self.progress)
+            state = self.COMPLETED
+            self.status['percent'] = 100.0
+        finally:
+            self.status['state'] = state
+            self.write_status(force=True)
+            self.add_stage(
+                chunk, stage, state, time.time() - start,
+                self.status['peak_rss'],
+            )
+
+    def print_report(self):
+        print('Stage timing:')
+        for stage in self.stages:
+            print('  {chunk} - {stage}: {status}, {wall_time:.0f} s'.format(
+                **stage
+            ))
+        print('  total: {:.0f} s'.format(time.time() - self.run_start))
+        print('Timing report: ' + self.timing_file)
@@ -1,13 +1,21 @@
 from .converters import DecimalConverter
+from .image_footprints import ImageFootprints
+from .image_mover import ImageMover
 from .images_meta_csv import ImagesMetaCsv
+from .sbet_cache import SbetCache
 
 # Below modules depend on the above
 from .eif_data import EifData
+from .image_thinning import ImageThinning
 from .sbet_file import SbetFile
 
 __all__ = [
     'DecimalConverter',
     'EifData',
+    'ImageFootprints',
+    'ImageMover',
+    'ImageThinning',
     'ImagesMetaCsv',
+    'SbetCache',
     'SbetFile',
 ]
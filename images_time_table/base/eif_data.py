@@ -1,7 +1,9 @@
-import datetime
+import functools
 import glob
 import os
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas
 
 from images_time_table.base import DecimalConverter, ImagesMetaCsv
@@ -30,100 +32,217 @@ class EifData(object):
         usecols=NEW_EIF_HEADERS, lineterminator='\n',
         converters=EIF_CSV_DTYPES
     )
+    # Parse coordinates and orientation with the C engine into float64
+    NEW_NUMERIC_CSV_OPTIONS = dict(
+        names=NEW_EIF_HEADERS, sep=';', comment='#',
+        usecols=NEW_EIF_HEADERS, lineterminator='\n', engine='c',
+        dtype={column: float for column in EIF_CSV_DTYPES},
+    )
 
     def __init__(self, base_path, **kwargs):
         print('Getting image list')
-        self.file_list = glob.glob(self.eif_files(base_path), recursive=True)
+        # Sorted for the same order of images with identical times
+        self.file_list = sorted(
+            glob.glob(self.eif_files(base_path), recursive=True)
+        )
         self.new_eif_type = not kwargs['old_eif_type']
         self.image_type = kwargs['image_type']
-        self.images_time_table = []
+        self.numeric = kwargs.get('numeric', False)
+        self.workers = kwargs.get('workers', 1)
+        self.images_time_table = self.empty_table()
 
     @staticmethod
     def eif_files(base_path):
         return os.path.join(base_path, '**/*.eif')
 
     @staticmethod
-    def add_local_time(row):
-        row[ImagesMetaCsv.TIME_OF_DAY] = str(
-            datetime.timedelta(seconds=float(row[ImagesMetaCsv.TIME_COLUMN]))
+    def empty_table():
+        return pandas.DataFrame(columns=ImagesMetaCsv.RESULT_KEYS)
+
+    @staticmethod
+    def object_column(value, index):
+        """
+        Column that keeps the Python type of the values, i.e. an int 0 or
+        an empty string, when values of other types are set later.
+        """
+        return pandas.Series(value, index=index, dtype=object)
+
+    @staticmethod
+    def time_of_day(seconds):
+        """
+        Format seconds with the same output as str(datetime.timedelta).
+        Microseconds are rounded the same way as the timedelta constructor.
+        """
+        seconds = np.asarray(seconds, dtype=float)
+        whole_seconds = np.trunc(seconds)
+        microseconds = whole_seconds.astype(np.int64) * 10 ** 6 + \
+            np.rint((seconds - whole_seconds) * 1e6).astype(np.int64)
+
+        days, microseconds = np.divmod(microseconds, 86400 * 10 ** 6)
+        seconds, microseconds = np.divmod(microseconds, 10 ** 6)
+        hours, seconds = np.divmod(seconds, 3600)
+        minutes, seconds = np.divmod(seconds, 60)
+
+        time = np.char.add(hours.astype(str), ':')
+        time = np.char.add(time, np.char.zfill(minutes.astype(str), 2))
+        time = np.char.add(time, ':')
+        time = np.char.add(time, np.char.zfill(seconds.astype(str), 2))
+        time = np.where(
+            microseconds == 0,
+            time,
+            np.char.add(
+                np.char.add(time, '.'),
+                np.char.zfill(microseconds.astype(str), 6)
+            )
+        )
+
+        day_prefix = np.char.add(
+            days.astype(str),
+            np.where(np.abs(days) == 1, ' day, ', ' days, ')
+        )
+        return np.where(days == 0, time, np.char.add(day_prefix, time))
+
+    def add_local_time(self):
+        self.images_time_table[ImagesMetaCsv.TIME_OF_DAY] = self.time_of_day(
+            self.images_time_table[ImagesMetaCsv.TIME_COLUMN]
         )
 
-    def file_name_from_path(self, path):
-        file_name = path.split('\\')[-1]
+    def file_name_from_path(self, paths):
+        file_names = paths.str.split('\\').str[-1]
+        file_types = paths.str.split('.').str[-1]
 
-        file_type = path.split('.')[-1]
-        if not file_type.endswith(self.image_type):
-            file_name = file_name.replace(file_type, self.image_type)
+        for file_type in file_types.unique():
+            if file_type.endswith(self.image_type):
+                continue
+            rename = file_types == file_type
+            file_names[rename] = file_names[rename].str.replace(
+                file_type, self.image_type, regex=False
+            )
 
-        return file_name
+        return file_names
 
-    def yaw_to_360(self, row):
+    def yaw_to_360(self, data):
         """
         Yaw value from .eif file need transformation to a 0 to 360 degree range
         for Agisoft PhotoScan.
         """
-        yaw = row.get('yaw[deg]', None)
+        yaw = data.get('yaw[deg]', None)
         if yaw is not None and self.new_eif_type:
             return (360 - yaw) % 360
         else:
             return yaw
 
     @staticmethod
-    def transform_roll(row):
+    def transform_roll(data):
         """
         Seems that provided value of roll in .eif file is flipped with the
         pitch value.
         """
-        return row.get('pitch[deg]')
+        return data.get('pitch[deg]')
 
-    def transform_pitch(self, row):
+    def transform_pitch(self, data):
         """
         Seems that provided value of pitch in the .eif file is flipped with
         the roll value and has a different reference plane.
         """
-        pitch = row.get('roll[deg]', None)
+        pitch = data.get('roll[deg]', None)
         if pitch is not None and self.new_eif_type:
-            return row.get('roll[deg]', 0) + 180
+            return pitch + 180
         else:
             return pitch
 
-    def add_to_table(self, row):
-        data = [
-            self.file_name_from_path(row.get(self.FILE_COLUMN)),
-            row.get('longitude[deg]'),
-            row.get('latitude[deg]'),
-            '',
-            self.yaw_to_360(row),
-            self.transform_pitch(row),
-            self.transform_roll(row),
-            0,  # 'Time Diff' values for new eif type are always 0
-            row.get('#time[s]'),
-            None # Placeholder for time of day
-        ]
-
-        self.images_time_table.append(
-            {k: v for k, v in zip(ImagesMetaCsv.RESULT_KEYS, data)}
-        )
+    def to_table(self, csv_data):
+        """
+        Create the images time table for the data of one .eif file.
+        """
+        index = csv_data.index
+        return pandas.DataFrame({
+            ImagesMetaCsv.FILE_COLUMN: self.file_name_from_path(
+                csv_data[self.FILE_COLUMN]
+            ),
+            'X': csv_data.get('longitude[deg]'),
+            'Y': csv_data.get('latitude[deg]'),
+            'Z': self.object_column('', index),
+            'Yaw': self.yaw_to_360(csv_data),
+            'Pitch': self.transform_pitch(csv_data),
+            'Roll': self.transform_roll(csv_data),
+            # 'Time Diff' values for new eif type are always 0
+            'Time Diff': self.object_column(0, index),
+            ImagesMetaCsv.TIME_COLUMN: csv_data[self.TIME_COLUMN],
+            # Placeholder for time of day
+            ImagesMetaCsv.TIME_OF_DAY: self.object_column(None, index),
+        }, index=index, columns=ImagesMetaCsv.RESULT_KEYS)
+
+    def parse_file(self, source_file):
+        if self.new_eif_type and self.numeric:
+            options = self.NEW_NUMERIC_CSV_OPTIONS
+        elif self.new_eif_type:
+            options = self.NEW_CSV_OPTIONS
+        else:
+            options = self.OLD_CSV_OPTIONS
+
+        csv_data = pandas.read_csv(source_file, **options)
+
+        return self.to_table(csv_data)
 
     def parse_files(self):
-        for source_file in self.file_list:
-            if self.new_eif_type:
-                options = self.NEW_CSV_OPTIONS
-            else:
-                options = self.OLD_CSV_OPTIONS
+        """
+        Parse all .eif files, using a pool of processes when more than one
+        worker is configured. The tables are combined in the order of the
+        file list, independent of the order the workers finish.
 
-            csv_data = pandas.read_csv(source_file, **options)
+        Errors are reported for each file that failed to parse and a
+        RuntimeError is raised after all files were processed.
+        """
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = [
+                    executor.submit(self.parse_file, source_file)
+                    for source_file in self.file_list
+                ]
+                tables, errors = self.collect_tables(
+                    result.result for result in results
+                )
+        else:
+            tables, errors = self.collect_tables(
+                functools.partial(self.parse_file, source_file)
+                for source_file in self.file_list
+            )
+
+        if len(errors) > 0:
+            for source_file, error in errors:
+                print('**** Error parsing EIF file: ' + source_file)
+                print('    ' + repr(error))
+            raise RuntimeError(
+                'Failed to parse ' + str(len(errors)) + ' EIF file(s)'
+            )
+
+        if len(tables) > 0:
+            self.images_time_table = pandas.concat(tables, ignore_index=True)
+
+    def collect_tables(self, parse_results):
+        """
+        Gather parsed tables from given callables, keeping errors per file.
 
-            csv_data.apply(lambda row: self.add_to_table(row), axis=1)
+        :param parse_results: Generator of callables returning the table of
+                              the file at the same position in the file list
+        """
+        tables = []
+        errors = []
+        for source_file, parse_result in zip(self.file_list, parse_results):
+            try:
+                tables.append(parse_result())
+            except Exception as error:
+                errors.append((source_file, error))
+
+        return tables, errors
 
     def sort_by_time(self):
-        self.images_time_table = sorted(
-            self.images_time_table,
-            key=lambda row: row[ImagesMetaCsv.TIME_COLUMN]
+        self.images_time_table = self.images_time_table.sort_values(
+            ImagesMetaCsv.TIME_COLUMN, kind='stable', ignore_index=True
         )
 
     def get_images(self):
         self.parse_files()
         self.sort_by_time()
-
-        [self.add_local_time(entry) for entry in self.images_time_table]
+        self.add_local_time()
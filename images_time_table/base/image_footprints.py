@@ -0,0 +1,210 @@
+import numpy as np
+import shapely
+
+
+class ImageFootprints(object):
+    """
+    Ground footprints of images, based on the camera position and
+    orientation from the images metadata CSV and a pinhole camera model.
+
+    The corner rays of every image are intersected with the ground, given
+    as constant elevation or sampled from a coarse DEM. All images are
+    computed at once with numpy.
+
+    Assumptions:
+      * X and Y are longitude and latitude in degrees, Z is the altitude in
+        meters, the same vertical reference as the DEM.
+      * The camera points to nadir. Pitch and roll are tilts around the
+        across and along flight axis. Values are taken modulo 180 degrees,
+        which covers both nadir references in the CSV (0 and 180 degrees).
+      * Yaw is the heading, clockwise from north, with the image height
+        along the flight direction.
+    """
+    # Meters per degree latitude and longitude at the equator
+    METERS_PER_DEGREE_LAT = 110540.0
+    METERS_PER_DEGREE_LON = 111320.0
+
+    # Number of iterations to refine the ground intersection with the DEM
+    DEM_ITERATIONS = 3
+
+    # Image corners as fraction of the sensor size
+    CORNERS = np.array([[-.5, .5], [.5, .5], [.5, -.5], [-.5, -.5]])
+
+    def __init__(self, focal_length, sensor_width, sensor_height,
+                 ground_elevation=0.0):
+        """
+        :param focal_length: Focal length of the camera in mm
+        :param sensor_width: Sensor size across flight direction in mm
+        :param sensor_height: Sensor size along flight direction in mm
+        :param ground_elevation: Elevation of the ground in meters, used
+                                 when no DEM is loaded
+        """
+        self.focal_length = focal_length
+        self.sensor_width = sensor_width
+        self.sensor_height = sensor_height
+        self.ground_elevation = ground_elevation
+        self.dem = None
+
+    def load_dem(self, dem_file):
+        """
+        Load a coarse DEM to sample the ground elevation from. The whole
+        raster is read into memory.
+
+        :param dem_file: Path to any raster readable by rasterio
+        """
+        # Only needed with a DEM
+        import rasterio
+        from rasterio.warp import transform
+
+        with rasterio.open(dem_file) as dem:
+            elevation = dem.read(1, masked=True).astype(float).filled(np.nan)
+            self.dem = dict(
+                elevation=elevation,
+                transform=dem.transform,
+                to_dem_crs=lambda lon, lat: transform(
+                    'EPSG:4326', dem.crs, lon, lat
+                ),
+            )
+
+    def sample_ground(self, lon, lat):
+        """
+        Ground elevation at given locations. Locations outside the DEM or
+        without value get the constant ground elevation.
+        """
+        if self.dem is None:
+            return np.full(lon.shape, self.ground_elevation)
+
+        ground = np.full(lon.size, np.nan)
+        valid = np.isfinite(lon.ravel()) & np.isfinite(lat.ravel())
+
+        x, y = self.dem['to_dem_crs'](lon.ravel()[valid], lat.ravel()[valid])
+        column, row = ~self.dem['transform'] * (np.array(x), np.array(y))
+        column = np.floor(column).astype(int)
+        row = np.floor(row).astype(int)
+        elevation = self.dem['elevation']
+
+        inside = \
+            (row >= 0) & (row < elevation.shape[0]) & \
+            (column >= 0) & (column < elevation.shape[1])
+
+        sampled = np.full(len(inside), np.nan)
+        sampled[inside] = elevation[row[inside], column[inside]]
+        ground[valid] = sampled
+        ground[np.isnan(ground)] = self.ground_elevation
+
+        return ground.reshape(lon.shape)
+
+    @staticmethod
+    def tilt(angle):
+        """
+        Deviation from nadir in radians for angles with a reference of either
+        0 or 180 degrees.
+        """
+        return np.radians((np.asarray(angle, dtype=float) + 90) % 180 - 90)
+
+    def corner_rays(self, yaw, pitch, roll):
+        """
+        Direction of the rays through the image corners in east, north and up
+        components.
+
+        :return: Tuple of arrays with shape (images, 4)
+        """
+        x = self.CORNERS[:, 0] * self.sensor_width
+        y = self.CORNERS[:, 1] * self.sensor_height
+        z = np.full(x.shape, -self.focal_length)
+
+        pitch = self.tilt(pitch)[:, np.newaxis]
+        roll = self.tilt(roll)[:, np.newaxis]
+        yaw = np.radians(np.asarray(yaw, dtype=float))[:, np.newaxis]
+
+        # Roll around the flight direction
+        x, z = \
+            x * np.cos(roll) + z * np.sin(roll), \
+            -x * np.sin(roll) + z * np.cos(roll)
+        # Pitch around the across flight direction
+        y, z = \
+            y * np.cos(pitch) - z * np.sin(pitch), \
+            y * np.sin(pitch) + z * np.cos(pitch)
+        # Heading, clockwise from north
+        east = x * np.cos(yaw) + y * np.sin(yaw)
+        north = -x * np.sin(yaw) + y * np.cos(yaw)
+
+        return east, north, z
+
+    def ground_corners(self, images):
+        """
+        Intersect the corner rays of all images with the ground.
+
+        :param images: pandas.DataFrame as returned by ImagesMetaCsv.read_table
+
+        :return: Tuple of longitude and latitude arrays with shape (images, 4)
+        """
+        lon = images.X.to_numpy(dtype=float)[:, np.newaxis]
+        lat = images.Y.to_numpy(dtype=float)[:, np.newaxis]
+        altitude = images.Z.to_numpy(dtype=float)[:, np.newaxis]
+
+        east, north, up = self.corner_rays(
+            images.Yaw.to_numpy(), images.Pitch.to_numpy(),
+            images.Roll.to_numpy(),
+        )
+        lon_scale = self.METERS_PER_DEGREE_LON * np.cos(np.radians(lat))
+
+        ground = self.sample_ground(lon, lat)
+        corner_lon = np.broadcast_to(lon, east.shape)
+        corner_lat = np.broadcast_to(lat, east.shape)
+
+        for _ in range(self.DEM_ITERATIONS if self.dem else 1):
+            distance = (altitude - ground) / -up
+            corner_lon = lon + distance * east / lon_scale
+            corner_lat = lat + distance * north / self.METERS_PER_DEGREE_LAT
+            ground = self.sample_ground(corner_lon, corner_lat)
+
+        return corner_lon, corner_lat
+
+    def footprints(self, images):
+        """
+        :param images: pandas.DataFrame as returned by ImagesMetaCsv.read_table
+
+        :return: Array of shapely polygons, None for images with missing
+                 position or orientation
+        """
+        corner_lon, corner_lat = self.ground_corners(images)
+        valid = np.isfinite(corner_lon).all(axis=1) & \
+            np.isfinite(corner_lat).all(axis=1)
+
+        footprints = np.full(len(images), None, dtype=object)
+        footprints[valid] = shapely.polygons(
+            np.stack([corner_lon[valid], corner_lat[valid]], axis=-1)
+        )
+        return footprints
+
+    @staticmethod
+    def has_footprint(footprints):
+        """
+        :param footprints: Array as returned by footprints
+
+        :return: Boolean array, False for missing or empty footprints
+        """
+        return ~shapely.is_missing(footprints) & ~shapely.is_empty(footprints)
+
+    def intersecting(self, images, polygons, footprints=None):
+        """
+        Check which image footprints intersect any of the given polygons.
+
+        :param images: pandas.DataFrame as returned by ImagesMetaCsv.read_table
+        :param polygons: Array of shapely polygons
+        :param footprints: Optional, footprints of the images already created
+                           with footprints
+
+        :return: Boolean array, True for images seeing the polygons
+        """
+        if footprints is None:
+            footprints = self.footprints(images)
+        tree = shapely.STRtree(polygons)
+        image_index, _polygon_index = tree.query(
+            footprints, predicate='intersects'
+        )
+
+        result = np.zeros(len(images), dtype=bool)
+        result[image_index] = True
+        return result
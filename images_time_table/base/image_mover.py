@@ -0,0 +1,251 @@
+import errno
+import json
+import os
+import shutil
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ImageMover(object):
+    """
+    Move images into a destination folder using a pool of threads.
+
+    Files are renamed when source and destination are on the same file
+    system. Otherwise, they are copied to a temporary file in the
+    destination first and renamed once complete, before the source is
+    removed. Every processed file is recorded in a journal inside the
+    destination folder, which allows to resume an interrupted run or to
+    move all files back to their source.
+
+    A copy is recorded in the journal before it starts. A run interrupted
+    after the copy, but before the source was removed, leaves both files.
+    These are completed on resume or rollback when both files have the same
+    size. Temporary files of interrupted copies are removed.
+    """
+    JOURNAL_FILE = 'filter_files_journal.jsonl'
+    TEMP_SUFFIX = '.moving'
+    DEFAULT_WORKERS = 8
+
+    COPYING = 'copying'
+    RESTORING = 'restoring'
+    MOVED = 'moved'
+    ALREADY_MOVED = 'already moved'
+    MISSING = 'missing'
+    EXISTS = 'exists in destination'
+    FAILED = 'failed'
+    RESTORED = 'restored'
+    WOULD_MOVE = 'would move'
+    WOULD_RESTORE = 'would restore'
+
+    def __init__(self, destination, workers=DEFAULT_WORKERS, dry_run=False):
+        self.destination = destination
+        self.workers = workers
+        self.dry_run = dry_run
+        self.errors = []
+        self._journal_lock = threading.Lock()
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.destination, self.JOURNAL_FILE)
+
+    def destination_path(self, source):
+        return os.path.join(self.destination, os.path.basename(source))
+
+    def read_journal(self):
+        """
+        :return: Dictionary with the last recorded status for each source
+        """
+        entries = {}
+        if not os.path.exists(self.journal_path):
+            return entries
+
+        with open(self.journal_path, 'r') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Incomplete last line of an interrupted run
+                    continue
+                entries[entry['source']] = entry
+
+        return entries
+
+    def record(self, source, status):
+        if self.dry_run:
+            return
+
+        entry = json.dumps(dict(
+            source=source,
+            destination=self.destination_path(source),
+            status=status,
+        ))
+        with self._journal_lock:
+            with open(self.journal_path, 'a') as journal:
+                journal.write(entry + '\n')
+
+    @staticmethod
+    def remove_temp_file(file_path):
+        temp_file = file_path + ImageMover.TEMP_SUFFIX
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    def remove_temp_files(self):
+        """
+        Remove temporary files of interrupted copies in the destination.
+        """
+        if self.dry_run or not os.path.isdir(self.destination):
+            return
+
+        for entry in os.scandir(self.destination):
+            if entry.is_file() and entry.name.endswith(self.TEMP_SUFFIX):
+                os.remove(entry.path)
+
+    @staticmethod
+    def relocate(source, destination, before_copy):
+        """
+        Atomic rename on the same file system, copy and rename otherwise.
+
+        :param before_copy: Function called before a copy starts
+        """
+        try:
+            os.rename(source, destination)
+        except OSError as error:
+            if error.errno != errno.EXDEV:
+                raise
+            before_copy()
+            temp_file = destination + ImageMover.TEMP_SUFFIX
+            shutil.copy2(source, temp_file)
+            os.replace(temp_file, destination)
+            os.remove(source)
+
+    @staticmethod
+    def is_copy(source, destination):
+        return os.path.getsize(source) == os.path.getsize(destination)
+
+    def move_file(self, source, journal):
+        destination = self.destination_path(source)
+        source_exists = os.path.exists(source)
+        destination_exists = os.path.exists(destination)
+        status = journal.get(source, {}).get('status')
+
+        if not source_exists:
+            if destination_exists:
+                if status != self.MOVED:
+                    self.record(source, self.MOVED)
+                return self.ALREADY_MOVED
+            self.record(source, self.MISSING)
+            return self.MISSING
+
+        if destination_exists:
+            if status == self.COPYING and self.is_copy(source, destination):
+                # Interrupted before the source was removed
+                if self.dry_run:
+                    return self.WOULD_MOVE
+                os.remove(source)
+                self.record(source, self.MOVED)
+                return self.MOVED
+            self.errors.append((source, 'Destination file already exists'))
+            return self.EXISTS
+
+        if self.dry_run:
+            return self.WOULD_MOVE
+
+        self.relocate(
+            source, destination, lambda: self.record(source, self.COPYING)
+        )
+        self.record(source, self.MOVED)
+        return self.MOVED
+
+    def restore_file(self, source, journal):
+        destination = self.destination_path(source)
+        status = journal[source]['status']
+
+        if not os.path.exists(destination):
+            if status != self.MOVED and os.path.exists(source):
+                # Copy never completed or interrupted restore
+                if not self.dry_run:
+                    self.record(source, self.RESTORED)
+                return self.RESTORED
+            return self.MISSING
+        if os.path.exists(source):
+            if status in [self.COPYING, self.RESTORING] and \
+                    self.is_copy(source, destination):
+                # Interrupted before the copy in the destination was removed
+                if self.dry_run:
+                    return self.WOULD_RESTORE
+                os.remove(destination)
+                self.record(source, self.RESTORED)
+                return self.RESTORED
+            self.errors.append((source, 'Source file already exists'))
+            return self.EXISTS
+        if self.dry_run:
+            return self.WOULD_RESTORE
+
+        self.remove_temp_file(source)
+        self.relocate(
+            destination, source, lambda: self.record(source, self.RESTORING)
+        )
+        self.record(source, self.RESTORED)
+        return self.RESTORED
+
+    def run(self, action, sources):
+        summary = Counter()
+
+        def run_action(source):
+            try:
+                return action(source)
+            except OSError as error:
+                self.errors.append((source, str(error)))
+                return self.FAILED
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for status in executor.map(run_action, sources):
+                summary[status] += 1
+
+        return summary
+
+    def move(self, sources):
+        """
+        Move all given files into the destination. Files recorded as moved
+        in the journal of a previous run are skipped.
+
+        :param sources: Paths of the files to move
+
+        :return: collections.Counter with the number of files per status
+        """
+        journal = self.read_journal()
+        self.remove_temp_files()
+        return self.run(
+            lambda source: self.move_file(source, journal), sources
+        )
+
+    def rollback(self):
+        """
+        Move all files recorded as moved in the journal back to their source.
+        Files of interrupted copies are restored too.
+
+        :return: collections.Counter with the number of files per status
+        """
+        journal = self.read_journal()
+        self.remove_temp_files()
+        sources = [
+            source for source, entry in journal.items()
+            if entry['status'] in [self.MOVED, self.COPYING, self.RESTORING]
+        ]
+        return self.run(
+            lambda source: self.restore_file(source, journal), sources
+        )
+
+    def print_summary(self, summary):
+        if self.dry_run:
+            print('Dry run - no files were changed')
+
+        for status, count in sorted(summary.items()):
+            print('  ' + status + ': ' + str(count))
+
+        for source, error in self.errors:
+            print('**** ' + source + ': ' + error)
+
+        if not self.dry_run:
+            print('Journal: ' + self.journal_path)
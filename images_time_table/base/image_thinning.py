@@ -0,0 +1,164 @@
+import numpy as np
+import pandas
+import shapely
+
+from images_time_table.base import ImagesMetaCsv
+
+
+class ImageThinning(object):
+    """
+    Reduce images with more overlap than needed for the alignment.
+
+    Images are split into flight lines by time gaps and heading changes.
+    Along each line, images are dropped as long as the following image
+    still overlaps the last kept image by the target forward overlap. A whole
+    line is dropped when its images already overlap the kept images of
+    other lines by more than the target side overlap, i.e. a repeated pass.
+
+    Overlap is the fraction of the footprint area covered by the other
+    footprint. Overlapping footprints across lines are found with a
+    spatial index.
+    """
+    FORWARD_OVERLAP = 0.7
+    SIDE_OVERLAP = 0.8
+
+    # Start a new flight line after a gap in seconds or a change in heading
+    LINE_TIME_GAP = 10.0
+    LINE_HEADING_CHANGE = 30.0
+
+    LINE_COLUMN = 'Line'
+    KEEP_COLUMN = 'Keep'
+    FORWARD_COLUMN = 'Forward Overlap'
+    SIDE_COLUMN = 'Side Overlap'
+    REPORT_FILE = 'images_overlap_report.csv'
+
+    def __init__(self, footprints, forward_overlap=FORWARD_OVERLAP,
+                 side_overlap=SIDE_OVERLAP):
+        """
+        :param footprints: ImageFootprints instance with the camera model
+        :param forward_overlap: Target overlap along a flight line
+        :param side_overlap: Target overlap between flight lines
+        """
+        self.footprints = footprints
+        self.forward_overlap = forward_overlap
+        self.side_overlap = side_overlap
+
+    @staticmethod
+    def overlap(footprints, others):
+        """
+        Fraction of each footprint covered by the other at same position.
+        """
+        return shapely.area(shapely.intersection(footprints, others)) / \
+            shapely.area(footprints)
+
+    def flight_lines(self, images):
+        """
+        Number the flight lines, with images ordered by time.
+
+        :return: Array with the flight line for each image
+        """
+        time_gap = np.diff(images[ImagesMetaCsv.TIME_COLUMN].to_numpy())
+        heading_change = np.abs(
+            (np.diff(images.Yaw.to_numpy()) + 180) % 360 - 180
+        )
+
+        new_line = (time_gap > self.LINE_TIME_GAP) | \
+            (heading_change > self.LINE_HEADING_CHANGE)
+        return np.concatenate([[0], np.cumsum(new_line)])
+
+    def thin_line(self, footprints):
+        """
+        Thin images along one flight line, ordered by time. Of the images
+        following a kept image, the last one that still overlaps it by the
+        target forward overlap is kept next.
+
+        :return: Tuple of the keep mask and the forward overlap of kept
+                 images with the previously kept one
+        """
+        keep = np.zeros(len(footprints), dtype=bool)
+        forward = np.full(len(footprints), np.nan)
+        keep[0] = True
+        last_kept = 0
+
+        for index in range(1, len(footprints)):
+            if index < len(footprints) - 1 and self.overlap(
+                footprints[index + 1], footprints[last_kept]
+            ) >= self.forward_overlap:
+                continue
+
+            keep[index] = True
+            forward[index] = self.overlap(
+                footprints[index], footprints[last_kept]
+            )
+            last_kept = index
+
+        return keep, forward
+
+    def side_overlaps(self, footprints, lines):
+        """
+        Largest overlap of each image with an image from another line.
+
+        :return: Tuple of the image pairs across lines and their overlap
+        """
+        tree = shapely.STRtree(footprints)
+        image, other = tree.query(footprints, predicate='intersects')
+        across = lines[image] != lines[other]
+        image, other = image[across], other[across]
+
+        return image, other, self.overlap(footprints[image], footprints[other])
+
+    def thin(self, images):
+        """
+        :param images: pandas.DataFrame as returned by ImagesMetaCsv.read_table
+
+        :return: pandas.DataFrame with the flight line, whether to keep the
+                 image and the kept forward and side overlap for each image
+        """
+        order = np.argsort(
+            images[ImagesMetaCsv.TIME_COLUMN].to_numpy(), kind='stable'
+        )
+        images = images.iloc[order]
+        footprints = self.footprints.footprints(images)
+        has_footprint = np.not_equal(footprints, None)
+
+        lines = np.full(len(images), -1)
+        lines[has_footprint] = self.flight_lines(images[has_footprint])
+
+        # Images without footprint are always kept
+        keep = ~has_footprint
+        forward = np.full(len(images), np.nan)
+        for line in np.unique(lines[has_footprint]):
+            in_line = np.flatnonzero(lines == line)
+            keep[in_line], forward[in_line] = self.thin_line(
+                footprints[in_line]
+            )
+
+        # Drop lines covered by the kept images of previous lines
+        side = np.full(len(images), np.nan)
+        kept = np.flatnonzero(keep & has_footprint)
+        image, other, overlap = self.side_overlaps(
+            footprints[kept], lines[kept]
+        )
+        image, other = kept[image], kept[other]
+        for line in np.unique(lines[kept]):
+            pairs = (lines[image] == line) & (lines[other] < line) & \
+                keep[other]
+            line_overlap = pandas.Series(overlap[pairs]) \
+                .groupby(image[pairs]).max()
+            side[line_overlap.index] = line_overlap.to_numpy()
+
+            in_line = kept[lines[kept] == line]
+            if len(line_overlap) == len(in_line) and \
+                    np.median(line_overlap) > self.side_overlap:
+                keep[in_line] = False
+
+        report = pandas.DataFrame({
+            ImagesMetaCsv.FILE_COLUMN:
+                images[ImagesMetaCsv.FILE_COLUMN].to_numpy(),
+            self.LINE_COLUMN: lines,
+            self.KEEP_COLUMN: keep,
+            self.FORWARD_COLUMN: forward,
+            self.SIDE_COLUMN: side,
+        }, index=images.index)
+
+        return report.loc[np.sort(images.index)]
@@ -1,6 +1,9 @@
 import csv
+import numbers
 import os
 
+import pandas
+
 
 class ImagesMetaCsv(object):
     FILE_COLUMN = 'Filename'
@@ -18,6 +21,11 @@ class ImagesMetaCsv(object):
 
     CSV_OUTPUT_FILE = 'images_metadata.csv'
 
+    # Columns written with a fixed number of decimal places for float values
+    DECIMAL_COLUMNS = ['X', 'Y', 'Z', 'Yaw', 'Pitch', 'Roll']
+    # Same as the '%lf' output of the SBET converter
+    DECIMAL_PLACES = 6
+
     @staticmethod
     def read_file(file):
         with open(file, mode='r') as csv_file:
@@ -27,11 +35,92 @@ class ImagesMetaCsv(object):
                 yield row
 
     @staticmethod
-    def write_output_file(base_path, images_data):
+    def read_table(file, as_text=False):
+        """
+        Read the whole file into a pandas.DataFrame, with float values
+        for the coordinate and orientation columns.
+
+        :param as_text: Keep all values as in the file, to write selected
+                        rows back unchanged
+        """
+        if as_text:
+            return pandas.read_csv(
+                file,
+                header=0,
+                names=ImagesMetaCsv.RESULT_KEYS,
+                dtype=str,
+                keep_default_na=False,
+            )
+
+        return pandas.read_csv(
+            file,
+            header=0,
+            names=ImagesMetaCsv.RESULT_KEYS,
+            dtype={column: float for column in ImagesMetaCsv.DECIMAL_COLUMNS},
+        )
+
+    @staticmethod
+    def parse_decimal_places(value):
+        """
+        Parse the decimal places for the coordinate and orientation columns.
+        Either one number for all columns, or a comma separated list of
+        column names with their number, i.e. 'X=9,Y=9'. Columns not listed
+        use the default DECIMAL_PLACES.
+
+        :return: Dictionary with the decimal places per column
+        """
+        decimal_places = dict.fromkeys(
+            ImagesMetaCsv.DECIMAL_COLUMNS, ImagesMetaCsv.DECIMAL_PLACES
+        )
+        if '=' not in value:
+            return dict.fromkeys(ImagesMetaCsv.DECIMAL_COLUMNS, int(value))
+
+        for column_places in value.split(','):
+            column, places = column_places.split('=')
+            if column not in decimal_places:
+                raise ValueError('Unknown column: ' + column)
+            decimal_places[column] = int(places)
+
+        return decimal_places
+
+    @staticmethod
+    def format_column(values, decimal_places):
+        """
+        Format float values of a column with given number of decimal places.
+        """
+        return [
+            '{:.{}f}'.format(value, decimal_places)
+            if isinstance(value, numbers.Real) else value
+            for value in values
+        ]
+
+    @staticmethod
+    def write_output_file(base_path, images_data, decimal_places=None):
+        """
+        Write the images metadata CSV under the given base path.
+
+        :param base_path: Directory to write the CSV file to
+        :param images_data: pandas.DataFrame with the images table
+        :param decimal_places: Optional, dictionary with the number of decimal
+                               places for float values per column. Values
+                               are written as given when not set.
+        """
         csv_file = os.path.join(base_path, ImagesMetaCsv.CSV_OUTPUT_FILE)
         print('Writing CSV file to:')
         print('    ' + str(csv_file))
+
+        decimal_places = decimal_places or {}
+        columns = [
+            ImagesMetaCsv.format_column(images_data[key], decimal_places[key])
+            if key in decimal_places else images_data[key]
+            for key in ImagesMetaCsv.RESULT_KEYS
+        ]
+
         with open(csv_file, 'w') as csv_file:
-            writer = csv.DictWriter(csv_file, **ImagesMetaCsv.CSV_OPTIONS)
-            writer.writeheader()
-            writer.writerows(images_data)
+            writer = csv.writer(
+                csv_file,
+                delimiter=ImagesMetaCsv.CSV_OPTIONS['delimiter'],
+                lineterminator=ImagesMetaCsv.CSV_OPTIONS['lineterminator'],
+            )
+            writer.writerow(ImagesMetaCsv.RESULT_KEYS)
+            writer.writerows(zip(*columns))
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class SbetCache(object):
+    """
+    Sidecar cache for a SBET file. Holds a binary array of records next to
+    the source file along with a key file that describes the source.
+
+    The cache is valid as long as the size, modification time and content
+    hash of the source match. A source with a new modification time, but
+    the same content hash, keeps the cache and only updates the key.
+    """
+    VERSION = 2
+    CACHE_SUFFIX = '.cache.npy'
+    KEY_SUFFIX = '.cache.json'
+    HASH_BLOCK_SIZE = 2 ** 20
+
+    def __init__(self, source_file):
+        self.source_file = source_file
+        self.cache_file = source_file + self.CACHE_SUFFIX
+        self.key_file = source_file + self.KEY_SUFFIX
+
+    def file_stat(self):
+        stat = os.stat(self.source_file)
+        return dict(size=stat.st_size, mtime=stat.st_mtime_ns)
+
+    def file_hash(self):
+        content_hash = hashlib.sha256()
+        with open(self.source_file, 'rb') as source:
+            for block in iter(
+                lambda: source.read(self.HASH_BLOCK_SIZE), b''
+            ):
+                content_hash.update(block)
+
+        return content_hash.hexdigest()
+
+    def read_key(self):
+        if not os.path.exists(self.key_file) or \
+                not os.path.exists(self.cache_file):
+            return None
+
+        with open(self.key_file, 'r') as key_file:
+            try:
+                return json.load(key_file)
+            except ValueError:
+                return None
+
+    def write_key(self, key):
+        self.replace_file(
+            self.key_file, lambda file: json.dump(key, file), mode='w'
+        )
+
+    @staticmethod
+    def replace_file(file_path, write, mode='wb'):
+        """
+        Write to a temporary file first, so other processes reading the
+        cache never see a partially written file.
+        """
+        temp_file = file_path + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_file, mode) as file:
+            write(file)
+        os.replace(temp_file, file_path)
+
+    def load(self):
+        """
+        Load the cached records when the cache matches the source.
+
+        :return: Tuple with the records as read-only memory map and the
+                 metadata given when saved. None for a missing or
+                 outdated cache.
+        """
+        key = self.read_key()
+        if key is None or key.get('version') != self.VERSION:
+            return None
+
+        stat = self.file_stat()
+        if key.get('size') != stat['size']:
+            return None
+
+        if key.get('mtime') != stat['mtime']:
+            if key.get('hash') != self.file_hash():
+                return None
+            key['mtime'] = stat['mtime']
+            try:
+                self.write_key(key)
+            except OSError:
+                pass
+
+        return np.load(self.cache_file, mmap_mode='r'), key['metadata']
+
+    def save(self, records, **metadata):
+        """
+        Save given records along with the key of the source file.
+        The records are only kept in memory when the cache can't be written.
+
+        :param records: numpy.ndarray to store
+        :param metadata: Values returned with the records on load
+
+        :return: Tuple with the records and metadata, same as load
+        """
+        key = dict(
+            version=self.VERSION,
+            hash=self.file_hash(),
+            metadata=metadata,
+            **self.file_stat()
+        )
+
+        try:
+            self.replace_file(
+                self.cache_file, lambda file: np.save(file, records)
+            )
+            self.write_key(key)
+        except OSError as error:
+            print('**** Could not write SBET cache: ' + str(error))
+            return records, metadata
+
+        return np.load(self.cache_file, mmap_mode='r'), metadata
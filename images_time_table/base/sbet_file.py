@@ -2,9 +2,10 @@ import datetime
 import decimal
 import os
 
+import numpy as np
 import pandas
 
-from images_time_table.base import ImagesMetaCsv
+from images_time_table.base import ImagesMetaCsv, SbetCache
 
 
 class SbetFile(object):
@@ -24,16 +25,260 @@ class SbetFile(object):
         'Pitch': decimal.Decimal,
         'Heading': decimal.Decimal,
     }
+    SBET_CSV_COLUMNS = [GPS_COLUMN, 'X', 'Y', 'Z', 'Heading', 'Roll', 'Pitch']
 
-    def __init__(self, base_path):
+    # Layout of one record in the binary SBET file from Applanix.
+    # Same as the record_type struct in bin/extract_cols_from_sbet.c
+    SBET_RECORD_DTYPE = np.dtype([
+        ('time', '<f8'),
+        ('lat', '<f8'),         # in radians
+        ('lon', '<f8'),         # in radians
+        ('alt', '<f8'),
+        ('x_vel', '<f8'),
+        ('y_vel', '<f8'),
+        ('z_vel', '<f8'),
+        ('roll', '<f8'),        # in radians
+        ('pitch', '<f8'),       # in radians
+        ('heading', '<f8'),     # in radians
+        ('wander', '<f8'),
+        ('x_force', '<f8'),
+        ('y_force', '<f8'),
+        ('z_force', '<f8'),
+        ('x_ang_rate', '<f8'),
+        ('y_ang_rate', '<f8'),
+        ('z_ang_rate', '<f8'),
+    ])
+    SBET_RECORD_FIELDS = {
+        GPS_COLUMN: 'time',
+        'X': 'lon',
+        'Y': 'lat',
+        'Z': 'alt',
+        'Heading': 'heading',
+        'Roll': 'roll',
+        'Pitch': 'pitch',
+    }
+    SBET_RADIAN_FIELDS = ['lat', 'lon', 'roll', 'pitch', 'heading']
+    # Values are rounded like the '%lf' output of extract_cols_from_sbet
+    SBET_VALUE_FORMAT = '%f'
+
+    # Rows per chunk when streaming the CSV file
+    SBET_CSV_CHUNK_SIZE = 10 ** 6
+    # Seconds of SBET records kept around each image when streaming
+    SBET_TIME_MARGIN = 1.0
+
+    # Cached CSV records hold the parsed values of all columns and the
+    # original text of the decimal columns, sorted by GPS time
+    SBET_CACHE_TEXT_SUFFIX = '_text'
+
+    def __init__(self, base_path, sbet_file=None, numeric=False,
+                 use_cache=True, image_times=None):
+        """
+        :param base_path: Root directory of the basin
+        :param sbet_file: Optional path to the SBET file. Files not ending
+                          with .csv are read as Applanix binary format.
+                          Default: SBET/sbet.csv under the base path
+        :param numeric: Return record values as float64 instead of
+                        decimal.Decimal
+        :param use_cache: Read a CSV file through a binary cache that is
+                          stored next to the file. Decimal values are
+                          restored from their original text, same as read
+                          from the CSV file. See SbetCache.
+        :param image_times: Optional, timestamps of all images. A CSV file is
+                            then read in chunks, keeping only the records
+                            around the images. Takes precedence over the
+                            cache.
+        """
         print('Loading IMU data')
-        self.file_path = self.csv_file_path(base_path)
+        self.file_path = sbet_file or self.csv_file_path(base_path)
+        self.numeric = numeric
+
+        self.sbet_table = None
+        self.sbet_data = None
+        self.record_fields = None
+        self.text_fields = {}
+        self.round_gps_time = False
+
+        if self.is_binary_file(self.file_path):
+            self.load_binary()
+        elif image_times is not None:
+            self.load_csv_windows(image_times)
+        elif use_cache:
+            self.load_csv_cache()
+        else:
+            self.load_csv()
+
+        self.index_gps_time()
+
+    def load_binary(self):
+        self.sbet_data = np.memmap(
+            self.file_path, dtype=self.SBET_RECORD_DTYPE, mode='r'
+        )
+        self.record_fields = self.SBET_RECORD_FIELDS
+        self.round_gps_time = not self.numeric
+        self.gps_time = self.sbet_data['time']
+        self.first_gps_time = self.gps_time[0]
+        self.last_gps_time = self.gps_time[-1]
+
+    def load_csv(self):
         self.sbet_table = pandas.read_csv(
             self.file_path,
             header=0,
-            dtype={ self.GPS_COLUMN: float },
-            converters=self.SBET_CSV_DTYPES,
+            **self.csv_options()
         )
+        self.gps_time = self.sbet_table[self.GPS_COLUMN].to_numpy()
+        self.first_gps_time = self.gps_time[0]
+        self.last_gps_time = self.gps_time[-1]
+
+    def csv_gps_time_range(self):
+        """
+        Read the GPS time of the first and last record from the CSV file
+        without parsing the records in between.
+        """
+        with open(self.file_path, 'rb') as csv_file:
+            csv_file.readline()  # Skip header
+            first_line = csv_file.readline()
+
+            csv_file.seek(0, os.SEEK_END)
+            position = csv_file.tell()
+            last_line = b''
+            while position > 0 and last_line.count(b'\n') < 2:
+                block_size = min(position, 4096)
+                position -= block_size
+                csv_file.seek(position)
+                last_line = csv_file.read(block_size) + last_line
+            last_line = last_line.rstrip(b'\r\n').split(b'\n')[-1]
+
+        return float(first_line.split(b',')[0]), \
+            float(last_line.split(b',')[0])
+
+    def gps_time_windows(self, image_times):
+        """
+        GPS week time windows that can hold a SBET record for the given
+        image times. Covers the lookup for the first and last day of the
+        SBET file, with SBET_TIME_MARGIN seconds around each image.
+
+        :return: Tuple of arrays with the start and end of merged windows
+        """
+        image_times = np.asarray(image_times, dtype=float)
+        image_times = image_times[~np.isnan(image_times)]
+
+        gps_week_times = np.sort(np.concatenate([
+            self.get_gps_day_of_week() + image_times + self.GPS_LEAP_SECONDS,
+            self.get_gps_day_of_week(False) + image_times +
+            self.GPS_LEAP_SECONDS,
+        ]))
+        starts = gps_week_times - self.SBET_TIME_MARGIN
+        ends = np.maximum.accumulate(gps_week_times + self.SBET_TIME_MARGIN)
+        if len(starts) == 0:
+            return starts, ends
+
+        # A new window begins where all previous ones ended before
+        new_window = np.ones(len(starts), dtype=bool)
+        new_window[1:] = starts[1:] > ends[:-1]
+        window_ends = np.append(np.flatnonzero(new_window)[1:] - 1, -1)
+
+        return starts[new_window], ends[window_ends]
+
+    @staticmethod
+    def in_windows(gps_time, windows):
+        starts, ends = windows
+        if len(starts) == 0:
+            return np.zeros(len(gps_time), dtype=bool)
+
+        window = np.searchsorted(starts, gps_time, side='right') - 1
+        return (window >= 0) & (gps_time <= ends[np.clip(window, 0, None)])
+
+    def load_csv_windows(self, image_times):
+        """
+        Stream the CSV file in chunks and only keep the records inside the
+        GPS time windows of the images. Values are parsed to decimals for
+        the kept records only.
+        """
+        self.first_gps_time, self.last_gps_time = self.csv_gps_time_range()
+        windows = self.gps_time_windows(image_times)
+
+        if self.numeric:
+            dtype = float
+        else:
+            dtype = {column: str for column in self.SBET_CSV_DTYPES}
+            dtype[self.GPS_COLUMN] = float
+
+        chunks = [
+            chunk[self.in_windows(chunk[self.GPS_COLUMN].to_numpy(), windows)]
+            for chunk in pandas.read_csv(
+                self.file_path,
+                header=0,
+                dtype=dtype,
+                engine='c',
+                chunksize=self.SBET_CSV_CHUNK_SIZE,
+            )
+        ]
+        self.sbet_table = pandas.concat(chunks, ignore_index=True)
+
+        if not self.numeric:
+            for column, converter in self.SBET_CSV_DTYPES.items():
+                self.sbet_table[column] = pandas.Series(
+                    [converter(value) for value in self.sbet_table[column]],
+                    dtype=object,
+                )
+
+        self.gps_time = self.sbet_table[self.GPS_COLUMN].to_numpy()
+
+    def load_csv_cache(self):
+        """
+        Load the records of a CSV file from the cache. The cache is created
+        with all records sorted by GPS time when missing or outdated.
+        """
+        cache = SbetCache(self.file_path)
+        cached = cache.load()
+
+        if cached is None:
+            print('Creating SBET cache')
+            sbet_table = pandas.read_csv(
+                self.file_path, header=0, dtype=float, engine='c'
+            )
+            sbet_text = pandas.read_csv(
+                self.file_path, header=0, dtype=str, engine='c',
+                usecols=list(self.SBET_CSV_DTYPES),
+            )
+            gps_time = sbet_table[self.GPS_COLUMN].to_numpy()
+            order = np.argsort(gps_time, kind='stable')
+
+            texts = {
+                column: sbet_text[column].to_numpy(dtype=bytes)[order]
+                for column in self.SBET_CSV_DTYPES
+            }
+            records = np.empty(len(sbet_table), dtype=np.dtype(
+                [(column, '<f8') for column in self.SBET_CSV_COLUMNS] +
+                [(self.text_field(column), values.dtype)
+                 for column, values in texts.items()]
+            ))
+            for column in self.SBET_CSV_COLUMNS:
+                records[column] = sbet_table[column].to_numpy()[order]
+            for column, values in texts.items():
+                records[self.text_field(column)] = values
+
+            cached = cache.save(
+                records,
+                first_gps_time=float(gps_time[0]),
+                last_gps_time=float(gps_time[-1]),
+            )
+
+        self.sbet_data, metadata = cached
+        self.record_fields = {
+            column: column for column in self.SBET_CSV_COLUMNS
+        }
+        self.text_fields = {
+            column: self.text_field(column)
+            for column in self.SBET_CSV_DTYPES
+        }
+        self.gps_time = self.sbet_data[self.GPS_COLUMN]
+        self.first_gps_time = metadata['first_gps_time']
+        self.last_gps_time = metadata['last_gps_time']
+
+    @classmethod
+    def text_field(cls, column):
+        return column + cls.SBET_CACHE_TEXT_SUFFIX
 
     @staticmethod
     def csv_file_path(base_path):
@@ -41,6 +286,19 @@ class SbetFile(object):
             base_path, SbetFile.SBET_DIR, SbetFile.SBET_CSV_FILE_NAME
         )
 
+    def csv_options(self):
+        if self.numeric:
+            return dict(dtype=float, engine='c')
+
+        return dict(
+            dtype={ self.GPS_COLUMN: float },
+            converters=self.SBET_CSV_DTYPES,
+        )
+
+    @staticmethod
+    def is_binary_file(file_path):
+        return not file_path.lower().endswith('.csv')
+
     @staticmethod
     def yaw_to_360(yaw):
         return yaw + 360 if yaw < 0 else yaw
@@ -56,69 +314,252 @@ class SbetFile(object):
         :return: Number of seconds for calculated day
         """
         if first_entry:
-            sbet_entry = self.sbet_table.iloc[0][self.GPS_COLUMN]
+            sbet_entry = self.first_gps_time
         else:
-            sbet_entry = self.sbet_table.iloc[-1][self.GPS_COLUMN]
+            sbet_entry = self.last_gps_time
 
         days = datetime.timedelta(seconds=float(sbet_entry)).days
         return datetime.timedelta(days=days).total_seconds()
 
-    def find_sbet_record(self, row_time):
-        time = self.sbet_table[
-            (self.sbet_table[
-                 self.GPS_COLUMN] > row_time - self.GPS_TIME_WINDOW) &
-            (self.sbet_table[self.GPS_COLUMN] < row_time + self.GPS_TIME_WINDOW)
-            ]
+    def index_gps_time(self):
+        """
+        Prepare the GPS times for a binary search. SBET files are written in
+        time order, in which case the GPS times are used as they are and no
+        copy is created. Otherwise, a sorted copy along with the sort order
+        is kept.
+        """
+        if np.all(self.gps_time[1:] >= self.gps_time[:-1]):
+            self.gps_time_order = None
+            self.gps_time_sorted = self.gps_time
+        else:
+            self.gps_time_order = np.argsort(self.gps_time, kind='stable')
+            self.gps_time_sorted = self.gps_time[self.gps_time_order]
+
+    def table_positions(self, sorted_positions):
+        if self.gps_time_order is None:
+            return sorted_positions
+        return self.gps_time_order[sorted_positions]
 
-        min_diff = (abs(time[self.GPS_COLUMN] - row_time))
+    def find_sbet_records(self, row_times):
+        """
+        Find the closest SBET record within the GPS_TIME_WINDOW for all given
+        times in one pass over the sorted GPS times. Only the nearest records
+        below and above each time can qualify. On equal distance, the record
+        with the lower position in the SBET file is chosen.
 
-        if len(min_diff) == 0:
+        :param row_times: GPS week times to look up
+
+        :return: Positions in the SBET table, -1 where no record was found
+        """
+        row_times = np.asarray(row_times, dtype=float)
+        sorted_times = self.gps_time_sorted
+        if len(sorted_times) == 0:
+            return np.full(row_times.shape, -1)
+
+        lower_bound = row_times - self.GPS_TIME_WINDOW
+        upper_bound = row_times + self.GPS_TIME_WINDOW
+        last_index = len(sorted_times) - 1
+
+        above = np.searchsorted(sorted_times, row_times, side='left')
+        below = above - 1
+        above = np.clip(above, 0, last_index)
+        below = np.clip(below, 0, last_index)
+
+        time_above = sorted_times[above]
+        time_below = sorted_times[below]
+        # First occurrence in case of duplicate GPS times
+        below = np.searchsorted(sorted_times, time_below, side='left')
+
+        in_window_above = \
+            (time_above > lower_bound) & (time_above < upper_bound) & \
+            (time_above >= row_times)
+        in_window_below = \
+            (time_below > lower_bound) & (time_below < upper_bound) & \
+            (time_below < row_times)
+
+        position_above = self.table_positions(above)
+        position_below = self.table_positions(below)
+        diff_above = abs(time_above - row_times)
+        diff_below = abs(time_below - row_times)
+
+        use_above = in_window_above & (
+            ~in_window_below |
+            (diff_above < diff_below) |
+            ((diff_above == diff_below) & (position_above < position_below))
+        )
+
+        return np.where(
+            use_above,
+            position_above,
+            np.where(in_window_below, position_below, -1)
+        )
+
+    def sbet_records(self, positions):
+        """
+        Get the SBET records at given positions with the same columns and
+        value types as read from the CSV file. For binary and cached SBET
+        files, only the requested records are read and converted. Decimals
+        of cached files are created from the original text.
+
+        :param positions: Positions in the SBET file
+
+        :return: pandas.DataFrame with one row per given position
+        """
+        if self.sbet_table is not None:
+            return self.sbet_table.iloc[positions].reset_index(drop=True)
+
+        records = self.sbet_data[positions]
+        sbet_records = {}
+
+        for column, field in self.record_fields.items():
+            values = records[field]
+            if field in self.SBET_RADIAN_FIELDS:
+                values = np.degrees(values)
+
+            if column == self.GPS_COLUMN:
+                if self.round_gps_time:
+                    values = [
+                        float(self.SBET_VALUE_FORMAT % value)
+                        for value in values
+                    ]
+            elif not self.numeric:
+                if column in self.text_fields:
+                    values = [
+                        decimal.Decimal(value.decode())
+                        for value in records[self.text_fields[column]]
+                    ]
+                else:
+                    values = [
+                        decimal.Decimal(self.SBET_VALUE_FORMAT % value)
+                        for value in values
+                    ]
+
+            sbet_records[column] = values
+
+        return pandas.DataFrame(sbet_records, columns=self.SBET_CSV_COLUMNS)
+
+    def find_sbet_record(self, row_time):
+        position = self.find_sbet_records([row_time])[0]
+
+        if position < 0:
             return []
 
-        return self.sbet_table.iloc[min_diff.idxmin()]
+        return self.sbet_records([position]).iloc[0]
 
     @staticmethod
-    def update_row(row, values):
-        for key, value in zip(ImagesMetaCsv.RESULT_KEYS, values):
-            row[key] = value
-        return row
+    def row_table(row):
+        return pandas.DataFrame(
+            [row], columns=ImagesMetaCsv.RESULT_KEYS, dtype=object
+        )
 
-    def gps_week_time_for_row(self, row, first_entry=True):
-        return self.get_gps_day_of_week(first_entry) + \
-               row.get(ImagesMetaCsv.TIME_COLUMN) + \
-               self.GPS_LEAP_SECONDS
+    def imu_data_for_table(self, images_time_table):
+        """
+        Resolve the SBET records for all images at once. Images that have no
+        record based on the first day in the SBET file are looked up again
+        with the last day, covering flights past midnight GPS time.
 
-    def imu_data_for_row(self, row):
-        gps_week_time = self.gps_week_time_for_row(row)
+        :param images_time_table: Images table as created by EifData
+
+        :return: Tuple with the positions in the SBET table (-1 for images
+                 without record) and the GPS week time for each image
+        """
+        image_times = images_time_table[ImagesMetaCsv.TIME_COLUMN].to_numpy(
+            dtype=float
+        )
 
-        sbet_record = self.find_sbet_record(gps_week_time)
-        if len(sbet_record) == 0:
-            gps_week_time = self.gps_week_time_for_row(row, False)
-            sbet_record = self.find_sbet_record(gps_week_time)
+        gps_week_times = self.get_gps_day_of_week() + image_times + \
+            self.GPS_LEAP_SECONDS
+        positions = self.find_sbet_records(gps_week_times)
 
-        return sbet_record, gps_week_time
+        not_found = positions < 0
+        if not_found.any():
+            gps_week_times[not_found] = \
+                self.get_gps_day_of_week(False) + image_times[not_found] + \
+                self.GPS_LEAP_SECONDS
+            positions[not_found] = self.find_sbet_records(
+                gps_week_times[not_found]
+            )
 
-    def set_imu_data_for_row(self, row):
-        sbet_record, gps_week_time = self.imu_data_for_row(row)
-
-        if len(sbet_record) > 0:
-            result = [
-                row.get(ImagesMetaCsv.FILE_COLUMN),
-                sbet_record.X,
-                sbet_record.Y,
-                sbet_record.Z,
-                self.yaw_to_360(sbet_record.Heading),
-                sbet_record.Pitch,
-                sbet_record.Roll,
-                gps_week_time - sbet_record[self.GPS_COLUMN],
-                row.get(ImagesMetaCsv.TIME_COLUMN),
-                row.get(ImagesMetaCsv.TIME_OF_DAY)
-            ]
+        return positions, gps_week_times
+
+    def imu_data_for_row(self, row):
+        positions, gps_week_times = self.imu_data_for_table(
+            self.row_table(row)
+        )
+
+        if positions[0] < 0:
+            sbet_record = []
         else:
-            result = []
+            sbet_record = self.sbet_records(positions[:1]).iloc[0]
+
+        return sbet_record, gps_week_times[0]
+
+    def set_imu_data(self, images_time_table):
+        """
+        Update the images table with the position and orientation from
+        the matching SBET records. Images without a record stay unchanged.
+
+        :param images_time_table: Images table as created by EifData
+
+        :return: The updated images table
+        """
+        positions, gps_week_times = self.imu_data_for_table(images_time_table)
+        found = np.flatnonzero(positions >= 0)
+        rows = images_time_table.index[found]
+        sbet_records = self.sbet_records(positions[found])
+
+        heading = sbet_records.Heading.to_numpy()
+        for column, values in [
+            ('X', sbet_records.X.to_numpy()),
+            ('Y', sbet_records.Y.to_numpy()),
+            ('Z', sbet_records.Z.to_numpy()),
+            ('Yaw', np.where(heading < 0, heading + 360, heading)),
+            ('Pitch', sbet_records.Pitch.to_numpy()),
+            ('Roll', sbet_records.Roll.to_numpy()),
+            ('Time Diff', gps_week_times[found] -
+             sbet_records[self.GPS_COLUMN].to_numpy()),
+        ]:
+            self.set_column_values(images_time_table, column, rows, values)
+
+        return images_time_table
 
-        return self.update_row(row, result)
+    def set_altitude(self, images_time_table):
+        """
+        Update the images table with the altitude from the matching SBET
+        records. Images without a record stay unchanged.
+
+        :param images_time_table: Images table as created by EifData
+
+        :return: The updated images table
+        """
+        positions, _gps_week_times = self.imu_data_for_table(images_time_table)
+        found = np.flatnonzero(positions >= 0)
+        sbet_records = self.sbet_records(positions[found])
+
+        self.set_column_values(
+            images_time_table,
+            'Z',
+            images_time_table.index[found],
+            sbet_records.Z.to_numpy(),
+        )
+
+        return images_time_table
+
+    @staticmethod
+    def set_column_values(images_time_table, column, rows, values):
+        """
+        Set values for given rows of a column. Columns holding a mix of
+        types, i.e. the empty altitude from EifData, keep their object type.
+        """
+        if images_time_table[column].dtype == object:
+            values = values.astype(object)
+        images_time_table.loc[rows, column] = values
+
+    def set_imu_data_for_row(self, row):
+        table = self.set_imu_data(self.row_table(row))
+        row.update(table.iloc[0].to_dict())
+        return row
 
     def set_altitude_for_row(self, row):
-        sbet_record, gps_week_time = self.imu_data_for_row(row)
-        row['Z'] = sbet_record.Z
+        table = self.set_altitude(self.row_table(row))
+        row['Z'] = table.Z.iloc[0]
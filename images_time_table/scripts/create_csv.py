@@ -22,6 +22,45 @@ parser.add_argument(
     action="store_true",
     help='Flag to force querying the SBET file for new EIF file type',
 )
+parser.add_argument(
+    '--sbet-file',
+    type=str,
+    help='Path to the SBET file. Files not ending with .csv are read as '
+         'Applanix binary format. Default: SBET/sbet.csv under base path',
+)
+parser.add_argument(
+    '--no-sbet-cache',
+    action="store_true",
+    help='Read the SBET csv file without creating or using the binary cache '
+         'next to it',
+)
+parser.add_argument(
+    '--stream-sbet',
+    action="store_true",
+    help='Read the SBET csv file in chunks and only keep records around the '
+         'image times. Does not use the binary cache',
+)
+parser.add_argument(
+    '--numeric',
+    action="store_true",
+    help='Parse coordinates and orientations as floats instead of decimals. '
+         'Values are written with the number of --decimal-places',
+)
+parser.add_argument(
+    '--decimal-places',
+    type=ImagesMetaCsv.parse_decimal_places,
+    help='Decimal places for coordinates and orientations with --numeric. '
+         'Either one number for all or per column, i.e.: X=9,Y=9. '
+         'Default: ' + str(ImagesMetaCsv.DECIMAL_PLACES),
+    default=str(ImagesMetaCsv.DECIMAL_PLACES),
+)
+parser.add_argument(
+    '--workers',
+    type=int,
+    help='Number of processes to parse EIF files with. '
+         'Default: SLURM_NTASKS or 1',
+    default=int(os.environ.get('SLURM_NTASKS', 1)),
+)
 parser.add_argument(
     '--image-type',
     type=str,
@@ -38,19 +77,33 @@ if __name__ == '__main__':
     eif_data = EifData(
         os.path.join(basin_dir, IMAGE_DIR),
         old_eif_type=arguments.old_eif_type,
-        image_type=arguments.image_type
+        image_type=arguments.image_type,
+        numeric=arguments.numeric,
+        workers=arguments.workers,
     )
     eif_data.get_images()
 
-    sbet = SbetFile(basin_dir)
+    if arguments.stream_sbet:
+        image_times = eif_data.images_time_table[ImagesMetaCsv.TIME_COLUMN]
+    else:
+        image_times = None
+
+    sbet = SbetFile(
+        basin_dir,
+        arguments.sbet_file,
+        numeric=arguments.numeric,
+        use_cache=not arguments.no_sbet_cache,
+        image_times=image_times,
+    )
 
     if query_sbet:
-        image_list = [
-            sbet.set_imu_data_for_row(row)
-            for row in eif_data.images_time_table
-        ]
+        image_list = sbet.set_imu_data(eif_data.images_time_table)
+    else:
+        image_list = sbet.set_altitude(eif_data.images_time_table)
+
+    if arguments.numeric:
+        decimal_places = arguments.decimal_places
     else:
-        image_list = eif_data.images_time_table
-        [sbet.set_altitude_for_row(row) for row in image_list]
+        decimal_places = None
 
-    ImagesMetaCsv.write_output_file(basin_dir, image_list)
+    ImagesMetaCsv.write_output_file(basin_dir, image_list, decimal_places)
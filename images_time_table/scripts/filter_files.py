@@ -3,11 +3,12 @@
 import argparse
 import json
 import os
-import shutil
 
-from shapely.geometry import shape, Point
+import numpy as np
+import shapely
+from shapely.geometry import shape
 
-from images_time_table.base import ImagesMetaCsv
+from images_time_table.base import ImageFootprints, ImageMover, ImagesMetaCsv
 
 
 def parser():
@@ -22,37 +23,148 @@ def parser():
         '--csv',
         type=str,
         help='Path to csv file containing images to keep.'
-             'Format should be as written by create_csv script',
-        required=True
+             'Format should be as written by create_csv script. '
+             'Required unless --rollback is given',
     )
     argument_parser.add_argument(
         '--boundary',
         type=str,
         help='Path to boundaries in GeoJSON format',
     )
+    argument_parser.add_argument(
+        '--footprint',
+        action='store_true',
+        help='Keep images with a ground footprint inside the boundaries, '
+             'instead of the camera location. Requires the camera model '
+             'with --focal-length, --sensor-width and --sensor-height',
+    )
+    argument_parser.add_argument(
+        '--focal-length',
+        type=float,
+        help='Focal length of the camera in mm',
+    )
+    argument_parser.add_argument(
+        '--sensor-width',
+        type=float,
+        help='Sensor size across flight direction in mm',
+    )
+    argument_parser.add_argument(
+        '--sensor-height',
+        type=float,
+        help='Sensor size along flight direction in mm',
+    )
+    argument_parser.add_argument(
+        '--dem',
+        type=str,
+        help='Path to a coarse DEM for the ground elevation of footprints',
+    )
+    argument_parser.add_argument(
+        '--ground-elevation',
+        type=float,
+        default=0.0,
+        help='Ground elevation in meters for footprints outside the DEM or '
+             'when no DEM is given. Default: 0',
+    )
+    argument_parser.add_argument(
+        '--workers',
+        type=int,
+        default=ImageMover.DEFAULT_WORKERS,
+        help='Number of threads moving files. '
+             'Default: ' + str(ImageMover.DEFAULT_WORKERS),
+    )
+    argument_parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Only report which files would be moved',
+    )
+    argument_parser.add_argument(
+        '--rollback',
+        action='store_true',
+        help='Move all files recorded in the journal of the destination '
+             'folder back to the images path',
+    )
     return argument_parser
 
 
 def load_boundaries(file):
+    """
+    Load the polygons of all features in given GeoJSON file. Multi part
+    geometries are split into their single polygons.
+    """
     with open(file, 'r') as boundary_file:
         boundary = json.load(boundary_file)
 
-        boundary = shape(boundary['features'][0]['geometry'])
+        polygons = shapely.get_parts([
+            shape(feature['geometry']) for feature in boundary['features']
+        ])
 
-    return boundary
+    shapely.prepare(polygons)
+    return polygons
 
 
-def inbounds(polygon, image_location):
-    return polygon.contains(
-        Point(
-            float(image_location['X']),
-            float(image_location['Y'])
-        )
+def inbounds(polygons, x, y):
+    """
+    Check which image locations are inside any of the boundary polygons.
+    Locations outside the total bounds of all polygons are ruled out first,
+    the remaining are tested with a spatial index over the polygons.
+
+    :param polygons: Boundary polygons as returned by load_boundaries
+    :param x: Array with the X coordinate of all images
+    :param y: Array with the Y coordinate of all images
+
+    :return: Boolean array, True for images inside the boundaries
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x_min, y_min, x_max, y_max = shapely.total_bounds(polygons)
+
+    candidates = np.flatnonzero(
+        (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+    )
+    tree = shapely.STRtree(polygons)
+    point_index, _polygon_index = tree.query(
+        shapely.points(x[candidates], y[candidates]), predicate='within'
+    )
+
+    result = np.zeros(len(x), dtype=bool)
+    result[candidates[point_index]] = True
+    return result
+
+
+def footprints_inbounds(polygons, images, arguments):
+    """
+    Images with a footprint intersecting the boundaries. Only images without
+    a footprint, i.e. missing altitude, are kept by their camera location.
+
+    :return: Tuple of boolean arrays, True for images inside the boundaries
+             and True for images without a footprint
+    """
+    footprints = ImageFootprints(
+        arguments.focal_length,
+        arguments.sensor_width,
+        arguments.sensor_height,
+        arguments.ground_elevation,
+    )
+    if arguments.dem:
+        footprints.load_dem(arguments.dem)
+
+    image_footprints = footprints.footprints(images)
+    has_footprint = footprints.has_footprint(image_footprints)
+
+    keep = np.where(
+        has_footprint,
+        footprints.intersecting(images, polygons, image_footprints),
+        inbounds(polygons, images.X, images.Y),
     )
+    return keep, ~has_footprint
+
+
+def destination_folder(base_dir):
+    return os.path.join(base_dir, 'keep', '')
 
 
 def ensure_destination_folder(base_dir):
-    folder = os.path.join(base_dir, 'keep', '')
+    folder = destination_folder(base_dir)
     if not os.path.exists(folder):
         os.mkdir(folder)
 
@@ -60,29 +172,59 @@ def ensure_destination_folder(base_dir):
 
 
 def main():
-    arguments = parser().parse_args()
-
-    keep_folder = ensure_destination_folder(arguments.images_path)
+    argument_parser = parser()
+    arguments = argument_parser.parse_args()
+
+    if not arguments.rollback and not arguments.csv:
+        argument_parser.error('--csv is required unless --rollback is given')
+
+    if arguments.footprint and not (
+        arguments.focal_length and arguments.sensor_width and
+        arguments.sensor_height
+    ):
+        argument_parser.error(
+            '--footprint requires --focal-length, --sensor-width and '
+            '--sensor-height'
+        )
 
-    if arguments.boundary:
-        bounds = load_boundaries(arguments.boundary)
+    if arguments.dry_run:
+        keep_folder = destination_folder(arguments.images_path)
     else:
-        bounds = None
+        keep_folder = ensure_destination_folder(arguments.images_path)
 
-    for image in ImagesMetaCsv.read_file(arguments.csv):
-        if bounds and not inbounds(bounds, image):
-            continue
+    mover = ImageMover(keep_folder, arguments.workers, arguments.dry_run)
 
-        image = os.path.join(
-            arguments.images_path, image[ImagesMetaCsv.FILE_COLUMN]
-        )
+    if arguments.rollback:
+        print('Moving files back from: ' + keep_folder)
+        mover.print_summary(mover.rollback())
+        return
+
+    images = ImagesMetaCsv.read_table(arguments.csv)
 
-        if os.path.exists(image):
-            print('moving file: ' + str(image))
-            print('  to: ' + keep_folder)
-            shutil.move(image, keep_folder)
+    if arguments.boundary:
+        polygons = load_boundaries(arguments.boundary)
+        if arguments.footprint:
+            keep, no_footprint = footprints_inbounds(
+                polygons, images, arguments
+            )
+            if no_footprint.any():
+                print(
+                    'Images without a footprint, checked by camera location: '
+                    + str(np.count_nonzero(no_footprint))
+                )
+                for image in images[ImagesMetaCsv.FILE_COLUMN][no_footprint]:
+                    print('  ' + image)
         else:
-            print(f'Missing file {image} from csv')
+            keep = inbounds(polygons, images.X, images.Y)
+        images = images[keep]
+
+    print('Moving ' + str(len(images)) + ' files to: ' + keep_folder)
+    mover.print_summary(
+        mover.move(
+            os.path.join(arguments.images_path, image)
+            for image in images[ImagesMetaCsv.FILE_COLUMN]
+        )
+    )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+
+from images_time_table.base import (
+    ImageFootprints, ImageThinning, ImagesMetaCsv
+)
+
+
+def parser():
+    argument_parser = argparse.ArgumentParser(
+        description='Drop images with more overlap than needed for the '
+                    'alignment and write a reduced images metadata CSV.'
+    )
+    argument_parser.add_argument(
+        '--csv',
+        type=str,
+        help='Path to csv file with all images. '
+             'Format should be as written by create_csv script',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--output-path',
+        type=str,
+        help='Directory to write the reduced images_metadata.csv and the '
+             'overlap report to',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--forward-overlap',
+        type=float,
+        default=ImageThinning.FORWARD_OVERLAP,
+        help='Target overlap between images along a flight line, '
+             'as fraction. Default: ' + str(ImageThinning.FORWARD_OVERLAP),
+    )
+    argument_parser.add_argument(
+        '--side-overlap',
+        type=float,
+        default=ImageThinning.SIDE_OVERLAP,
+        help='Flight lines overlapping previous lines by more than this '
+             'fraction are dropped. '
+             'Default: ' + str(ImageThinning.SIDE_OVERLAP),
+    )
+    argument_parser.add_argument(
+        '--focal-length',
+        type=float,
+        help='Focal length of the camera in mm',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--sensor-width',
+        type=float,
+        help='Sensor size across flight direction in mm',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--sensor-height',
+        type=float,
+        help='Sensor size along flight direction in mm',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--dem',
+        type=str,
+        help='Path to a coarse DEM for the ground elevation of footprints',
+    )
+    argument_parser.add_argument(
+        '--ground-elevation',
+        type=float,
+        default=0.0,
+        help='Ground elevation in meters for footprints outside the DEM or '
+             'when no DEM is given. Default: 0',
+    )
+    return argument_parser
+
+
+def print_summary(report):
+    kept = report[report[ImageThinning.KEEP_COLUMN]]
+    lines = report[report[ImageThinning.LINE_COLUMN] >= 0] \
+        .groupby(ImageThinning.LINE_COLUMN)[ImageThinning.KEEP_COLUMN].any()
+
+    print('Kept ' + str(len(kept)) + ' of ' + str(len(report)) + ' images')
+    print('  flight lines kept: ' + str(lines.sum()) + ' of ' +
+          str(len(lines)))
+    for column in [ImageThinning.FORWARD_COLUMN, ImageThinning.SIDE_COLUMN]:
+        overlap = kept[column].dropna()
+        if len(overlap) > 0:
+            print('  ' + column.lower() + ': min {:.2f}, median {:.2f}'
+                  .format(overlap.min(), overlap.median()))
+
+
+def main():
+    arguments = parser().parse_args()
+
+    output_csv = os.path.join(
+        arguments.output_path, ImagesMetaCsv.CSV_OUTPUT_FILE
+    )
+    if os.path.abspath(output_csv) == os.path.abspath(arguments.csv):
+        parser().error('Output path would overwrite the source CSV')
+
+    footprints = ImageFootprints(
+        arguments.focal_length,
+        arguments.sensor_width,
+        arguments.sensor_height,
+        arguments.ground_elevation,
+    )
+    if arguments.dem:
+        footprints.load_dem(arguments.dem)
+
+    thinning = ImageThinning(
+        footprints, arguments.forward_overlap, arguments.side_overlap
+    )
+    report = thinning.thin(ImagesMetaCsv.read_table(arguments.csv))
+    print_summary(report)
+
+    keep = report[ImageThinning.KEEP_COLUMN].to_numpy()
+    ImagesMetaCsv.write_output_file(
+        arguments.output_path,
+        ImagesMetaCsv.read_table(arguments.csv, as_text=True)[keep],
+    )
+    report.to_csv(
+        os.path.join(arguments.output_path, ImageThinning.REPORT_FILE),
+        index=False,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -5,17 +5,27 @@ setup(
     version='0.1',
     packages=[
         'images_time_table.base',
+        'workflow_tools.base',
+        'workflow_tools.scripts',
     ],
     url='https://github.com/UofU-Cryosphere/snow-aso',
     author='Joachim Meyer',
     author_email='j.meyer@utah.edu',
     description='Helper tools for processing ASO imagery',
     install_requires=[
-        'numpy', 'pandas', 'shapely'
+        'laspy[lazrs]', 'numpy', 'pandas', 'rasterio', 'shapely>=2.0'
     ],
     entry_points={
         'console_scripts': [
-            'filter_files=images_time_table.scripts.filter_files:main'
+            'filter_files=images_time_table.scripts.filter_files:main',
+            'thin_images=images_time_table.scripts.thin_images:main',
+            'rasterize_tiles=workflow_tools.scripts.rasterize_tiles:main',
+            'residual_report=workflow_tools.scripts.residual_report:main',
+            'run_workflow=workflow_tools.scripts.run_workflow:main',
+            'snow_depth=workflow_tools.scripts.snow_depth:main',
+            'stable_ground_mask=workflow_tools.scripts.stable_ground_mask:main',
+            'thin_cloud=workflow_tools.scripts.thin_cloud:main',
+            'transform_cloud=workflow_tools.scripts.transform_cloud:main',
         ],
     }
 )
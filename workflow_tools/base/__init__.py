@@ -0,0 +1,25 @@
+from .point_cloud_transform import PointCloudTransform
+from .raster_blocks import RasterBlocks
+from .tiled_rasterization import TiledRasterization
+from .workflow_graph import WorkflowGraph, WorkflowStep
+
+# Below modules depend on the above
+from .point_cloud_thinning import PointCloudThinning
+from .residual_statistics import ResidualStatistics, StableGroundResiduals
+from .snow_depth_difference import SnowDepthDifference
+from .snow_depth_workflow import SnowDepthWorkflow
+from .stable_ground_mask import StableGroundMask
+
+__all__ = [
+    'PointCloudThinning',
+    'PointCloudTransform',
+    'RasterBlocks',
+    'ResidualStatistics',
+    'SnowDepthDifference',
+    'SnowDepthWorkflow',
+    'StableGroundMask',
+    'StableGroundResiduals',
+    'TiledRasterization',
+    'WorkflowGraph',
+    'WorkflowStep',
+]
@@ -0,0 +1,250 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import laspy
+import numpy as np
+from rasterio.enums import Resampling
+
+from .raster_blocks import RasterBlocks
+
+
+class PointCloudThinning(object):
+    """
+    Thin a LAS/LAZ cloud to at most a number of points per voxel, streamed
+    in chunks.
+
+    Points are grouped by voxel and stratum. The stratum is the slope band
+    of the DEM and whether the point is on a control surface, so steep
+    terrain and control surfaces keep their share of points within a voxel.
+    Points outside the DEM or without a slope fall into an own slope band.
+
+    The cloud is read twice. The first pass counts the points per voxel and
+    stratum, the second keeps evenly spaced points of each group in file
+    order, exactly the cap or all points of groups with fewer. Memory grows
+    with the number of occupied groups, not with the points.
+
+    Chunks are read in order, their groups are computed in a thread pool.
+    All point dimensions are written unchanged.
+    """
+    VOXEL_SIZE = 1.0
+    CELL_CAP = 4
+    CHUNK_SIZE = 1000000
+    SLOPE_BANDS = [0, 5, 10, 20, 30, 40, 50, 90]
+    # Combine the counted chunks after this many
+    MERGE_CHUNKS = 16
+
+    def __init__(self, input_file, output_file, voxel_size=VOXEL_SIZE,
+                 cell_cap=CELL_CAP, dem_file=None, stable_file=None,
+                 slope_bands=SLOPE_BANDS, chunk_size=CHUNK_SIZE, workers=1):
+        """
+        :param input_file: LAS or LAZ cloud to thin
+        :param output_file: LAS or LAZ cloud to write, compressed when
+                            ending with .laz
+        :param voxel_size: Length of a voxel side in units of the CRS
+        :param cell_cap: Maximum number of points per voxel and stratum
+        :param dem_file: Optional, DEM for the slope of the points
+        :param stable_file: Optional, raster with values other than zero for
+                            control surfaces, i.e. the stable ground mask
+        :param slope_bands: Edges of the slope bands in degrees
+        :param chunk_size: Number of points read at once
+        :param workers: Number of threads processing chunks
+        """
+        self.input_file = input_file
+        self.output_file = output_file
+        self.voxel_size = voxel_size
+        self.cell_cap = cell_cap
+        self.dem_file = dem_file
+        self.stable_file = stable_file
+        self.slope_bands = list(slope_bands)
+        self.chunk_size = chunk_size
+        self.workers = max(1, workers)
+
+        self.blocks = None
+        if dem_file is not None or stable_file is not None:
+            self.blocks = RasterBlocks(dem_file or stable_file)
+
+        with laspy.open(input_file) as reader:
+            self.origin = np.array(reader.header.mins)
+            self.voxels = np.floor(
+                (np.array(reader.header.maxs) - self.origin) / voxel_size
+            ).astype(np.int64) + 1
+
+    @property
+    def unknown_slope(self):
+        return len(self.slope_bands) - 1
+
+    @property
+    def strata(self):
+        """
+        Number of strata, the slope bands with one for unknown slopes, each
+        on and off control surfaces
+        """
+        return 2 * (self.unknown_slope + 1)
+
+    def block_strata(self, window):
+        """
+        :return: Stratum of each cell of the block
+        """
+        slope_band = np.full(
+            (int(window.height), int(window.width)), self.unknown_slope,
+            dtype=np.int64,
+        )
+        if self.dem_file is not None:
+            dem = self.blocks.read(self.dem_file, window, halo=1)
+            slope = RasterBlocks.slope(dem, self.blocks.resolution)
+            band = np.digitize(slope, self.slope_bands) - 1
+            known = ~np.isnan(slope) & (band >= 0) & \
+                (band < self.unknown_slope)
+            slope_band[known] = band[known]
+
+        control_surface = np.zeros(slope_band.shape, dtype=np.int64)
+        if self.stable_file is not None:
+            stable = self.blocks.read(
+                self.stable_file, window, resampling=Resampling.nearest
+            )
+            control_surface[
+                ~np.ma.getmaskarray(stable) & (stable.filled(0) != 0)
+            ] = 1
+
+        return 2 * slope_band + control_surface
+
+    def group_keys(self, points):
+        """
+        :return: Key of the voxel and stratum for each point
+        """
+        coordinates = np.stack([
+            np.asarray(points.x), np.asarray(points.y), np.asarray(points.z)
+        ])
+        voxel = np.floor(
+            (coordinates - self.origin[:, np.newaxis]) / self.voxel_size
+        ).astype(np.int64)
+        # Points outside the header bounds go to the border voxels
+        voxel = np.clip(voxel, 0, self.voxels[:, np.newaxis] - 1)
+
+        if self.blocks is None:
+            strata = np.full(voxel.shape[1], 2 * self.unknown_slope)
+        else:
+            strata = self.blocks.sample(
+                coordinates[0], coordinates[1], self.block_strata,
+                fill=2 * self.unknown_slope,
+            )
+
+        return (
+            (voxel[0] * self.voxels[1] + voxel[1]) * self.voxels[2] +
+            voxel[2]
+        ) * self.strata + strata
+
+    def chunk_keys(self, reader):
+        """
+        Read the cloud in chunks and compute the group keys in the thread
+        pool, keeping a few chunks per thread in memory.
+
+        :return: Generator of tuples with the points and keys of a chunk
+        """
+        in_flight = 2 * self.workers
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for points in reader.chunk_iterator(self.chunk_size):
+                pending.append(
+                    (points, executor.submit(self.group_keys, points))
+                )
+                if len(pending) >= in_flight:
+                    points, keys = pending.popleft()
+                    yield points, keys.result()
+
+            while pending:
+                points, keys = pending.popleft()
+                yield points, keys.result()
+
+    @staticmethod
+    def merge_counts(keys, counts):
+        """
+        :return: Tuple of the sorted unique keys and their summed counts
+        """
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        return keys, np.bincount(
+            inverse, weights=np.concatenate(counts), minlength=keys.size
+        ).astype(np.int64)
+
+    def count_groups(self):
+        """
+        First pass, count the points per group.
+
+        :return: Tuple of the sorted group keys and their point counts
+        """
+        keys, counts = [], []
+        with laspy.open(self.input_file) as reader:
+            for _points, chunk_keys in self.chunk_keys(reader):
+                chunk_keys, chunk_counts = np.unique(
+                    chunk_keys, return_counts=True
+                )
+                keys.append(chunk_keys)
+                counts.append(chunk_counts)
+                if len(keys) > self.MERGE_CHUNKS:
+                    keys, counts = [
+                        [merged] for merged in self.merge_counts(keys, counts)
+                    ]
+
+        if not keys:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return self.merge_counts(keys, counts)
+
+    def keep(self, chunk_keys, group_keys, group_counts, seen):
+        """
+        Select the points of a chunk to keep. Of a group with more points
+        than the cap, every point is kept where the rank in the group times
+        the cap over the group count reaches the next integer.
+
+        :param chunk_keys: Group key of each point of the chunk
+        :param group_keys: Sorted keys of all groups
+        :param group_counts: Point count of each group
+        :param seen: Points per group of the previous chunks, updated
+
+        :return: Boolean array with True for points to keep
+        """
+        groups = np.searchsorted(group_keys, chunk_keys)
+
+        # Rank of each point within its group
+        order = np.argsort(groups, kind='stable')
+        sorted_groups = groups[order]
+        starts = np.flatnonzero(
+            np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+        )
+        lengths = np.diff(np.r_[starts, sorted_groups.size])
+        rank = np.empty(groups.size, dtype=np.int64)
+        rank[order] = np.arange(groups.size) - np.repeat(starts, lengths)
+        rank += seen[groups]
+        seen[sorted_groups[starts]] += lengths
+
+        counts = group_counts[groups]
+        return (rank + 1) * self.cell_cap // counts > \
+            rank * self.cell_cap // counts
+
+    def run(self):
+        """
+        :return: Tuple of the number of read and written points
+        """
+        try:
+            group_keys, group_counts = self.count_groups()
+            seen = np.zeros(group_keys.size, dtype=np.int64)
+            read = written = 0
+
+            with laspy.open(self.input_file) as reader, \
+                    laspy.open(self.output_file, mode='w',
+                               header=reader.header) as writer:
+                for points, chunk_keys in self.chunk_keys(reader):
+                    keep = self.keep(
+                        chunk_keys, group_keys, group_counts, seen
+                    )
+                    writer.write_points(points[keep])
+                    read += len(points)
+                    written += int(np.count_nonzero(keep))
+        finally:
+            if self.blocks is not None:
+                self.blocks.close()
+
+        print('Kept {} of {} points in {} voxel groups'.format(
+            written, read, group_keys.size
+        ))
+        print('Saved: ' + self.output_file)
+        return read, written
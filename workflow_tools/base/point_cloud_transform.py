@@ -0,0 +1,130 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import laspy
+import numpy as np
+from laspy.vlrs.known import GeoKeyDirectoryVlr, WktCoordinateSystemVlr
+from rasterio.crs import CRS
+from rasterio.warp import transform as transform_coordinates
+
+
+class PointCloudTransform(object):
+    """
+    Apply a saved pc_align transform to a LAS/LAZ cloud, streamed in chunks.
+
+    The 4x4 matrix of a pc_align '-transform.txt' file is in Cartesian
+    (ECEF) coordinates. Points are converted from the CRS of the cloud to
+    ECEF, transformed and converted back, same as pc_align does with
+    '--num-iterations 0'. The reference cloud is not needed.
+
+    Chunks are read in order, transformed in a thread pool and written in
+    order. Only the coordinates change, all other point dimensions and the
+    header records are written unchanged.
+    """
+    CHUNK_SIZE = 1000000
+    ECEF = CRS.from_epsg(4978)
+    # GeoTIFF keys of the projected and geographic CRS in LAS 1.2 headers
+    PROJECTED_CRS_KEY = 3072
+    GEOGRAPHIC_CRS_KEY = 2048
+    USER_DEFINED = 32767
+
+    def __init__(self, transform_file, input_file, output_file, crs=None,
+                 chunk_size=CHUNK_SIZE, workers=1):
+        """
+        :param transform_file: pc_align transform file
+        :param input_file: LAS or LAZ cloud to transform
+        :param output_file: LAS or LAZ cloud to write, compressed when
+                            ending with .laz
+        :param crs: Optional, CRS of the cloud. Default: From the header
+        :param chunk_size: Number of points read at once
+        :param workers: Number of threads transforming chunks
+        """
+        self.matrix = self.read_transform(transform_file)
+        self.input_file = input_file
+        self.output_file = output_file
+        self.chunk_size = chunk_size
+        self.workers = max(1, workers)
+
+        if crs is None:
+            with laspy.open(input_file) as reader:
+                crs = self.header_crs(reader.header)
+            if crs is None:
+                raise ValueError(
+                    'Cloud has no CRS in the header, give the CRS'
+                )
+        self.crs = CRS.from_user_input(crs)
+
+    @staticmethod
+    def read_transform(transform_file):
+        """
+        :return: 4x4 transformation matrix
+        """
+        matrix = np.loadtxt(transform_file)
+        if matrix.shape != (4, 4):
+            raise ValueError(
+                'Transform in ' + transform_file + ' is not a 4x4 matrix'
+            )
+        return matrix
+
+    @classmethod
+    def header_crs(cls, header):
+        """
+        :return: CRS of the WKT or GeoTIFF keys record, None without one
+        """
+        for vlr in header.vlrs:
+            if isinstance(vlr, WktCoordinateSystemVlr):
+                return CRS.from_wkt(vlr.string)
+            if isinstance(vlr, GeoKeyDirectoryVlr):
+                keys = {key.id: key.value_offset for key in vlr.geo_keys}
+                for key in [cls.PROJECTED_CRS_KEY, cls.GEOGRAPHIC_CRS_KEY]:
+                    if keys.get(key, cls.USER_DEFINED) != cls.USER_DEFINED:
+                        return CRS.from_epsg(keys[key])
+        return None
+
+    def transform(self, points):
+        """
+        Transform the coordinates of a chunk in place.
+
+        :return: The transformed points
+        """
+        x, y, z = transform_coordinates(
+            self.crs, self.ECEF,
+            np.asarray(points.x), np.asarray(points.y), np.asarray(points.z)
+        )
+        ecef = self.matrix[:3, :3] @ np.array([x, y, z]) + \
+            self.matrix[:3, 3:]
+        x, y, z = transform_coordinates(self.ECEF, self.crs, *ecef)
+
+        points.x = x
+        points.y = y
+        points.z = z
+        return points
+
+    def run(self):
+        """
+        :return: Number of transformed points
+        """
+        # Chunks being processed, limits the chunks held in memory
+        in_flight = 2 * self.workers
+        count = 0
+
+        with laspy.open(self.input_file) as reader, \
+                laspy.open(self.output_file, mode='w',
+                           header=reader.header) as writer, \
+                ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for points in reader.chunk_iterator(self.chunk_size):
+                pending.append(executor.submit(self.transform, points))
+                if len(pending) >= in_flight:
+                    points = pending.popleft().result()
+                    writer.write_points(points)
+                    count += len(points)
+
+            while pending:
+                points = pending.popleft().result()
+                writer.write_points(points)
+                count += len(points)
+
+        print('Transformed {} points'.format(count))
+        print('Saved: ' + self.output_file)
+        return count
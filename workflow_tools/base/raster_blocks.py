@@ -0,0 +1,244 @@
+import threading
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window, bounds as window_bounds, from_bounds
+
+
+class RasterBlocks(object):
+    """
+    Read rasters block by block on a common grid.
+
+    The grid is the one of the grid raster, limited to the extent all
+    extent rasters cover. Rasters on a different grid are read resampled to
+    the grid. Each thread opens its own dataset handles on first use, so
+    blocks can be read in a thread pool.
+
+    Blocks can be read with a halo of cells around them, i.e. for a kernel
+    like the slope. Cells of the halo outside the rasters have no data.
+    """
+    BLOCK_SIZE = 1024
+    # Largest halo in cells, resampled rasters are extended by it
+    HALO_MARGIN = 16
+    # Offset in cells up to which grids count as aligned
+    ALIGNMENT_TOLERANCE = 1e-6
+
+    def __init__(self, grid_file, extent_files=(), block_size=BLOCK_SIZE):
+        """
+        :param grid_file: Raster with the grid to read blocks on
+        :param extent_files: Optional, rasters limiting the grid extent
+        :param block_size: Length of a block side in cells
+        """
+        self.block_size = block_size
+        self.local = threading.local()
+        self.open_datasets = []
+        self.lock = threading.Lock()
+
+        with rasterio.open(grid_file) as grid:
+            self.crs = grid.crs
+            bounds = list(grid.bounds)
+            for extent_file in extent_files:
+                with rasterio.open(extent_file) as extent:
+                    bounds = [
+                        max(bounds[0], extent.bounds.left),
+                        max(bounds[1], extent.bounds.bottom),
+                        min(bounds[2], extent.bounds.right),
+                        min(bounds[3], extent.bounds.top),
+                    ]
+            if bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+                raise ValueError('The rasters do not overlap')
+
+            self.window = from_bounds(*bounds, transform=grid.transform) \
+                .round_offsets().round_lengths()
+            self.transform = grid.window_transform(self.window)
+
+    @property
+    def width(self):
+        return int(self.window.width)
+
+    @property
+    def height(self):
+        return int(self.window.height)
+
+    @property
+    def resolution(self):
+        return abs(self.transform.a), abs(self.transform.e)
+
+    def windows(self):
+        for row in range(0, self.height, self.block_size):
+            for column in range(0, self.width, self.block_size):
+                yield Window(
+                    column, row,
+                    min(self.block_size, self.width - column),
+                    min(self.block_size, self.height - row),
+                )
+
+    def is_aligned(self, dataset):
+        if dataset.crs != self.crs:
+            return False
+
+        transform = dataset.transform
+        if not np.allclose(
+            [transform.a, transform.b, transform.d, transform.e],
+            [self.transform.a, self.transform.b,
+             self.transform.d, self.transform.e],
+        ):
+            return False
+
+        column, row = ~transform * (self.transform.c, self.transform.f)
+        return abs(column - round(column)) < self.ALIGNMENT_TOLERANCE and \
+            abs(row - round(row)) < self.ALIGNMENT_TOLERANCE
+
+    def source(self, file_path, resampling):
+        """
+        Dataset of the calling thread to read given raster on the grid.
+        """
+        if not hasattr(self.local, 'sources'):
+            self.local.sources = {}
+
+        key = (file_path, resampling)
+        if key not in self.local.sources:
+            dataset = rasterio.open(file_path)
+            with self.lock:
+                self.open_datasets.append(dataset)
+            if not self.is_aligned(dataset):
+                # Extended to read halos at the edges of the grid
+                margin = self.HALO_MARGIN
+                dataset = WarpedVRT(
+                    dataset, crs=self.crs,
+                    transform=self.transform * self.transform.translation(
+                        -margin, -margin
+                    ),
+                    width=self.width + 2 * margin,
+                    height=self.height + 2 * margin,
+                    resampling=resampling,
+                )
+                with self.lock:
+                    self.open_datasets.append(dataset)
+            self.local.sources[key] = dataset
+
+        return self.local.sources[key]
+
+    def read(self, file_path, window, band=1, halo=0,
+             resampling=Resampling.bilinear):
+        """
+        Read a block of a raster on the grid.
+
+        :param file_path: Raster to read
+        :param window: Block of the grid
+        :param band: Band to read
+        :param halo: Number of cells added around the block, up to
+                     HALO_MARGIN
+        :param resampling: Resampling for rasters on a different grid
+
+        :return: Masked array, masked where the raster has no data
+        """
+        if halo > self.HALO_MARGIN:
+            raise ValueError('Halo larger than ' + str(self.HALO_MARGIN))
+
+        dataset = self.source(file_path, resampling)
+        window = Window(
+            window.col_off - halo, window.row_off - halo,
+            window.width + 2 * halo, window.height + 2 * halo,
+        )
+        source_window = from_bounds(
+            *window_bounds(window, self.transform),
+            transform=dataset.transform
+        ).round_offsets().round_lengths()
+        inside = source_window.col_off >= 0 and \
+            source_window.row_off >= 0 and \
+            source_window.col_off + source_window.width <= dataset.width and \
+            source_window.row_off + source_window.height <= dataset.height
+
+        return dataset.read(
+            band, window=source_window, masked=True, boundless=not inside,
+            out_shape=(int(window.height), int(window.width)),
+        )
+
+    def sample(self, x, y, block_values, fill):
+        """
+        Sample values computed per block at points.
+
+        Each block with points is computed once, so only the blocks the
+        points fall into are read.
+
+        :param x: Array of the point X coordinates
+        :param y: Array of the point Y coordinates
+        :param block_values: Function returning the array of values for a
+                             block window
+        :param fill: Value for points outside the grid
+
+        :return: Array with the value of the cell of each point
+        """
+        columns, rows = ~self.transform * (np.asarray(x), np.asarray(y))
+        columns = np.floor(columns).astype(np.int64)
+        rows = np.floor(rows).astype(np.int64)
+        inside = (columns >= 0) & (columns < self.width) & \
+            (rows >= 0) & (rows < self.height)
+
+        values = None
+        block_ids = (rows // self.block_size) * self.width + \
+            columns // self.block_size
+        for block_id in np.unique(block_ids[inside]):
+            block_row, block_column = divmod(
+                int(block_id), self.width
+            )
+            row_off = block_row * self.block_size
+            column_off = block_column * self.block_size
+            window = Window(
+                column_off, row_off,
+                min(self.block_size, self.width - column_off),
+                min(self.block_size, self.height - row_off),
+            )
+            block = block_values(window)
+            if values is None:
+                values = np.full(columns.shape, fill, dtype=block.dtype)
+
+            points = inside & (block_ids == block_id)
+            values[points] = block[
+                rows[points] - row_off, columns[points] - column_off
+            ]
+
+        if values is None:
+            values = np.full(columns.shape, fill)
+        return values
+
+    def close(self):
+        for dataset in reversed(self.open_datasets):
+            dataset.close()
+        self.open_datasets = []
+        self.local = threading.local()
+
+    @staticmethod
+    def slope(elevation, resolution):
+        """
+        Slope in degrees with Horn's method, same as gdaldem.
+
+        :param elevation: Masked array with a halo of one cell
+        :param resolution: Tuple of the cell size in X and Y
+
+        :return: Array for the cells within the halo, NaN where a cell or a
+                 neighbor has no data
+        """
+        values = np.ma.filled(elevation.astype(np.float64), np.nan)
+
+        def cells(row, column):
+            return values[
+                row:values.shape[0] - 2 + row,
+                column:values.shape[1] - 2 + column
+            ]
+
+        dz_dx = (
+            (cells(0, 2) + 2 * cells(1, 2) + cells(2, 2)) -
+            (cells(0, 0) + 2 * cells(1, 0) + cells(2, 0))
+        ) / (8 * resolution[0])
+        dz_dy = (
+            (cells(2, 0) + 2 * cells(2, 1) + cells(2, 2)) -
+            (cells(0, 0) + 2 * cells(0, 1) + cells(0, 2))
+        ) / (8 * resolution[1])
+
+        slope = np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))
+        slope[np.isnan(cells(1, 1))] = np.nan
+        return slope
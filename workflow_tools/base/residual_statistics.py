@@ -0,0 +1,290 @@
+import json
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from rasterio.enums import Resampling
+
+from .raster_blocks import RasterBlocks
+
+
+class ResidualStatistics(object):
+    """
+    Running statistics of residuals with a fixed bin histogram.
+
+    Count, mean, standard deviation, RMSE, minimum and maximum are exact.
+    Median and percentiles are interpolated within the histogram bins, the
+    NMAD has the resolution of the bin width. Residuals outside the
+    histogram range are counted at the range limits.
+    """
+    HISTOGRAM_RANGE = 10.0
+    BIN_WIDTH = 0.01
+    # Scales the median absolute deviation to the standard deviation of a
+    # normal distribution
+    NMAD_FACTOR = 1.4826
+
+    def __init__(self, histogram_range=HISTOGRAM_RANGE, bin_width=BIN_WIDTH):
+        self.histogram_range = histogram_range
+        self.bin_width = bin_width
+        self.bins = int(round(2 * histogram_range / bin_width))
+        # First and last entry count the residuals outside the range
+        self.histogram = np.zeros(self.bins + 2, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, residuals):
+        """
+        :param residuals: Array of residuals without missing values
+        """
+        if residuals.size == 0:
+            return
+
+        residuals = residuals.astype(np.float64)
+        self.count += residuals.size
+        self.total += residuals.sum()
+        self.squares += np.square(residuals).sum()
+        self.minimum = min(self.minimum, residuals.min())
+        self.maximum = max(self.maximum, residuals.max())
+
+        index = np.floor(
+            (residuals + self.histogram_range) / self.bin_width
+        ).astype(np.int64) + 1
+        self.histogram += np.bincount(
+            np.clip(index, 0, self.bins + 1), minlength=self.bins + 2
+        )
+
+    def merge(self, other):
+        self.histogram += other.histogram
+        self.count += other.count
+        self.total += other.total
+        self.squares += other.squares
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def bin_centers(self):
+        centers = -self.histogram_range + \
+            (np.arange(self.bins) + 0.5) * self.bin_width
+        return np.concatenate(
+            ([-self.histogram_range], centers, [self.histogram_range])
+        )
+
+    def percentile(self, percent):
+        """
+        Percentile interpolated linearly within the histogram bin.
+        """
+        target = percent / 100 * self.count
+        cumulative = np.cumsum(self.histogram)
+        index = min(int(np.searchsorted(cumulative, target)), self.bins + 1)
+        if index == 0 or index == self.bins + 1:
+            return float(self.bin_centers[index])
+
+        before = cumulative[index - 1]
+        fraction = (target - before) / self.histogram[index]
+        return float(
+            -self.histogram_range +
+            (index - 1 + fraction) * self.bin_width
+        )
+
+    def nmad(self, median):
+        deviation = np.abs(self.bin_centers - median)
+        order = np.argsort(deviation)
+        cumulative = np.cumsum(self.histogram[order])
+        index = np.searchsorted(cumulative, 0.5 * self.count)
+        return self.NMAD_FACTOR * float(deviation[order][index])
+
+    def summary(self):
+        if self.count == 0:
+            return dict(count=0)
+
+        mean = self.total / self.count
+        median = self.percentile(50)
+        return dict(
+            count=self.count,
+            mean=mean,
+            std=math.sqrt(max(self.squares / self.count - mean ** 2, 0)),
+            rmse=math.sqrt(self.squares / self.count),
+            median=median,
+            nmad=self.nmad(median),
+            min=float(self.minimum),
+            max=float(self.maximum),
+            p05=self.percentile(5),
+            p95=self.percentile(95),
+            outside_histogram=int(
+                self.histogram[0] + self.histogram[-1]
+            ),
+        )
+
+
+class StableGroundResiduals(object):
+    """
+    Residuals of a co-registered DSM minus the reference DSM over stable
+    ground, streamed block by block.
+
+    Stable ground are the cells with a value other than zero in the
+    control surface raster, i.e. the output of
+    classifier/3_create_stable_geotiff.json. The statistics are reported
+    for all stable ground and broken down by bands of the slope and the
+    elevation, both from the reference DSM.
+
+    The grid is the one of the reference DSM. The DSM is resampled with the
+    average and the control surfaces with the nearest value when on a
+    different grid. See RasterBlocks.
+    """
+    DSM_BAND = 3
+    REFERENCE_BAND = 3
+    STABLE_BAND = 1
+    SLOPE_BANDS = [0, 5, 10, 20, 30, 40, 50, 90]
+    ELEVATION_BAND = 250.0
+
+    ALL = 'all'
+    SLOPE = 'slope'
+    ELEVATION = 'elevation'
+
+    def __init__(self, dsm_file, reference_file, stable_file,
+                 dsm_band=DSM_BAND, reference_band=REFERENCE_BAND,
+                 stable_band=STABLE_BAND, slope_bands=SLOPE_BANDS,
+                 elevation_band=ELEVATION_BAND,
+                 block_size=RasterBlocks.BLOCK_SIZE, workers=1):
+        """
+        :param dsm_file: Co-registered DSM
+        :param reference_file: Reference DSM
+        :param stable_file: Control surface raster
+        :param dsm_band: Band of the DSM with the elevation
+        :param reference_band: Band of the reference DSM with the elevation
+        :param stable_band: Band of the control surface raster
+        :param slope_bands: Edges of the slope bands in degrees
+        :param elevation_band: Height of the elevation bands in meters
+        :param block_size: Length of a processed block side in cells
+        :param workers: Number of threads processing blocks
+        """
+        self.dsm_file = dsm_file
+        self.reference_file = reference_file
+        self.stable_file = stable_file
+        self.dsm_band = dsm_band
+        self.reference_band = reference_band
+        self.stable_band = stable_band
+        self.slope_bands = list(slope_bands)
+        self.elevation_band = elevation_band
+        self.workers = max(1, workers)
+        self.blocks = RasterBlocks(reference_file, [dsm_file], block_size)
+
+    def block_statistics(self, window):
+        """
+        :return: Dictionary of ResidualStatistics per group of the block
+        """
+        reference = self.blocks.read(
+            self.reference_file, window, self.reference_band, halo=1
+        )
+        slope = RasterBlocks.slope(reference, self.blocks.resolution)
+        reference = reference[1:-1, 1:-1]
+        dsm = self.blocks.read(
+            self.dsm_file, window, self.dsm_band,
+            resampling=Resampling.average,
+        )
+        stable = self.blocks.read(
+            self.stable_file, window, self.stable_band,
+            resampling=Resampling.nearest,
+        )
+
+        valid = ~(
+            np.ma.getmaskarray(reference) | np.ma.getmaskarray(dsm) |
+            np.ma.getmaskarray(stable)
+        ) & (stable.filled(0) != 0)
+        residuals = (dsm.data.astype(np.float64) - reference.data)[valid]
+        slope = slope[valid]
+        elevation = reference.data[valid]
+
+        statistics = {}
+
+        def add(group, selection=None):
+            if group not in statistics:
+                statistics[group] = ResidualStatistics()
+            statistics[group].add(
+                residuals if selection is None else residuals[selection]
+            )
+
+        add((self.ALL, None, None))
+        slope_band = np.digitize(slope, self.slope_bands) - 1
+        for band in range(len(self.slope_bands) - 1):
+            selection = slope_band == band
+            if selection.any():
+                add((self.SLOPE, self.slope_bands[band],
+                     self.slope_bands[band + 1]), selection)
+
+        elevation_band = np.floor(elevation / self.elevation_band)
+        for band in np.unique(elevation_band):
+            lower = float(band * self.elevation_band)
+            add((self.ELEVATION, lower, lower + self.elevation_band),
+                elevation_band == band)
+
+        return statistics
+
+    def run(self):
+        """
+        :return: Dictionary of ResidualStatistics per group, with the group
+                 as tuple of type, lower and upper band limit
+        """
+        statistics = {}
+
+        def merge(block_statistics):
+            for group, group_statistics in block_statistics.items():
+                if group in statistics:
+                    statistics[group].merge(group_statistics)
+                else:
+                    statistics[group] = group_statistics
+
+        # Blocks being processed, limits the blocks held in memory
+        in_flight = 2 * self.workers
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                pending = deque()
+                for window in self.blocks.windows():
+                    pending.append(
+                        executor.submit(self.block_statistics, window)
+                    )
+                    if len(pending) >= in_flight:
+                        merge(pending.popleft().result())
+
+                while pending:
+                    merge(pending.popleft().result())
+        finally:
+            self.blocks.close()
+
+        return statistics
+
+    def report(self, statistics):
+        """
+        :return: DataFrame with one row per group, ordered by type and band
+        """
+        order = [self.ALL, self.SLOPE, self.ELEVATION]
+        rows = [
+            dict(group=group, lower=lower, upper=upper,
+                 **statistics[(group, lower, upper)].summary())
+            for group, lower, upper in sorted(
+                statistics,
+                key=lambda key: (order.index(key[0]), key[1] or 0)
+            )
+        ]
+        return pd.DataFrame(rows)
+
+    def write_report(self, report, output_file):
+        """
+        Write the report as JSON and CSV with the same file name.
+        """
+        with open(output_file, 'w') as json_file:
+            json.dump(dict(
+                dsm=self.dsm_file,
+                reference=self.reference_file,
+                stable=self.stable_file,
+                groups=json.loads(report.to_json(orient='records')),
+            ), json_file, indent=2)
+        report.to_csv(
+            os.path.splitext(output_file)[0] + '.csv', index=False
+        )
@@ -0,0 +1,113 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+
+from .raster_blocks import RasterBlocks
+
+
+class SnowDepthDifference(object):
+    """
+    Snow depth as difference of the snow on minus the snow free DSM,
+    processed block by block.
+
+    The output grid is the grid of the snow on DSM, limited to the extent
+    both DSMs cover. The snow free DSM and masks on a different grid are
+    read resampled to the output grid, the DSM bilinear and masks with the
+    nearest value. See RasterBlocks.
+
+    Blocks are read and differenced in a thread pool and written in order.
+    Only a few blocks per thread are held in memory at any time.
+
+    Cells are nodata where either DSM has no data or a mask is zero or has
+    no data.
+    """
+    BAND = 3
+    BLOCK_SIZE = RasterBlocks.BLOCK_SIZE
+    NODATA = -9999.0
+
+    OUTPUT_OPTIONS = dict(
+        driver='GTiff',
+        dtype='float32',
+        count=1,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress='LZW',
+        predictor=3,
+        bigtiff='IF_SAFER',
+    )
+
+    def __init__(self, snow_on_file, snow_free_file, output_file, band=BAND,
+                 mask_files=(), block_size=BLOCK_SIZE, workers=1):
+        """
+        :param snow_on_file: DSM of the snow on date
+        :param snow_free_file: DSM of the snow free date
+        :param output_file: GeoTIFF to write the snow depth to
+        :param band: Band of the DSMs with the elevation
+        :param mask_files: Optional, rasters with zero for cells to exclude
+        :param block_size: Length of a processed block side in cells
+        :param workers: Number of threads processing blocks
+        """
+        self.snow_on_file = snow_on_file
+        self.snow_free_file = snow_free_file
+        self.output_file = output_file
+        self.band = band
+        self.mask_files = list(mask_files)
+        self.workers = max(1, workers)
+        self.blocks = RasterBlocks(
+            snow_on_file, [snow_free_file], block_size
+        )
+
+    def difference(self, window):
+        """
+        :return: Snow depth of the block, with NODATA for excluded cells
+        """
+        snow_on = self.blocks.read(self.snow_on_file, window, self.band)
+        snow_free = self.blocks.read(self.snow_free_file, window, self.band)
+
+        depth = snow_on.astype(np.float32) - snow_free.astype(np.float32)
+        excluded = np.ma.getmaskarray(depth)
+        for mask_file in self.mask_files:
+            mask = self.blocks.read(
+                mask_file, window, resampling=Resampling.nearest
+            )
+            excluded |= np.ma.getmaskarray(mask) | (mask.filled(0) == 0)
+
+        return np.where(excluded, np.float32(self.NODATA), depth.data) \
+            .astype(np.float32)
+
+    def run(self):
+        profile = dict(
+            self.OUTPUT_OPTIONS,
+            crs=self.blocks.crs,
+            transform=self.blocks.transform,
+            width=self.blocks.width,
+            height=self.blocks.height,
+            nodata=self.NODATA,
+        )
+        # Blocks being processed, limits the blocks held in memory
+        in_flight = 2 * self.workers
+
+        try:
+            with rasterio.open(self.output_file, 'w', **profile) as output, \
+                    ThreadPoolExecutor(max_workers=self.workers) as executor:
+                output.set_band_description(1, 'snow depth')
+                pending = deque()
+                for window in self.blocks.windows():
+                    pending.append(
+                        (window, executor.submit(self.difference, window))
+                    )
+                    if len(pending) >= in_flight:
+                        window, block = pending.popleft()
+                        output.write(block.result(), 1, window=window)
+
+                while pending:
+                    window, block = pending.popleft()
+                    output.write(block.result(), 1, window=window)
+        finally:
+            self.blocks.close()
+
+        print('Saved: ' + self.output_file)
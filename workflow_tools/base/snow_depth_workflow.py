@@ -0,0 +1,416 @@
+import os
+
+from .workflow_graph import WorkflowStep
+
+
+class SnowDepthWorkflow(object):
+    """
+    Steps of the snow depth workflow, as in Workflow/workflow_ERW.slurm,
+    declared for the WorkflowGraph.
+
+    Folder structure under the scratch home, with the snow on and snow free
+    date names:
+      snow_on/Lidar        - ASO lidar and classification of the snow on date
+      snow_on/CASI         - CASI classification raster
+      snow_on/ASO          - ASO delivered DEM and snow depth rasters
+      snow_on/Stable-Ground - Stable ground mask from classifier step 4
+      snow_on/Agisoft      - SfM cloud of the snow on date
+      snow_free/Agisoft    - SfM cloud of the snow free date
+      snow_free/Lidar      - ASO lidar of the snow free date
+      snow_depth           - Snow depth difference
+
+    The project home is a copy of the Workflow folder with the pipelines
+    adjusted to the basin.
+
+    With thinning, pc_align runs on thinned reference and moving clouds and
+    the saved transform is applied to the full moving cloud for the DSM.
+    """
+    PC_ALIGN_SUFFIX = '-trans_source.laz'
+    TRANSFORM_SUFFIX = '-transform.txt'
+    THINNED_SUFFIX = '_thinned.laz'
+
+    # Tool names and their script relative to the project home
+    PC_ALIGN = 'pc_align'
+    SCRIPTS = {
+        PC_ALIGN: os.path.join('co-registration', '3_pc_align.sh'),
+    }
+    # Tools installed with this package
+    RESIDUAL_REPORT = 'residual_report'
+    SNOW_DEPTH = 'snow_depth'
+    STABLE_GROUND_MASK = 'stable_ground_mask'
+    THIN_CLOUD = 'thin_cloud'
+    TRANSFORM_CLOUD = 'transform_cloud'
+
+    def __init__(self, project_home, scratch_home, snow_on, snow_free,
+                 basin, thin_clouds=False):
+        """
+        :param project_home: Folder with the pipelines and scripts
+        :param scratch_home: Folder with the data of both dates
+        :param snow_on: Name of the snow on date, i.e. ERW_20180524
+        :param snow_free: Name of the snow free date, i.e. ERW_20180912
+        :param basin: Name of the basin in the output files, i.e. ERW
+        :param thin_clouds: Run pc_align on thinned clouds
+        """
+        self.project_home = project_home
+        self.scratch_home = scratch_home
+        self.snow_on = snow_on
+        self.snow_free = snow_free
+        self.basin = basin
+        self.thin_clouds = thin_clouds
+
+    def project_file(self, *path):
+        return os.path.join(self.project_home, *path)
+
+    def scratch_file(self, *path):
+        return os.path.join(self.scratch_home, *path)
+
+    def tools(self):
+        """
+        :return: Dictionary with the script per tool name
+        """
+        return {
+            tool: self.project_file(script)
+            for tool, script in self.SCRIPTS.items()
+        }
+
+    def pdal_step(self, name, pipeline, reader, writer, writer_type='las',
+                  raster=None):
+        """
+        PDAL pipeline reading one cloud and writing one file.
+        """
+        command = [
+            'pdal', 'pipeline', pipeline,
+            '--readers.las.filename=' + reader,
+        ]
+        inputs = [pipeline, reader]
+        if raster is not None:
+            command.append('--filters.colorization.raster=' + raster)
+            inputs.append(raster)
+        command.append('--writers.' + writer_type + '.filename=' + writer)
+
+        return WorkflowStep(name, command, inputs, [writer])
+
+    def pc_align_step(self, name, prefix, reference, moving):
+        return WorkflowStep(
+            name,
+            [self.PC_ALIGN, prefix, reference, moving],
+            [self.project_file(self.SCRIPTS[self.PC_ALIGN]),
+             reference, moving],
+            [prefix + self.PC_ALIGN_SUFFIX, prefix + self.TRANSFORM_SUFFIX],
+        )
+
+    def thinned_cloud(self, cloud):
+        return os.path.splitext(cloud)[0] + self.THINNED_SUFFIX
+
+    def thin_step(self, name, cloud, stratify_control_surfaces=True):
+        """
+        Thin a cloud by slope and, optionally, control surfaces.
+
+        :return: Tuple of the step and the thinned cloud
+        """
+        thinned = self.thinned_cloud(cloud)
+        command = [
+            self.THIN_CLOUD,
+            '--input', cloud,
+            '--output', thinned,
+            '--dem', self.aso_dem,
+        ]
+        inputs = [cloud, self.aso_dem]
+        if stratify_control_surfaces:
+            command += ['--stable', self.stable_ground_mask]
+            inputs.append(self.stable_ground_mask)
+
+        return WorkflowStep(name, command, inputs, [thinned]), thinned
+
+    def transform_step(self, name, transform, cloud, output):
+        return WorkflowStep(
+            name,
+            [self.TRANSFORM_CLOUD,
+             '--transform', transform,
+             '--input', cloud,
+             '--output', output],
+            [transform, cloud],
+            [output],
+        )
+
+    def alignment_steps(self, label, prefix, moving):
+        """
+        pc_align of a moving cloud to the reference cloud, on thinned clouds
+        when enabled.
+
+        :return: Tuple of the steps and the pc_align transform
+        """
+        steps = []
+        reference = self.reference_cloud
+        if self.thin_clouds:
+            reference = self.thinned_cloud(self.reference_cloud)
+            thin_moving, moving = self.thin_step(
+                'thin ' + label + ' moving cloud', moving
+            )
+            steps.append(thin_moving)
+
+        steps.append(self.pc_align_step(
+            label + ' pc_align', prefix, reference, moving
+        ))
+        return steps, prefix + self.TRANSFORM_SUFFIX
+
+    def classifier_steps(self):
+        lidar = self.scratch_file(self.snow_on, 'Lidar')
+        classified = os.path.join(
+            lidar, self.snow_on + '_cropped_classified.laz'
+        )
+        nor = os.path.join(lidar, self.snow_on + '_NoR_1m.tif')
+        snow_depth = self.scratch_file(
+            self.snow_on, 'ASO', self.snow_on + '_snow_depth.tif'
+        )
+        return [
+            self.pdal_step(
+                'classify cloud',
+                self.project_file('classifier', '1_classify_cloud.json'),
+                os.path.join(lidar, self.snow_on + '_merge.laz'),
+                classified,
+                raster=self.scratch_file(
+                    self.snow_on, 'CASI',
+                    self.snow_on + '_casi_classified.tif'
+                ),
+            ),
+            self.pdal_step(
+                'NoR geotiff',
+                self.project_file('classifier', '2_create_NoR_geotiff.json'),
+                classified,
+                nor,
+                writer_type='gdal',
+            ),
+            self.pdal_step(
+                'stable geotiff',
+                self.project_file(
+                    'classifier', '3_create_stable_geotiff.json'
+                ),
+                classified,
+                self.stable_ground,
+                writer_type='gdal',
+            ),
+            WorkflowStep(
+                'stable ground mask',
+                [self.STABLE_GROUND_MASK,
+                 '--nor', nor,
+                 '--stable', self.stable_ground,
+                 '--dem', self.aso_dem,
+                 '--snow-depth', snow_depth,
+                 '--output', self.stable_ground_mask],
+                [nor, self.stable_ground, self.aso_dem, snow_depth],
+                [self.stable_ground_mask],
+            ),
+            self.pdal_step(
+                'ASO reference DSM',
+                self.project_file('co-registration', '4R_create_geotiff.json'),
+                classified,
+                self.reference_dsm,
+                writer_type='gdal',
+            ),
+        ]
+
+    @property
+    def reference_cloud(self):
+        return self.scratch_file(
+            self.snow_on, 'Lidar', self.snow_on + '_reference.laz'
+        )
+
+    @property
+    def aso_dem(self):
+        return self.scratch_file(
+            self.snow_on, 'ASO', self.snow_on + '_dem.tif'
+        )
+
+    @property
+    def stable_ground_mask(self):
+        return self.scratch_file(
+            self.snow_on, 'Stable-Ground',
+            self.snow_on + '_NoR_FS_no_snow_1m.tif'
+        )
+
+    def reference_steps(self):
+        lidar = self.scratch_file(self.snow_on, 'Lidar')
+        steps = [
+            self.pdal_step(
+                'reference cloud',
+                self.project_file(
+                    'co-registration', '1L_prepare_fixed_cloud.json'
+                ),
+                os.path.join(
+                    lidar, self.snow_on + '_cropped_classified.laz'
+                ),
+                self.reference_cloud,
+                raster=self.stable_ground_mask,
+            ),
+        ]
+        if self.thin_clouds:
+            # All reference points are on the stable ground mask, so only
+            # the slope stratifies them
+            steps.append(self.thin_step(
+                'thin reference cloud', self.reference_cloud,
+                stratify_control_surfaces=False,
+            )[0])
+        return steps
+
+    @property
+    def reference_dsm(self):
+        return self.scratch_file(
+            self.snow_on, 'Lidar', self.snow_on + '_dsm_3m.tif'
+        )
+
+    @property
+    def stable_ground(self):
+        return self.scratch_file(
+            self.snow_on, 'Lidar', self.snow_on + '_stable_dem_1m.tif'
+        )
+
+    def residual_step(self, name, dsm, output):
+        """
+        Residuals of a co-registered DSM over stable ground.
+        """
+        return WorkflowStep(
+            name,
+            [self.RESIDUAL_REPORT,
+             '--dsm', dsm,
+             '--reference', self.reference_dsm,
+             '--stable', self.stable_ground,
+             '--output', output],
+            [dsm, self.reference_dsm, self.stable_ground],
+            [output, os.path.splitext(output)[0] + '.csv'],
+        )
+
+    def basin_dsm(self, date):
+        return self.scratch_file(
+            date, 'Agisoft',
+            date + '_' + self.basin + '_basin_dsm_3m.tif'
+        )
+
+    def sfm_steps(self, date, label, run_name):
+        """
+        Co-registration of the SfM cloud for one date.
+
+        :param date: Name of the date
+        :param label: Label of the date in the step names
+        :param run_name: Name of the pc_align run
+        """
+        sfm = self.scratch_file(date, 'Agisoft')
+        moving = os.path.join(sfm, date + '_moving.laz')
+        prefix = os.path.join(sfm, 'pc_align', run_name)
+        aligned = prefix + self.PC_ALIGN_SUFFIX
+        dsm = os.path.join(sfm, date + '_dsm_1m.tif')
+        option_file = self.project_file(
+            'process-helpers', 'resample_3m_cut.gdal'
+        )
+
+        steps = [
+            self.pdal_step(
+                label + ' moving cloud',
+                self.project_file(
+                    'co-registration', '2A_create_moving_cloud.json'
+                ),
+                os.path.join(sfm, date + '.laz'),
+                moving,
+            ),
+        ]
+        alignment, transform = self.alignment_steps(label, prefix, moving)
+        steps += alignment
+        if self.thin_clouds:
+            # pc_align only transformed the thinned cloud
+            aligned = os.path.join(
+                sfm, 'pc_align_transform', run_name + self.PC_ALIGN_SUFFIX
+            )
+            steps.append(self.transform_step(
+                label + ' apply transform', transform, moving, aligned
+            ))
+
+        return steps + [
+            self.pdal_step(
+                label + ' DSM',
+                self.project_file('co-registration', '4M_create_geotiff.json'),
+                aligned,
+                dsm,
+                writer_type='gdal',
+            ),
+            self.residual_step(
+                label + ' residuals', dsm,
+                os.path.join(sfm, date + '_residuals.json'),
+            ),
+            WorkflowStep(
+                label + ' basin DSM',
+                ['gdalwarp', '--optfile', option_file,
+                 dsm, self.basin_dsm(date)],
+                [option_file, dsm],
+                [self.basin_dsm(date)],
+            ),
+        ]
+
+    def snow_depth_steps(self):
+        output = self.scratch_file(
+            'snow_depth',
+            self.snow_on + '_' + self.basin + '_basin_snow_depth_3m.tif'
+        )
+        return [
+            WorkflowStep(
+                'snow depth',
+                [self.SNOW_DEPTH,
+                 '--snow-on', self.basin_dsm(self.snow_on),
+                 '--snow-free', self.basin_dsm(self.snow_free),
+                 '--output', output],
+                [self.basin_dsm(self.snow_on),
+                 self.basin_dsm(self.snow_free)],
+                [output],
+            ),
+        ]
+
+    def aso_snow_free_steps(self):
+        lidar = self.scratch_file(self.snow_free, 'Lidar')
+        merged = os.path.join(lidar, self.snow_free + '_merge.laz')
+        moving = os.path.join(lidar, self.snow_free + '_moving.laz')
+        last_only = os.path.join(lidar, self.snow_free + '_last_only.laz')
+        prefix = os.path.join(lidar, 'pc_align', 'snow_free')
+        transform_prefix = os.path.join(
+            lidar, 'pc_align_transform', 'snow_free'
+        )
+        steps = [
+            self.pdal_step(
+                'ASO snow free moving cloud',
+                self.project_file(
+                    'aso-reference', 'ASO_create_moving_cloud.json'
+                ),
+                merged,
+                moving,
+            ),
+        ]
+        alignment, transform = self.alignment_steps(
+            'ASO snow free', prefix, moving
+        )
+        steps += alignment
+
+        return steps + [
+            self.pdal_step(
+                'ASO snow free last only cloud',
+                self.project_file('aso-reference', 'last_only_cloud.json'),
+                merged,
+                last_only,
+            ),
+            self.transform_step(
+                'ASO snow free apply transform', transform, last_only,
+                transform_prefix + self.PC_ALIGN_SUFFIX,
+            ),
+            self.pdal_step(
+                'ASO snow free DSM',
+                self.project_file('aso-reference', 'ASO_geotiff.json'),
+                transform_prefix + self.PC_ALIGN_SUFFIX,
+                os.path.join(lidar, self.snow_free + '_Lidar_dsm_3.tif'),
+                writer_type='gdal',
+            ),
+        ]
+
+    def steps(self):
+        return self.classifier_steps() + \
+            self.reference_steps() + \
+            self.sfm_steps(self.snow_on, 'snow on', 'snow_on') + \
+            self.sfm_steps(self.snow_free, 'snow free', 'snow_free') + \
+            self.snow_depth_steps() + \
+            self.aso_snow_free_steps()
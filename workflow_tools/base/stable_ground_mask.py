@@ -0,0 +1,141 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+
+from .raster_blocks import RasterBlocks
+
+
+class StableGroundMask(object):
+    """
+    Stable ground mask of classifier step 4, processed block by block.
+
+    A cell is stable ground with a value of 1 when:
+      * It is a control surface, i.e. has a value in the output of
+        classifier/3_create_stable_geotiff.json
+      * All points have a 'NumberOfReturns' of 1, i.e. the maximum band of
+        classifier/2_create_NoR_geotiff.json is 1
+      * The slope of the DEM is more than 5 and less than 50 degrees
+      * ASO measured no snow depth, i.e. the snow depth has no data or is
+        not above zero
+    All other cells are 0. The mask is read by
+    co-registration/1L_prepare_fixed_cloud.json.
+
+    The output grid is the grid of the NoR raster, limited to the extent of
+    the control surface raster. The DEM is read bilinear and the snow depth
+    with the nearest value when on a different grid. See RasterBlocks.
+    """
+    NOR_BAND = 2
+    MIN_SLOPE = 5.0
+    MAX_SLOPE = 50.0
+    MAX_SNOW_DEPTH = 0.0
+    BLOCK_SIZE = RasterBlocks.BLOCK_SIZE
+    STABLE = 1
+
+    OUTPUT_OPTIONS = dict(
+        driver='GTiff',
+        dtype='uint8',
+        count=1,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress='LZW',
+        bigtiff='IF_SAFER',
+    )
+
+    def __init__(self, nor_file, stable_file, dem_file, snow_depth_file,
+                 output_file, nor_band=NOR_BAND, min_slope=MIN_SLOPE,
+                 max_slope=MAX_SLOPE, max_snow_depth=MAX_SNOW_DEPTH,
+                 block_size=BLOCK_SIZE, workers=1):
+        """
+        :param nor_file: Raster with the NumberOfReturns per cell
+        :param stable_file: Raster with the control surfaces
+        :param dem_file: DEM for the slope
+        :param snow_depth_file: ASO snow depth raster
+        :param output_file: GeoTIFF to write the mask to
+        :param nor_band: Band with the maximum NumberOfReturns
+        :param min_slope: Slope in degrees the cells have to be steeper than
+        :param max_slope: Slope in degrees the cells have to be flatter than
+        :param max_snow_depth: Snow depth above which cells have snow
+        :param block_size: Length of a processed block side in cells
+        :param workers: Number of threads processing blocks
+        """
+        self.nor_file = nor_file
+        self.stable_file = stable_file
+        self.dem_file = dem_file
+        self.snow_depth_file = snow_depth_file
+        self.output_file = output_file
+        self.nor_band = nor_band
+        self.min_slope = min_slope
+        self.max_slope = max_slope
+        self.max_snow_depth = max_snow_depth
+        self.workers = max(1, workers)
+        self.blocks = RasterBlocks(nor_file, [stable_file], block_size)
+
+    def mask(self, window):
+        """
+        :return: Mask of the block with STABLE for stable ground cells
+        """
+        nor = self.blocks.read(
+            self.nor_file, window, self.nor_band,
+            resampling=Resampling.nearest,
+        )
+        stable = self.blocks.read(
+            self.stable_file, window, resampling=Resampling.nearest
+        )
+        dem = self.blocks.read(self.dem_file, window, halo=1)
+        snow_depth = self.blocks.read(
+            self.snow_depth_file, window, resampling=Resampling.nearest
+        )
+
+        slope = RasterBlocks.slope(dem, self.blocks.resolution)
+        with np.errstate(invalid='ignore'):
+            stable_ground = (
+                ~np.ma.getmaskarray(stable) &
+                (nor.filled(0) == 1) &
+                (slope > self.min_slope) & (slope < self.max_slope) &
+                ~(snow_depth.filled(self.max_snow_depth) >
+                  self.max_snow_depth)
+            )
+
+        return np.where(stable_ground, self.STABLE, 0).astype(np.uint8)
+
+    def run(self):
+        profile = dict(
+            self.OUTPUT_OPTIONS,
+            crs=self.blocks.crs,
+            transform=self.blocks.transform,
+            width=self.blocks.width,
+            height=self.blocks.height,
+        )
+        # Blocks being processed, limits the blocks held in memory
+        in_flight = 2 * self.workers
+        stable_cells = 0
+
+        try:
+            with rasterio.open(self.output_file, 'w', **profile) as output, \
+                    ThreadPoolExecutor(max_workers=self.workers) as executor:
+                output.set_band_description(1, 'stable ground')
+                pending = deque()
+                for window in self.blocks.windows():
+                    pending.append(
+                        (window, executor.submit(self.mask, window))
+                    )
+                    if len(pending) >= in_flight:
+                        window, block = pending.popleft()
+                        block = block.result()
+                        stable_cells += int(np.count_nonzero(block))
+                        output.write(block, 1, window=window)
+
+                while pending:
+                    window, block = pending.popleft()
+                    block = block.result()
+                    stable_cells += int(np.count_nonzero(block))
+                    output.write(block, 1, window=window)
+        finally:
+            self.blocks.close()
+
+        print('Stable ground cells: ' + str(stable_cells))
+        print('Saved: ' + self.output_file)
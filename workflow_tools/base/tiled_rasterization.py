@@ -0,0 +1,421 @@
+import copy
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+import rasterio
+import rasterio.shutil
+import shapely
+from shapely.geometry import box, shape
+
+
+class TiledRasterization(object):
+    """
+    Run a PDAL pipeline ending with writers.gdal per tile of the output
+    grid in parallel and assemble the tiles into a VRT or Cloud Optimized
+    GeoTIFF.
+
+    The output grid is the grid of the writer for the pipeline bounds, or
+    for given bounds. With a boundary, the grid covers the bounds of the
+    boundary, aligned to the resolution, and tiles outside the boundary are
+    left out.
+
+    Each tile writes an exact part of the output grid. The points are
+    cropped to the tile with an overlap of at least the writer radius, so
+    every cell sees the same points as with a single pass and the tiles are
+    identical to the full raster at the seams.
+
+    A tile index GeoJSON (.geojson) as input is read with readers.tindex,
+    which only opens the files intersecting a tile. A COPC cloud (.copc.laz)
+    is read with readers.copc limited to the tile bounds. Any other cloud
+    is split once with 'pdal tile' into files of the tile size, indexed with
+    'pdal tindex' and then read as tile index, so no tile reads the whole
+    cloud.
+    """
+    TILE_SIZE = 2000
+    TILE_FOLDER_SUFFIX = '_tiles'
+    READER = 'readers.'
+    WRITER = 'writers.gdal'
+    TILE_INDEX_READER = 'readers.tindex'
+    TILE_INDEX_SUFFIX = '.geojson'
+    COPC_READER = 'readers.copc'
+    COPC_SUFFIX = '.copc.laz'
+    SPLIT_FOLDER = 'points'
+    VRT_SUFFIX = '.vrt'
+
+    COG_OPTIONS = dict(
+        COMPRESS='LZW', BIGTIFF='IF_SAFER', NUM_THREADS='ALL_CPUS',
+    )
+    GDAL_TYPES = {
+        'uint8': 'Byte', 'int8': 'Int8', 'uint16': 'UInt16',
+        'int16': 'Int16', 'uint32': 'UInt32', 'int32': 'Int32',
+        'float32': 'Float32', 'float64': 'Float64',
+    }
+
+    def __init__(self, pipeline_file, input_file, output_file,
+                 tile_size=TILE_SIZE, bounds=None, boundary=None,
+                 overlap=None, workers=1, pdal='pdal'):
+        """
+        :param pipeline_file: PDAL pipeline JSON with writers.gdal
+        :param input_file: Point cloud to read, a COPC cloud or a tile index
+                           GeoJSON
+        :param output_file: Output with .vrt ending for a VRT, otherwise a
+                            COG. The tiles are saved into a folder next to
+                            it.
+        :param tile_size: Length of a tile side in cells
+        :param bounds: Optional, bounds in PDAL format replacing the
+                       pipeline bounds
+        :param boundary: Optional, path to a GeoJSON boundary
+        :param overlap: Optional, overlap of the point crop in units of the
+                        CRS. Default: Writer radius plus one cell
+        :param workers: Number of tiles to run in parallel
+        :param pdal: PDAL executable
+        """
+        with open(pipeline_file, 'r') as pipeline:
+            self.pipeline = json.load(pipeline)['pipeline']
+        self.input_file = input_file
+        self.output_file = output_file
+        self.tile_size = tile_size
+        self.workers = max(1, workers)
+        self.pdal = pdal
+
+        writer = self.writer_stage(self.pipeline)
+        self.resolution = float(writer['resolution'])
+        self.boundary = None
+        if boundary is not None:
+            self.boundary = self.read_boundary(boundary)
+            bounds = self.boundary_bounds(self.boundary)
+        elif bounds is None:
+            bounds = writer.get('bounds')
+            if bounds is None:
+                raise ValueError('Pipeline writer has no bounds, '
+                                 'give bounds or a boundary')
+        self.bounds = self.parse_bounds(bounds) \
+            if isinstance(bounds, str) else bounds
+
+        if overlap is None:
+            radius = float(writer.get(
+                'radius', self.resolution * math.sqrt(2)
+            ))
+            window = int(writer.get('window_size', 0))
+            overlap = radius + (window + 1) * self.resolution
+        self.overlap = overlap
+
+        output_name = os.path.splitext(output_file)[0]
+        self.tile_path = output_name + self.TILE_FOLDER_SUFFIX
+        self.vrt_file = output_name + self.VRT_SUFFIX
+        # Input of the tile pipelines, the tile index of a split cloud
+        self.source_file = input_file
+
+    @classmethod
+    def writer_stage(cls, pipeline):
+        for stage in pipeline:
+            if isinstance(stage, dict) and stage.get('type') == cls.WRITER:
+                return stage
+        raise ValueError('Pipeline has no ' + cls.WRITER + ' stage')
+
+    @staticmethod
+    def parse_bounds(value):
+        """
+        Parse bounds in the PDAL format: ([xmin, xmax], [ymin, ymax])
+
+        :return: Tuple of (x_min, x_max, y_min, y_max)
+        """
+        values = [
+            float(number) for number in
+            re.findall(r'[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?', value)
+        ]
+        if len(values) < 4:
+            raise ValueError('Bounds need X and Y minimum and maximum')
+        return tuple(values[:4])
+
+    @staticmethod
+    def format_bounds(x_min, x_max, y_min, y_max):
+        return '([{!r}, {!r}], [{!r}, {!r}])'.format(
+            x_min, x_max, y_min, y_max
+        )
+
+    @staticmethod
+    def read_boundary(boundary_file):
+        with open(boundary_file, 'r') as boundary:
+            boundary = json.load(boundary)
+        features = boundary.get('features', [boundary])
+        return shapely.union_all([
+            shape(feature.get('geometry', feature)) for feature in features
+        ])
+
+    def boundary_bounds(self, boundary):
+        """
+        Bounds of the boundary, extended to the resolution
+        """
+        x_min, y_min, x_max, y_max = boundary.bounds
+        return (
+            math.floor(x_min / self.resolution) * self.resolution,
+            math.ceil(x_max / self.resolution) * self.resolution,
+            math.floor(y_min / self.resolution) * self.resolution,
+            math.ceil(y_max / self.resolution) * self.resolution,
+        )
+
+    @property
+    def grid_size(self):
+        """
+        Columns and rows of the output grid. Same as writers.gdal, the grid
+        has one cell more than fit into the bounds.
+        """
+        x_min, x_max, y_min, y_max = self.bounds
+        return (
+            int((x_max - x_min) / self.resolution) + 1,
+            int((y_max - y_min) / self.resolution) + 1,
+        )
+
+    @property
+    def grid_top(self):
+        return self.bounds[2] + self.grid_size[1] * self.resolution
+
+    def tile_extent(self, tile):
+        """
+        :param tile: Tuple of column and row offset, width and height in
+                     cells, with rows from the top
+        :return: Tuple of (x_min, x_max, y_min, y_max) of the tile cells
+        """
+        column, row, width, height = tile
+        x_min = self.bounds[0] + column * self.resolution
+        y_max = self.grid_top - row * self.resolution
+        return (
+            x_min, x_min + width * self.resolution,
+            y_max - height * self.resolution, y_max,
+        )
+
+    def tiles(self):
+        """
+        :return: List of tiles as (column, row, width, height) in cells
+        """
+        columns, rows = self.grid_size
+        tiles = []
+        for row in range(0, rows, self.tile_size):
+            for column in range(0, columns, self.tile_size):
+                tile = (
+                    column, row,
+                    min(self.tile_size, columns - column),
+                    min(self.tile_size, rows - row),
+                )
+                if self.boundary is not None:
+                    x_min, x_max, y_min, y_max = self.tile_extent(tile)
+                    if not self.boundary.intersects(
+                        box(x_min, y_min, x_max, y_max)
+                    ):
+                        continue
+                tiles.append(tile)
+
+        return tiles
+
+    def tile_file(self, tile):
+        return os.path.join(
+            self.tile_path, 'tile_{}_{}.tif'.format(tile[0], tile[1])
+        )
+
+    def tile_pipeline(self, tile):
+        """
+        Pipeline for a tile, with the reader and writer set to the tile
+        and the points cropped to the tile with the overlap.
+        """
+        x_min, x_max, y_min, y_max = self.tile_extent(tile)
+        crop_bounds = self.format_bounds(
+            x_min - self.overlap, x_max + self.overlap,
+            y_min - self.overlap, y_max + self.overlap,
+        )
+        # Half a cell less than the grid, which writers.gdal extends by one
+        width, height = tile[2:]
+        writer_bounds = self.format_bounds(
+            x_min, x_min + (width - 0.5) * self.resolution,
+            y_min, y_min + (height - 0.5) * self.resolution,
+        )
+
+        pipeline = []
+        for stage in copy.deepcopy(self.pipeline):
+            stage_type = stage.get('type', '')
+            if stage_type.startswith(self.READER):
+                if self.source_file.endswith(self.TILE_INDEX_SUFFIX):
+                    stage = dict(
+                        type=self.TILE_INDEX_READER, bounds=crop_bounds
+                    )
+                elif self.source_file.endswith(self.COPC_SUFFIX):
+                    stage = dict(type=self.COPC_READER, bounds=crop_bounds)
+                stage['filename'] = self.source_file
+                pipeline.append(stage)
+                pipeline.append(dict(type='filters.crop', bounds=crop_bounds))
+                continue
+            if stage_type == self.WRITER:
+                stage['filename'] = self.tile_file(tile)
+                stage['bounds'] = writer_bounds
+            pipeline.append(stage)
+
+        return dict(pipeline=pipeline)
+
+    def is_split(self, tiles):
+        """
+        Whether the input is split before rasterizing the tiles.
+        """
+        return len(tiles) > 1 and not (
+            self.input_file.endswith(self.TILE_INDEX_SUFFIX) or
+            self.input_file.endswith(self.COPC_SUFFIX)
+        )
+
+    def split_input(self):
+        """
+        Split the input cloud into files aligned with the tiles in one pass
+        and index them.
+
+        :return: Error output of PDAL, None on success
+        """
+        split_path = os.path.join(self.tile_path, self.SPLIT_FOLDER)
+        shutil.rmtree(split_path, ignore_errors=True)
+        os.makedirs(split_path)
+        index_file = os.path.join(
+            split_path, 'tile_index' + self.TILE_INDEX_SUFFIX
+        )
+
+        for command in [
+            [self.pdal, 'tile',
+             '--length', repr(self.tile_size * self.resolution),
+             '--origin_x', repr(self.bounds[0]),
+             '--origin_y', repr(self.bounds[2]),
+             self.input_file,
+             os.path.join(split_path, 'points_#.laz')],
+            # Bounds from the file headers, without reading the points
+            [self.pdal, 'tindex', 'create',
+             '--tindex', index_file,
+             '--filespec', os.path.join(
+                 os.path.abspath(split_path), 'points_*.laz'
+             ),
+             '--fast_boundary',
+             '--ogrdriver', 'GeoJSON'],
+        ]:
+            result = subprocess.run(
+                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                universal_newlines=True,
+            )
+            if result.returncode != 0:
+                return result.stdout.strip() or \
+                    'Exit code ' + str(result.returncode)
+
+        self.source_file = index_file
+        return None
+
+    def run_tile(self, tile):
+        """
+        :return: Error output of PDAL, None on success
+        """
+        pipeline_file = os.path.splitext(self.tile_file(tile))[0] + '.json'
+        with open(pipeline_file, 'w') as pipeline:
+            json.dump(self.tile_pipeline(tile), pipeline, indent=2)
+
+        result = subprocess.run(
+            [self.pdal, 'pipeline', pipeline_file],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+        if result.returncode != 0:
+            return result.stdout.strip() or \
+                'Exit code ' + str(result.returncode)
+        return None
+
+    def write_vrt(self, tiles):
+        """
+        Write a VRT placing each tile at its offset in the output grid.
+        """
+        with rasterio.open(self.tile_file(tiles[0])) as first_tile:
+            profile = first_tile.profile
+            descriptions = first_tile.descriptions
+
+        columns, rows = self.grid_size
+        dataset = ElementTree.Element(
+            'VRTDataset', rasterXSize=str(columns), rasterYSize=str(rows)
+        )
+        if profile['crs'] is not None:
+            ElementTree.SubElement(dataset, 'SRS').text = \
+                profile['crs'].to_wkt()
+        ElementTree.SubElement(dataset, 'GeoTransform').text = ', '.join(
+            repr(value) for value in (
+                self.bounds[0], self.resolution, 0.0,
+                self.grid_top, 0.0, -self.resolution,
+            )
+        )
+
+        vrt_path = os.path.dirname(os.path.abspath(self.vrt_file))
+        for band in range(1, profile['count'] + 1):
+            vrt_band = ElementTree.SubElement(
+                dataset, 'VRTRasterBand', band=str(band),
+                dataType=self.GDAL_TYPES[profile['dtype']],
+            )
+            if descriptions[band - 1]:
+                ElementTree.SubElement(vrt_band, 'Description').text = \
+                    descriptions[band - 1]
+            if profile['nodata'] is not None:
+                ElementTree.SubElement(vrt_band, 'NoDataValue').text = \
+                    repr(profile['nodata'])
+
+            for tile in tiles:
+                column, row, width, height = tile
+                source = ElementTree.SubElement(vrt_band, 'SimpleSource')
+                ElementTree.SubElement(
+                    source, 'SourceFilename', relativeToVRT='1'
+                ).text = os.path.relpath(
+                    os.path.abspath(self.tile_file(tile)), vrt_path
+                )
+                ElementTree.SubElement(source, 'SourceBand').text = str(band)
+                size = dict(xSize=str(width), ySize=str(height))
+                ElementTree.SubElement(
+                    source, 'SrcRect', xOff='0', yOff='0', **size
+                )
+                ElementTree.SubElement(
+                    source, 'DstRect', xOff=str(column), yOff=str(row),
+                    **size
+                )
+
+        ElementTree.ElementTree(dataset).write(self.vrt_file)
+
+    def run(self):
+        """
+        Rasterize all tiles and assemble the output.
+
+        :return: True when all tiles were written
+        """
+        os.makedirs(self.tile_path, exist_ok=True)
+        tiles = self.tiles()
+        columns, rows = self.grid_size
+        print('Rasterizing ' + str(len(tiles)) + ' tiles for a grid of ' +
+              str(columns) + ' x ' + str(rows) + ' cells')
+
+        if self.is_split(tiles):
+            print('Splitting ' + self.input_file + ' into tiles')
+            error = self.split_input()
+            if error is not None:
+                print('**** Splitting the input failed:\n' + error)
+                return False
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            errors = list(executor.map(self.run_tile, tiles))
+
+        failed = [
+            (tile, error) for tile, error in zip(tiles, errors)
+            if error is not None
+        ]
+        for tile, error in failed:
+            print('**** Tile ' + self.tile_file(tile) + ' failed:\n' + error)
+        if failed or not tiles:
+            return False
+
+        self.write_vrt(tiles)
+        if self.output_file != self.vrt_file:
+            rasterio.shutil.copy(
+                self.vrt_file, self.output_file, driver='COG',
+                **self.COG_OPTIONS
+            )
+        print('Saved: ' + self.output_file)
+        return True
@@ -0,0 +1,390 @@
+import datetime
+import hashlib
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class WorkflowStep(object):
+    """
+    Single command of a workflow with the files it reads and writes.
+
+    The first element of the command is the tool name, which is replaced
+    with the executable configured for the tool when running the step. All
+    other elements are passed as given.
+    """
+
+    def __init__(self, name, command, inputs=(), outputs=(), parameters=None,
+                 working_directory=None):
+        """
+        :param name: Unique name of the step
+        :param command: List with the tool name and the arguments
+        :param inputs: Files read by the step, including pipeline and option
+                       files
+        :param outputs: Files written by the step
+        :param parameters: Optional, dictionary of values the outputs depend
+                           on, that are not part of the command
+        :param working_directory: Optional, directory to run the command in
+        """
+        self.name = name
+        self.command = [str(argument) for argument in command]
+        self.inputs = [str(path) for path in inputs]
+        self.outputs = [str(path) for path in outputs]
+        self.parameters = parameters or {}
+        self.working_directory = working_directory
+
+    @property
+    def tool(self):
+        return self.command[0]
+
+
+class WorkflowGraph(object):
+    """
+    Run workflow steps as a dependency graph. A step depends on the steps
+    writing its inputs. Independent steps run in parallel, up to the given
+    number of tasks.
+
+    A step is skipped when it completed before with the same key and all of
+    its outputs exist. The key is a hash of the command, the parameters and
+    the content of all inputs. Content hashes of the inputs are cached by
+    file size and modification time, so unchanged files are only read once.
+
+    Files saved into the state path:
+      * workflow_state.json
+        Key of each completed step and the cached input hashes.
+      * workflow_timing.json
+        Wall time and status of each step, with one entry per run.
+      * logs/<step name>.log
+        Output of the step command.
+
+    When a step fails, steps depending on it are blocked and all other
+    steps continue.
+    """
+    STATE_FILE = 'workflow_state.json'
+    TIMING_FILE = 'workflow_timing.json'
+    LOG_FOLDER = 'logs'
+    HASH_BLOCK_SIZE = 2 ** 20
+
+    COMPLETED = 'completed'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+    BLOCKED = 'blocked'
+
+    def __init__(self, steps, state_path, tasks=1, tools=None):
+        """
+        :param steps: List of WorkflowStep
+        :param state_path: Directory for the state, timing and log files
+        :param tasks: Maximum number of steps to run in parallel
+        :param tools: Optional, dictionary of executables per tool name.
+                      Tools not given are run by name.
+        """
+        self.steps = {}
+        for step in steps:
+            if step.name in self.steps:
+                raise ValueError('Duplicate step name: ' + step.name)
+            self.steps[step.name] = step
+
+        self.state_path = state_path
+        self.tasks = max(1, tasks)
+        self.tools = tools or {}
+        self.dependencies = self.find_dependencies()
+        self.state = self.read_json(self.state_file, dict(steps={}, files={}))
+        self.step_times = []
+
+    @property
+    def state_file(self):
+        return os.path.join(self.state_path, self.STATE_FILE)
+
+    @property
+    def timing_file(self):
+        return os.path.join(self.state_path, self.TIMING_FILE)
+
+    def log_file(self, step):
+        return os.path.join(
+            self.state_path, self.LOG_FOLDER,
+            step.name.replace(' ', '_').replace(os.sep, '_') + '.log'
+        )
+
+    def find_dependencies(self):
+        """
+        :return: Dictionary with the names of the steps each step depends on
+        """
+        producers = {}
+        for step in self.steps.values():
+            for output in step.outputs:
+                output = os.path.abspath(output)
+                if output in producers:
+                    raise ValueError(
+                        'Output of ' + step.name + ' is also written by ' +
+                        producers[output] + ': ' + output
+                    )
+                producers[output] = step.name
+
+        dependencies = {
+            step.name: set(
+                producers[os.path.abspath(path)] for path in step.inputs
+                if os.path.abspath(path) in producers
+            ) - {step.name}
+            for step in self.steps.values()
+        }
+        self.check_cycles(dependencies)
+        return dependencies
+
+    @staticmethod
+    def check_cycles(dependencies):
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError('Dependency cycle at step: ' + name)
+            visiting.add(name)
+            for dependency in dependencies[name]:
+                visit(dependency)
+            visiting.remove(name)
+            visited.add(name)
+
+        for step_name in dependencies:
+            visit(step_name)
+
+    def selected_steps(self, targets=None):
+        """
+        :param targets: Optional, step names to run along with all steps
+                        they depend on. Default: All steps
+        :return: Set of step names
+        """
+        if targets is None:
+            return set(self.steps)
+
+        selected = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in self.steps:
+                raise ValueError('Unknown step: ' + name)
+            if name not in selected:
+                selected.add(name)
+                pending.extend(self.dependencies[name])
+
+        return selected
+
+    def ordered_steps(self, names):
+        """
+        :return: Given step names sorted so that each step follows the steps
+                 it depends on
+        """
+        ordered = []
+        remaining = [name for name in self.steps if name in names]
+        while remaining:
+            for name in remaining:
+                if not (self.dependencies[name] & set(remaining)):
+                    ordered.append(name)
+                    remaining.remove(name)
+                    break
+
+        return ordered
+
+    @staticmethod
+    def read_json(file_path, default):
+        if not os.path.exists(file_path):
+            return default
+
+        with open(file_path, 'r') as json_file:
+            try:
+                return json.load(json_file)
+            except ValueError:
+                return default
+
+    @staticmethod
+    def write_json(file_path, content):
+        temp_file = file_path + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_file, 'w') as json_file:
+            json.dump(content, json_file, indent=2)
+        os.replace(temp_file, file_path)
+
+    @staticmethod
+    def timestamp(seconds):
+        return datetime.datetime.fromtimestamp(seconds).isoformat(
+            timespec='seconds'
+        )
+
+    def file_hash(self, file_path):
+        """
+        Content hash of a file, cached by size and modification time.
+        """
+        stat = os.stat(file_path)
+        cached = self.state['files'].get(os.path.abspath(file_path))
+        if cached is not None and cached['size'] == stat.st_size and \
+                cached['mtime'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        content_hash = hashlib.sha256()
+        with open(file_path, 'rb') as source:
+            for block in iter(
+                lambda: source.read(self.HASH_BLOCK_SIZE), b''
+            ):
+                content_hash.update(block)
+
+        self.state['files'][os.path.abspath(file_path)] = dict(
+            size=stat.st_size,
+            mtime=stat.st_mtime_ns,
+            sha256=content_hash.hexdigest(),
+        )
+        return content_hash.hexdigest()
+
+    def step_key(self, step):
+        """
+        :return: Hash of the command, parameters and input contents
+        """
+        key = hashlib.sha256()
+        key.update(json.dumps(
+            [step.command, step.parameters], sort_keys=True
+        ).encode())
+        for path in step.inputs:
+            key.update(path.encode())
+            key.update(self.file_hash(path).encode())
+
+        return key.hexdigest()
+
+    def is_up_to_date(self, step, key):
+        completed = self.state['steps'].get(step.name, {})
+        return completed.get('key') == key and \
+            all(os.path.exists(path) for path in step.outputs)
+
+    def run_command(self, step):
+        """
+        Run the command of a step with the output written to the log file.
+
+        :return: Exit code of the command
+        """
+        command = [self.tools.get(step.tool, step.tool)] + step.command[1:]
+        for output in step.outputs:
+            os.makedirs(os.path.dirname(os.path.abspath(output)),
+                        exist_ok=True)
+        if step.working_directory is not None:
+            os.makedirs(step.working_directory, exist_ok=True)
+
+        with open(self.log_file(step), 'w') as log:
+            log.write(' '.join(command) + '\n')
+            log.flush()
+            try:
+                return subprocess.run(
+                    command, cwd=step.working_directory,
+                    stdout=log, stderr=subprocess.STDOUT,
+                ).returncode
+            except OSError as error:
+                log.write(str(error) + '\n')
+                return -1
+
+    def add_step_time(self, step, status, start=None):
+        wall_time = 0.0 if start is None else time.time() - start
+        self.step_times.append(dict(
+            step=step.name, status=status, wall_time=round(wall_time, 3),
+        ))
+        print('  {}: {} ({:.0f} s)'.format(step.name, status, wall_time))
+
+    def write_report(self, run_start, previous_runs):
+        self.write_json(self.timing_file, dict(
+            runs=previous_runs + [dict(
+                start=self.timestamp(run_start),
+                wall_time=round(time.time() - run_start, 3),
+                tasks=self.tasks,
+                steps=self.step_times,
+            )]
+        ))
+
+    def start_step(self, step):
+        """
+        Check the inputs of a step before running it.
+
+        :return: Key of the step, None when an input is missing
+        """
+        missing = [path for path in step.inputs if not os.path.exists(path)]
+        if missing:
+            print('**** Missing inputs for ' + step.name + ':\n    ' +
+                  '\n    '.join(missing))
+            return None
+        return self.step_key(step)
+
+    def run(self, targets=None, force=False, dry_run=False):
+        """
+        Run the selected steps.
+
+        :param targets: Optional, step names to run with the steps they
+                        depend on. Default: All steps
+        :param force: Run the steps, even when up to date
+        :param dry_run: Only print the steps in order
+
+        :return: True when no step failed or was blocked
+        """
+        selected = self.selected_steps(targets)
+        pending = self.ordered_steps(selected)
+        if dry_run:
+            for name in pending:
+                print(name + ': ' + ' '.join(self.steps[name].command))
+            return True
+
+        os.makedirs(os.path.join(self.state_path, self.LOG_FOLDER),
+                    exist_ok=True)
+        run_start = time.time()
+        previous_runs = self.read_json(self.timing_file, dict(runs=[]))['runs']
+        done, failed = set(), set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.tasks) as executor:
+            while pending or running:
+                for name in list(pending):
+                    dependencies = self.dependencies[name] & selected
+                    if dependencies & failed:
+                        pending.remove(name)
+                        failed.add(name)
+                        self.add_step_time(self.steps[name], self.BLOCKED)
+                        continue
+                    if len(running) >= self.tasks or \
+                            not dependencies <= done:
+                        continue
+
+                    pending.remove(name)
+                    step = self.steps[name]
+                    key = self.start_step(step)
+                    if key is None:
+                        failed.add(name)
+                        self.add_step_time(step, self.FAILED)
+                    elif not force and self.is_up_to_date(step, key):
+                        done.add(name)
+                        self.add_step_time(step, self.SKIPPED)
+                    else:
+                        start = time.time()
+                        running[executor.submit(self.run_command, step)] = \
+                            (step, key, start)
+
+                if not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step, key, start = running.pop(future)
+                    if future.result() == 0:
+                        done.add(step.name)
+                        self.state['steps'][step.name] = dict(
+                            key=key, completed=self.timestamp(time.time()),
+                        )
+                        self.add_step_time(step, self.COMPLETED, start)
+                    else:
+                        failed.add(step.name)
+                        self.state['steps'].pop(step.name, None)
+                        self.add_step_time(step, self.FAILED, start)
+                        print('    see: ' + self.log_file(step))
+
+                self.write_json(self.state_file, self.state)
+                self.write_report(run_start, previous_runs)
+
+        self.write_json(self.state_file, self.state)
+        self.write_report(run_start, previous_runs)
+        print('Workflow finished in {:.0f} s, timing report: {}'.format(
+            time.time() - run_start, self.timing_file
+        ))
+        return len(failed) == 0
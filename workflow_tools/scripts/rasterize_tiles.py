@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+
+from workflow_tools.base import TiledRasterization
+
+
+def parser():
+    argument_parser = argparse.ArgumentParser(
+        description='Run a PDAL pipeline with writers.gdal per tile in '
+                    'parallel and assemble the tiles into a VRT or COG.'
+    )
+    argument_parser.add_argument(
+        '--pipeline',
+        type=str,
+        help='Path to the PDAL pipeline JSON, i.e. 4M_create_geotiff.json',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--input',
+        type=str,
+        help='Point cloud to rasterize, a COPC cloud or a tile index '
+             'GeoJSON. Other clouds are split into tiles first.',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--output',
+        type=str,
+        help='Output raster. Written as VRT with a .vrt ending, otherwise '
+             'as Cloud Optimized GeoTIFF',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--tile-size',
+        type=int,
+        default=TiledRasterization.TILE_SIZE,
+        help='Length of a tile side in cells. '
+             'Default: ' + str(TiledRasterization.TILE_SIZE),
+    )
+    argument_parser.add_argument(
+        '--bounds',
+        type=str,
+        help='Bounds replacing the pipeline bounds in PDAL format, i.e. '
+             '"([322521.0, 336549.0], [4305591.0, 4322442.0])"',
+    )
+    argument_parser.add_argument(
+        '--boundary',
+        type=str,
+        help='Path to a boundary in GeoJSON format. The output covers the '
+             'boundary and tiles outside of it are left out.',
+    )
+    argument_parser.add_argument(
+        '--overlap',
+        type=float,
+        help='Overlap of the points cropped for a tile in units of the CRS. '
+             'Default: Writer radius plus one cell',
+    )
+    argument_parser.add_argument(
+        '--workers',
+        type=int,
+        default=int(os.environ.get('SLURM_NTASKS', os.cpu_count())),
+        help='Number of tiles to rasterize in parallel. '
+             'Default: SLURM_NTASKS or the number of CPUs',
+    )
+    argument_parser.add_argument(
+        '--pdal',
+        type=str,
+        default='pdal',
+        help='PDAL executable. Default: pdal',
+    )
+    return argument_parser
+
+
+def main():
+    arguments = parser().parse_args()
+
+    rasterization = TiledRasterization(
+        arguments.pipeline,
+        arguments.input,
+        arguments.output,
+        tile_size=arguments.tile_size,
+        bounds=arguments.bounds,
+        boundary=arguments.boundary,
+        overlap=arguments.overlap,
+        workers=arguments.workers,
+        pdal=arguments.pdal,
+    )
+    if not rasterization.run():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
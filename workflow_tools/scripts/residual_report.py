@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+
+from workflow_tools.base import StableGroundResiduals
+
+
+def parser():
+    argument_parser = argparse.ArgumentParser(
+        description='Report the residuals of a co-registered DSM to the '
+                    'reference DSM over stable ground.'
+    )
+    argument_parser.add_argument(
+        '--dsm',
+        type=str,
+        help='Path to the co-registered DSM',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--reference',
+        type=str,
+        help='Path to the reference DSM',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--stable',
+        type=str,
+        help='Path to the control surface raster, '
+             'i.e. from 3_create_stable_geotiff.json',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--output',
+        type=str,
+        help='Path to the JSON report. A CSV with the same name is written '
+             'too.',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--dsm-band',
+        type=int,
+        default=StableGroundResiduals.DSM_BAND,
+        help='Band of the DSM with the elevation. '
+             'Default: ' + str(StableGroundResiduals.DSM_BAND),
+    )
+    argument_parser.add_argument(
+        '--reference-band',
+        type=int,
+        default=StableGroundResiduals.REFERENCE_BAND,
+        help='Band of the reference DSM with the elevation. '
+             'Default: ' + str(StableGroundResiduals.REFERENCE_BAND),
+    )
+    argument_parser.add_argument(
+        '--stable-band',
+        type=int,
+        default=StableGroundResiduals.STABLE_BAND,
+        help='Band of the control surface raster. '
+             'Default: ' + str(StableGroundResiduals.STABLE_BAND),
+    )
+    argument_parser.add_argument(
+        '--slope-bands',
+        type=lambda value: [float(edge) for edge in value.split(',')],
+        default=StableGroundResiduals.SLOPE_BANDS,
+        help='Comma separated edges of the slope bands in degrees. '
+             'Default: ' +
+             ','.join(str(edge) for edge in StableGroundResiduals.SLOPE_BANDS),
+    )
+    argument_parser.add_argument(
+        '--elevation-band',
+        type=float,
+        default=StableGroundResiduals.ELEVATION_BAND,
+        help='Height of the elevation bands in meters. '
+             'Default: ' + str(StableGroundResiduals.ELEVATION_BAND),
+    )
+    argument_parser.add_argument(
+        '--max-median',
+        type=float,
+        help='Exit with an error when the absolute median residual over all '
+             'stable ground is larger',
+    )
+    argument_parser.add_argument(
+        '--max-nmad',
+        type=float,
+        help='Exit with an error when the NMAD over all stable ground is '
+             'larger',
+    )
+    argument_parser.add_argument(
+        '--workers',
+        type=int,
+        default=int(os.environ.get('SLURM_NTASKS', os.cpu_count())),
+        help='Number of threads processing blocks. '
+             'Default: SLURM_NTASKS or the number of CPUs',
+    )
+    return argument_parser
+
+
+def main():
+    arguments = parser().parse_args()
+
+    residuals = StableGroundResiduals(
+        arguments.dsm,
+        arguments.reference,
+        arguments.stable,
+        dsm_band=arguments.dsm_band,
+        reference_band=arguments.reference_band,
+        stable_band=arguments.stable_band,
+        slope_bands=arguments.slope_bands,
+        elevation_band=arguments.elevation_band,
+        workers=arguments.workers,
+    )
+    report = residuals.report(residuals.run())
+    residuals.write_report(report, arguments.output)
+
+    overall = report.iloc[0]
+    print('Stable ground cells: {:.0f}'.format(overall['count']))
+    if overall['count'] == 0:
+        print('**** No stable ground cells')
+        sys.exit(1)
+
+    print('  median {:.3f} m, NMAD {:.3f} m, RMSE {:.3f} m'.format(
+        overall['median'], overall['nmad'], overall['rmse']
+    ))
+    failed = False
+    if arguments.max_median is not None and \
+            abs(overall['median']) > arguments.max_median:
+        print('**** Median residual above ' + str(arguments.max_median))
+        failed = True
+    if arguments.max_nmad is not None and \
+            overall['nmad'] > arguments.max_nmad:
+        print('**** NMAD above ' + str(arguments.max_nmad))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+
+from workflow_tools.base import SnowDepthWorkflow, WorkflowGraph
+
+
+def parse_tool(value):
+    tool, executable = value.split('=', 1)
+    return tool.strip(), executable.strip()
+
+
+def parser():
+    argument_parser = argparse.ArgumentParser(
+        description='Run the snow depth workflow steps as a dependency '
+                    'graph, skipping steps with unchanged inputs.'
+    )
+    argument_parser.add_argument(
+        '--project-home',
+        type=str,
+        help='Folder with the workflow pipelines and scripts',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--scratch-home',
+        type=str,
+        help='Folder with the data of both dates',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--snow-on',
+        type=str,
+        help='Name of the snow on date, i.e. ERW_20180524',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--snow-free',
+        type=str,
+        help='Name of the snow free date, i.e. ERW_20180912',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--basin',
+        type=str,
+        help='Name of the basin in the output files, i.e. ERW',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--state-path',
+        type=str,
+        help='Folder for the state, timing and log files. '
+             'Default: workflow under the scratch home',
+    )
+    argument_parser.add_argument(
+        '--tasks',
+        type=int,
+        default=int(os.environ.get('SLURM_NTASKS', 1)),
+        help='Number of steps to run in parallel. '
+             'Default: SLURM_NTASKS or 1',
+    )
+    argument_parser.add_argument(
+        '--steps',
+        nargs='+',
+        help='Only run these steps and the steps they depend on',
+    )
+    argument_parser.add_argument(
+        '--tool',
+        type=parse_tool,
+        action='append',
+        default=[],
+        help='Executable for a tool as name=path, i.e. to use a stand-in '
+             'command. Can be given multiple times.',
+    )
+    argument_parser.add_argument(
+        '--thin-clouds',
+        action='store_true',
+        help='Run pc_align on thinned reference and moving clouds and '
+             'apply the transform to the full moving clouds',
+    )
+    argument_parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Run all selected steps, even when up to date',
+    )
+    argument_parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Only list the selected steps in order',
+    )
+    return argument_parser
+
+
+def main():
+    arguments = parser().parse_args()
+
+    workflow = SnowDepthWorkflow(
+        arguments.project_home,
+        arguments.scratch_home,
+        arguments.snow_on,
+        arguments.snow_free,
+        arguments.basin,
+        thin_clouds=arguments.thin_clouds,
+    )
+    tools = workflow.tools()
+    tools.update(dict(arguments.tool))
+
+    graph = WorkflowGraph(
+        workflow.steps(),
+        arguments.state_path or os.path.join(
+            arguments.scratch_home, 'workflow'
+        ),
+        arguments.tasks,
+        tools,
+    )
+    if not graph.run(arguments.steps, arguments.force, arguments.dry_run):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
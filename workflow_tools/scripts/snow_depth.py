@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+
+from workflow_tools.base import SnowDepthDifference
+
+
+def parser():
+    argument_parser = argparse.ArgumentParser(
+        description='Snow depth as difference of the snow on minus the snow '
+                    'free DSM, processed in blocks.'
+    )
+    argument_parser.add_argument(
+        '--snow-on',
+        type=str,
+        help='Path to the snow on DSM',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--snow-free',
+        type=str,
+        help='Path to the snow free DSM',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--output',
+        type=str,
+        help='Path to the snow depth GeoTIFF to write',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--band',
+        type=int,
+        default=SnowDepthDifference.BAND,
+        help='Band of the DSMs with the elevation. '
+             'Default: ' + str(SnowDepthDifference.BAND),
+    )
+    argument_parser.add_argument(
+        '--mask',
+        type=str,
+        action='append',
+        default=[],
+        help='Raster with zero for cells to exclude. '
+             'Can be given multiple times.',
+    )
+    argument_parser.add_argument(
+        '--block-size',
+        type=int,
+        default=SnowDepthDifference.BLOCK_SIZE,
+        help='Length of a processed block side in cells. '
+             'Default: ' + str(SnowDepthDifference.BLOCK_SIZE),
+    )
+    argument_parser.add_argument(
+        '--workers',
+        type=int,
+        default=int(os.environ.get('SLURM_NTASKS', os.cpu_count())),
+        help='Number of threads processing blocks. '
+             'Default: SLURM_NTASKS or the number of CPUs',
+    )
+    return argument_parser
+
+
+def main():
+    arguments = parser().parse_args()
+
+    SnowDepthDifference(
+        arguments.snow_on,
+        arguments.snow_free,
+        arguments.output,
+        band=arguments.band,
+        mask_files=arguments.mask,
+        block_size=arguments.block_size,
+        workers=arguments.workers,
+    ).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+
+from workflow_tools.base import StableGroundMask
+
+
+def parser():
+    argument_parser = argparse.ArgumentParser(
+        description='Create the stable ground mask of classifier step 4, '
+                    'processed in blocks.'
+    )
+    argument_parser.add_argument(
+        '--nor',
+        type=str,
+        help='Path to the NumberOfReturns raster, '
+             'i.e. from 2_create_NoR_geotiff.json',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--stable',
+        type=str,
+        help='Path to the control surface raster, '
+             'i.e. from 3_create_stable_geotiff.json',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--dem',
+        type=str,
+        help='Path to the DEM for the slope',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--snow-depth',
+        type=str,
+        help='Path to the ASO snow depth raster',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--output',
+        type=str,
+        help='Path to the mask GeoTIFF to write',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--nor-band',
+        type=int,
+        default=StableGroundMask.NOR_BAND,
+        help='Band of the NumberOfReturns raster with the maximum. '
+             'Default: ' + str(StableGroundMask.NOR_BAND),
+    )
+    argument_parser.add_argument(
+        '--min-slope',
+        type=float,
+        default=StableGroundMask.MIN_SLOPE,
+        help='Slope in degrees stable ground is steeper than. '
+             'Default: ' + str(StableGroundMask.MIN_SLOPE),
+    )
+    argument_parser.add_argument(
+        '--max-slope',
+        type=float,
+        default=StableGroundMask.MAX_SLOPE,
+        help='Slope in degrees stable ground is flatter than. '
+             'Default: ' + str(StableGroundMask.MAX_SLOPE),
+    )
+    argument_parser.add_argument(
+        '--max-snow-depth',
+        type=float,
+        default=StableGroundMask.MAX_SNOW_DEPTH,
+        help='ASO snow depth above which a cell has snow. '
+             'Default: ' + str(StableGroundMask.MAX_SNOW_DEPTH),
+    )
+    argument_parser.add_argument(
+        '--block-size',
+        type=int,
+        default=StableGroundMask.BLOCK_SIZE,
+        help='Length of a processed block side in cells. '
+             'Default: ' + str(StableGroundMask.BLOCK_SIZE),
+    )
+    argument_parser.add_argument(
+        '--workers',
+        type=int,
+        default=int(os.environ.get('SLURM_NTASKS', os.cpu_count())),
+        help='Number of threads processing blocks. '
+             'Default: SLURM_NTASKS or the number of CPUs',
+    )
+    return argument_parser
+
+
+def main():
+    arguments = parser().parse_args()
+
+    StableGroundMask(
+        arguments.nor,
+        arguments.stable,
+        arguments.dem,
+        arguments.snow_depth,
+        arguments.output,
+        nor_band=arguments.nor_band,
+        min_slope=arguments.min_slope,
+        max_slope=arguments.max_slope,
+        max_snow_depth=arguments.max_snow_depth,
+        block_size=arguments.block_size,
+        workers=arguments.workers,
+    ).run()
+
+
+if __name__ == '__main__':
+    main()
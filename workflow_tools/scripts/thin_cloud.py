@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+
+from workflow_tools.base import PointCloudThinning
+
+
+def parser():
+    argument_parser = argparse.ArgumentParser(
+        description='Thin a point cloud to a maximum number of points per '
+                    'voxel, stratified by slope and control surfaces.'
+    )
+    argument_parser.add_argument(
+        '--input',
+        type=str,
+        help='Path to the LAS or LAZ cloud to thin',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--output',
+        type=str,
+        help='Path to the thinned cloud, compressed for a .laz ending',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--voxel-size',
+        type=float,
+        default=PointCloudThinning.VOXEL_SIZE,
+        help='Length of a voxel side in units of the CRS. '
+             'Default: ' + str(PointCloudThinning.VOXEL_SIZE),
+    )
+    argument_parser.add_argument(
+        '--cell-cap',
+        type=int,
+        default=PointCloudThinning.CELL_CAP,
+        help='Maximum number of points per voxel and stratum. '
+             'Default: ' + str(PointCloudThinning.CELL_CAP),
+    )
+    argument_parser.add_argument(
+        '--dem',
+        type=str,
+        help='Optional, DEM to stratify the points by slope',
+    )
+    argument_parser.add_argument(
+        '--stable',
+        type=str,
+        help='Optional, raster with values other than zero for control '
+             'surfaces, i.e. the stable ground mask',
+    )
+    argument_parser.add_argument(
+        '--slope-bands',
+        type=lambda value: [float(edge) for edge in value.split(',')],
+        default=PointCloudThinning.SLOPE_BANDS,
+        help='Comma separated edges of the slope bands in degrees. '
+             'Default: ' +
+             ','.join(str(edge) for edge in PointCloudThinning.SLOPE_BANDS),
+    )
+    argument_parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=PointCloudThinning.CHUNK_SIZE,
+        help='Number of points read at once. '
+             'Default: ' + str(PointCloudThinning.CHUNK_SIZE),
+    )
+    argument_parser.add_argument(
+        '--workers',
+        type=int,
+        default=int(os.environ.get('SLURM_NTASKS', os.cpu_count())),
+        help='Number of threads processing chunks. '
+             'Default: SLURM_NTASKS or the number of CPUs',
+    )
+    return argument_parser
+
+
+def main():
+    arguments = parser().parse_args()
+
+    PointCloudThinning(
+        arguments.input,
+        arguments.output,
+        voxel_size=arguments.voxel_size,
+        cell_cap=arguments.cell_cap,
+        dem_file=arguments.dem,
+        stable_file=arguments.stable,
+        slope_bands=arguments.slope_bands,
+        chunk_size=arguments.chunk_size,
+        workers=arguments.workers,
+    ).run()
+
+
+if __name__ == '__main__':
+    main()
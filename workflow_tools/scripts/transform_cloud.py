@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+
+from workflow_tools.base import PointCloudTransform
+
+
+def parser():
+    argument_parser = argparse.ArgumentParser(
+        description='Apply a saved pc_align transform to a point cloud, '
+                    'processed in chunks.'
+    )
+    argument_parser.add_argument(
+        '--transform',
+        type=str,
+        help='Path to the pc_align transform, i.e. run-transform.txt',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--input',
+        type=str,
+        help='Path to the LAS or LAZ cloud to transform',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--output',
+        type=str,
+        help='Path to the transformed cloud, compressed for a .laz ending',
+        required=True
+    )
+    argument_parser.add_argument(
+        '--crs',
+        type=str,
+        help='CRS of the cloud, i.e. EPSG:32613. '
+             'Default: From the cloud header',
+    )
+    argument_parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=PointCloudTransform.CHUNK_SIZE,
+        help='Number of points read at once. '
+             'Default: ' + str(PointCloudTransform.CHUNK_SIZE),
+    )
+    argument_parser.add_argument(
+        '--workers',
+        type=int,
+        default=int(os.environ.get('SLURM_NTASKS', os.cpu_count())),
+        help='Number of threads transforming chunks. '
+             'Default: SLURM_NTASKS or the number of CPUs',
+    )
+    return argument_parser
+
+
+def main():
+    arguments = parser().parse_args()
+
+    PointCloudTransform(
+        arguments.transform,
+        arguments.input,
+        arguments.output,
+        crs=arguments.crs,
+        chunk_size=arguments.chunk_size,
+        workers=arguments.workers,
+    ).run()
+
+
+if __name__ == '__main__':
+    main()